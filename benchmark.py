@@ -0,0 +1,282 @@
+#! /usr/bin/env python3
+
+"""eote-dice benchmarks.
+
+Run the suite and save the results as JSON:
+
+    python benchmark.py --output baseline.json
+
+After changing something, compare against the saved results.  The exit status is 1 if any
+benchmark got slower than the threshold allows:
+
+    python benchmark.py --compare baseline.json
+
+The ``startup`` benchmarks run fresh interpreters: ``startup.import`` is the cumulative time
+to import eote_dice as reported by ``python -X importtime``, and ``startup.roll`` the wall
+clock time of ``eote_dice.py --pool yg --roll``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy
+
+from dice import (AbilityDice, BoostDice, ChallengeDice, Dice, DicePool, DifficultyDice,
+                  distribution_cache, ProficiencyDice, SetbackDice)
+import rolls
+
+DICE_CLASSES = (BoostDice, AbilityDice, ProficiencyDice, SetbackDice, DifficultyDice,
+                ChallengeDice)
+
+# Pools of growing size, mixing every color so all four axes are populated.
+POOL_STRINGS = ('ygp', 'yyggprk', 'yyyggbrrppk', 'yyyyggggbrrrppppk', 'yyyyyygggbbrrrrrpppkk')
+SINGLE_COLOR_POOL_STRING = 'y' * 16
+
+DEFAULT_THRESHOLD = 1.25
+
+# Each startup benchmark runs a new interpreter, so they are repeated more times than the
+# others to smooth out the noise.
+STARTUP_REPEAT = 10
+
+_REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_per_call(func: Callable[[], object], min_time: float = 0.2, repeat: int = 3) -> float:
+    """Return the best time per call of ``func`` in seconds, over ``repeat`` runs that each
+    last at least ``min_time`` seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        number = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            number += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / number)
+    return best
+
+
+def _uncached_pool(pool_string: str, exact: bool = True) -> Callable[[], DicePool]:
+    def build():
+        distribution_cache.clear()
+        pool = DicePool.from_string(pool_string, exact=exact)
+        pool.distribution
+        return pool
+    return build
+
+
+def import_time(module: str = 'eote_dice') -> float:
+    """Return the cumulative time in seconds to import ``module`` in a fresh interpreter, as
+    reported by ``python -X importtime``."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                             cwd=_REPO_DIRECTORY, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+    # Lines look like "import time:  self [us] | cumulative | imported package".
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError('No import time reported for {}.'.format(module))
+
+
+def _run_eote_dice(*args: str) -> Callable[[], None]:
+    def run():
+        subprocess.run([sys.executable, 'eote_dice.py'] + list(args), cwd=_REPO_DIRECTORY,
+                       stdout=subprocess.DEVNULL, check=True)
+    return run
+
+
+def startup_benchmarks(repeat: int = STARTUP_REPEAT) -> List[Tuple[str, Callable[[], float]]]:
+    """Return (name, function returning the best time in seconds) for every startup
+    benchmark."""
+    return [
+        ('startup.import', lambda: min(import_time() for _ in range(repeat))),
+        ('startup.roll', lambda: time_per_call(_run_eote_dice('--pool', 'yg', '--roll'),
+                                               min_time=0.0, repeat=repeat)),
+    ]
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], object], int]]:
+    """Return (name, function, operations per call) for every benchmark."""
+    cases = []
+
+    # Standard dice are shared instances that build their distribution on first use, so build
+    # a new plain die from the same sides each time.
+    for dice_class in DICE_CLASSES:
+        cases.append(('dice_init.{}'.format(dice_class.__name__),
+                      lambda sides=dice_class.SIDES: Dice(sides).distribution, 1))
+
+    for pool_string in POOL_STRINGS:
+        distribution = _uncached_pool(pool_string)().distribution
+        die_distribution = ProficiencyDice().distribution
+        cases.append(('add.{}'.format(len(pool_string)),
+                      lambda d=distribution: d.add(die_distribution), 1))
+
+    # Many dice of one color, which is stored sparsely.
+    distribution = _uncached_pool(SINGLE_COLOR_POOL_STRING)().distribution
+    cases.append(('add.sparse.{}'.format(len(SINGLE_COLOR_POOL_STRING)),
+                  lambda: distribution.add(die_distribution), 1))
+    cases.append(('from_string.sparse.{}'.format(len(SINGLE_COLOR_POOL_STRING)),
+                  _uncached_pool(SINGLE_COLOR_POOL_STRING), 1))
+
+    for pool_string in POOL_STRINGS:
+        cases.append(('from_string.exact.{}'.format(len(pool_string)),
+                      _uncached_pool(pool_string), 1))
+        cases.append(('from_string.float.{}'.format(len(pool_string)),
+                      _uncached_pool(pool_string, exact=False), 1))
+
+    def marginal(pool_string, cutoff):
+        def build():
+            distribution_cache.clear()
+            return DicePool.from_string(pool_string).probability_above(*cutoff)
+        return build
+
+    for pool_string in POOL_STRINGS:
+        cases.append(('marginal.success.{}'.format(len(pool_string)),
+                      marginal(pool_string, (None, 1, None, None)), 1))
+        cases.append(('marginal.success_advantage.{}'.format(len(pool_string)),
+                      marginal(pool_string, (None, 1, 1, None)), 1))
+
+    queries = 100
+    pool = _uncached_pool(POOL_STRINGS[-1])()
+    cutoffs = [(t, s, a, d) for t in (None, 1) for s in (None, 0, 2, 4)
+               for a in (None, -1, 1, 3) for d in (None, 1)]
+
+    def probability_above():
+        for i in range(queries):
+            triumph, success, advantage, despair = cutoffs[i % len(cutoffs)]
+            pool.probability_above(triumph, success, advantage, despair)
+
+    def mean():
+        for _ in range(queries):
+            pool.mean()
+
+    cases.append(('probability_above', probability_above, queries))
+    cases.append(('mean', mean, queries))
+
+    num_rolls = 100
+    cases.append(('roll', lambda: [pool.roll() for _ in range(num_rolls)], num_rolls))
+    cases.append(('roll_ascii', lambda: [pool.roll_ascii() for _ in range(num_rolls)], num_rolls))
+    rng = numpy.random.default_rng(0)
+    cases.append(('roll_many', lambda: pool.roll_many(10000, rng), 10000))
+
+    def write_rolls(format):
+        def write():
+            with open(os.devnull, 'wb') as output:
+                rolls.write_rolls(pool, 100000, output, format, rng)
+        return write
+
+    for format in rolls.FORMATS:
+        cases.append(('write_rolls.{}'.format(format), write_rolls(format), 100000))
+    return cases
+
+
+def run_benchmarks(min_time: float = 0.2, repeat: int = 3,
+                   pattern: str = '') -> Dict[str, Dict[str, float]]:
+    random.seed(0)
+    results = {}
+    for name, func, operations in benchmarks():
+        if pattern not in name:
+            continue
+        seconds = time_per_call(func, min_time, repeat) / operations
+        _record(results, name, seconds)
+    for name, func in startup_benchmarks():
+        if pattern not in name:
+            continue
+        _record(results, name, func())
+    return results
+
+
+def _record(results: Dict[str, Dict[str, float]], name: str, seconds: float) -> None:
+    results[name] = {'seconds': seconds, 'ops_per_second': 1 / seconds}
+    print('{:<28} {:>14.3f} us  {:>14.1f} ops/s'.format(name, seconds * 1e6, 1 / seconds),
+          file=sys.stderr)
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[str, float]]:
+    """Return (name, slowdown) for each benchmark more than ``threshold`` times slower than
+    in ``baseline``."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        slowdown = result['seconds'] / baseline[name]['seconds']
+        if slowdown > threshold:
+            regressions.append((name, slowdown))
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks eote-dice.')
+    parser.add_argument('-o',
+                        '--output',
+                        type=str,
+                        help='Write the results as JSON to this file (default: stdout).')
+    parser.add_argument('-c',
+                        '--compare',
+                        type=str,
+                        help='Baseline JSON results to check for regressions against.')
+    parser.add_argument('-t',
+                        '--threshold',
+                        type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help='Slowdown relative to the baseline that counts as a regression '
+                             '(default: {}).'.format(DEFAULT_THRESHOLD))
+    parser.add_argument('-k',
+                        '--filter',
+                        type=str,
+                        default='',
+                        help='Only run benchmarks whose name contains this string.')
+    parser.add_argument('--min-time',
+                        type=float,
+                        default=0.2,
+                        help='Minimum time in seconds to run each repetition of a benchmark.')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='Number of repetitions, the best one is reported.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_arguments()
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+        },
+        'benchmarks': run_benchmarks(args.min_time, args.repeat, args.filter),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results['benchmarks'], baseline['benchmarks'], args.threshold)
+        for name, slowdown in regressions:
+            print('REGRESSION {}: {:.2f}x slower than baseline'.format(name, slowdown),
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
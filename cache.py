@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""In-memory and on-disk caches of dice pool distributions.
+
+numpy and the distribution module are only imported once the disk cache is used, so that
+importing dice stays fast.
+"""
+
+import collections
+import os
+import struct
+import threading
+from typing import Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from distribution import QuadDistribution
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+
+# File layout: a header (magic, dtype, number of axes), the offset and shape of every axis as
+# little-endian int64, then the raw little-endian counts starting at a 64-byte boundary.
+_MAGIC = b'EOTEDST1'
+_HEADER = struct.Struct('<8s2sB5x')
+_DTYPES = {b'i8': '<i8', b'f8': '<f8'}
+_SUFFIX = '.dist'
+
+
+class DistributionCache:
+    """Bounded LRU cache of distributions keyed by canonical pool string (e.g. ``'yygpp'``).
+
+    Exact and float (normalized) distributions of the same pool are cached separately, as are
+    marginal distributions of some of the axes (see QuadDistribution.marginal()).
+
+    The size of the cache is bounded by the approximate memory used by the cached
+    distributions rather than by the number of entries.  It is safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._nbytes = 0
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, pool_string: str) -> bool:
+        return ((pool_string, True, None) in self._entries or
+                (pool_string, False, None) in self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    def resize(self, max_bytes: int) -> None:
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, pool_string: str, exact: bool = True,
+            axes: Tuple[int, ...] = None) -> Optional['QuadDistribution']:
+        """Return the cached distribution, of just ``axes`` if given, or None."""
+        key = (pool_string, exact, axes)
+        with self._lock:
+            try:
+                distribution, _, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return distribution
+
+    def put(self, pool_string: str, distribution: 'QuadDistribution',
+            axes: Tuple[int, ...] = None) -> None:
+        key = (pool_string, distribution.exact, axes)
+        nbytes = distribution.nbytes
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+
+            if nbytes > self._max_bytes:
+                return
+            self._entries[key] = (distribution, nbytes, collections.Counter(pool_string))
+            self._nbytes += nbytes
+            self._evict()
+
+    def longest_sub_pool(self, pool_string: str, exact: bool = True,
+                         axes: Tuple[int, ...] = None) -> Tuple[str, Optional['QuadDistribution']]:
+        """Return the largest cached pool whose dice are all contained in ``pool_string``, with
+        the same mode and axes.
+
+        Returns ``('', None)`` if no cached pool is contained in it.
+        """
+        color_counts = collections.Counter(pool_string)
+        best_pool_string = ''
+        best_distribution = None
+        with self._lock:
+            for (sub_pool_string, sub_exact, sub_axes), (distribution, _, sub_color_counts) in (
+                    self._entries.items()):
+                if (sub_exact == exact and sub_axes == axes and
+                        len(sub_pool_string) > len(best_pool_string) and
+                        all(color_counts[color] >= count
+                            for color, count in sub_color_counts.items())):
+                    best_pool_string = sub_pool_string
+                    best_distribution = distribution
+
+            if best_distribution is not None:
+                self._entries.move_to_end((best_pool_string, exact, axes))
+        return best_pool_string, best_distribution
+
+    def _evict(self) -> None:
+        while self._nbytes > self._max_bytes:
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+
+
+def default_cache_directory() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                  '.cache')
+    return os.path.join(cache_home, 'eote-dice')
+
+
+class DiskCache:
+    """Distributions stored on disk, so they are shared between processes and runs.
+
+    Files are named after the canonical pool string, the mode (exact or float), the axes of a
+    marginal distribution and ``version``, a hash of the die definitions, so changing a die
+    never reads stale results.  Cached files are memory-mapped when read.  Writers create a
+    temporary file and atomically rename it into place, so concurrent processes never see a
+    partial file.  Once the directory grows beyond ``max_bytes`` the least recently used files
+    are deleted.
+
+    Exact distributions whose counts no longer fit in int64 are not stored.
+    """
+
+    def __init__(self, version: str, directory: str = None,
+                 max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        self.version = version
+        self.directory = default_cache_directory() if directory is None else directory
+        self.max_bytes = max_bytes
+
+    def path(self, pool_string: str, exact: bool = True, axes: Tuple[int, ...] = None) -> str:
+        marginal = '' if axes is None else '-axes{}'.format(''.join(str(axis) for axis in axes))
+        return os.path.join(self.directory, '{}-{}{}-{}{}'.format(
+            pool_string, 'exact' if exact else 'float', marginal, self.version, _SUFFIX))
+
+    def get(self, pool_string: str, exact: bool = True,
+            axes: Tuple[int, ...] = None) -> Optional['QuadDistribution']:
+        """Return the stored distribution, of just ``axes`` if given, or None."""
+        import numpy
+
+        from distribution import QuadDistribution
+
+        path = self.path(pool_string, exact, axes)
+        try:
+            with open(path, 'rb') as f:
+                magic, dtype_code, ndim = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC or dtype_code not in _DTYPES:
+                    raise ValueError('Not a distribution file: {}'.format(path))
+                layout = numpy.frombuffer(f.read(16 * ndim), dtype='<i8').reshape(2, ndim)
+            offset, shape = layout
+            counts = numpy.memmap(path, dtype=_DTYPES[dtype_code], mode='r',
+                                  offset=_data_offset(ndim), shape=tuple(shape))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error):
+            # Truncated or corrupt, most likely left behind by a crash.
+            self._remove(path)
+            return None
+        try:
+            # Mark the file as recently used for eviction.
+            os.utime(path)
+        except OSError:
+            # A read-only or shared directory: the file is still good to read.
+            pass
+        return QuadDistribution.from_array(counts, offset)
+
+    def put(self, pool_string: str, distribution: 'QuadDistribution',
+            axes: Tuple[int, ...] = None) -> None:
+        import tempfile
+
+        import numpy
+
+        counts = distribution.counts
+        if counts.dtype == object:
+            return
+        dtype_code = b'f8' if counts.dtype == numpy.float64 else b'i8'
+        ndim = counts.ndim
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, dtype_code, ndim))
+                f.write(numpy.array([distribution.offset, counts.shape], dtype='<i8').tobytes())
+                f.write(b'\0' * (_data_offset(ndim) - f.tell()))
+                f.write(numpy.ascontiguousarray(counts, dtype=_DTYPES[dtype_code]).tobytes())
+            os.replace(temp_path, self.path(pool_string, distribution.exact, axes))
+        except BaseException:
+            self._remove(temp_path)
+            raise
+        self._evict()
+
+    def clear(self) -> None:
+        for path, _ in self._files():
+            self._remove(path)
+
+    def _files(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            if name.endswith(_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    files.append((path, os.stat(path)))
+                except FileNotFoundError:
+                    # Evicted by another process.
+                    pass
+        return files
+
+    def _evict(self) -> None:
+        files = self._files()
+        nbytes = sum(stat.st_size for _, stat in files)
+        for path, stat in sorted(files, key=lambda file: file[1].st_mtime):
+            if nbytes <= self.max_bytes:
+                break
+            self._remove(path)
+            nbytes -= stat.st_size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process, not ours to remove, or still memory-mapped
+            # on Windows.  Eviction tries again later.
+            pass
+
+
+def _data_offset(ndim: int) -> int:
+    header_size = _HEADER.size + 16 * ndim
+    return (header_size + 63) // 64 * 64
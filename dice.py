@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 
-"""Statical distribution needed for analyzing EotE dice."""
+"""Statical distribution needed for analyzing EotE dice.
+
+numpy, colorama and the distribution module are imported where they are first needed, so that
+rolling from the command line starts quickly.
+"""
 
 import collections
 import enum
+import functools
 import random
-from typing import List, Sequence, Tuple
+from typing import Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING, Union
+
+from cache import DEFAULT_DISK_MAX_BYTES, DiskCache, DistributionCache
 
-import colorama
+if TYPE_CHECKING:  # pragma: no cover
+    import fractions
 
-from distribution import QuadDistribution
+    import numpy
+
+    from distribution import QuadDistribution
 
 
 @enum.unique
@@ -22,20 +32,50 @@ class Symbol(enum.Enum):
     Failure = 'f'
     Threat = 'r'
 
+    # Force points.
+    Light = 'l'
+    Dark = 'd'
+
 
-symbol_to_ansi = {
-    Symbol.Triumph: colorama.Fore.YELLOW,
-    Symbol.Success: colorama.Fore.GREEN,
-    Symbol.Advantage: colorama.Fore.CYAN,
-    Symbol.Despair: colorama.Fore.RED,
-    Symbol.Failure: colorama.Fore.MAGENTA,
-    Symbol.Threat: colorama.Fore.BLACK + colorama.Back.WHITE,
-}
+# The axes of a net outcome.  Pool distributions have the first four: the light and dark side
+# points of Force dice are independent of them, and only convolved for queries that ask for
+# them (see DicePool.marginal_distribution()).
+AXES = ('triumph', 'success', 'advantage', 'despair', 'light', 'dark')
+NET_AXES = (0, 1, 2, 3)
+FORCE_AXES = (4, 5)
+
+# Axes that are never negative, so a cutoff of 0 or less on them is no constraint.
+NON_NEGATIVE_AXES = (0, 3, 4, 5)
+
+# Maps a count of each Symbol (in Symbol order) to the net outcome along each of AXES.
+# Triumph also counts as a success and Despair as a failure.
+symbol_to_net = (
+    (1, 1, 0, 0, 0, 0),  # Triumph
+    (0, 1, 0, 0, 0, 0),  # Success
+    (0, 0, 1, 0, 0, 0),  # Advantage
+    (0, -1, 0, 1, 0, 0),  # Despair
+    (0, -1, 0, 0, 0, 0),  # Failure
+    (0, 0, -1, 0, 0, 0),  # Threat
+    (0, 0, 0, 0, 1, 0),  # Light
+    (0, 0, 0, 0, 0, 1),  # Dark
+)
+
+# Rolls drawn at a time by DicePool.roll_stream().
+ROLL_BATCH_SIZE = 65536
 
 
 class Side:
+    """An immutable side of a die, with its symbols counted once up front."""
+
+    __slots__ = ('_symbols', '_symbol_counts', '_outcome', '_net')
+
     def __init__(self, symbols: Sequence[Symbol]):
-        self._symbols = symbols
+        self._symbols = tuple(symbols)
+        self._symbol_counts = tuple(self.count_symbol(symbol) for symbol in Symbol)
+        self._outcome = tuple(sum(count * net
+                                  for count, net in zip(self._symbol_counts, axis_net))
+                              for axis_net in zip(*symbol_to_net))
+        self._net = self._outcome[:len(NET_AXES)]
 
     def count_symbol(self, symbol: Symbol) -> int:
         n = 0
@@ -45,28 +85,89 @@ class Side:
         return n
 
     @property
-    def symbols(self):
+    def symbols(self) -> Tuple[Symbol, ...]:
         return self._symbols
 
+    @property
+    def symbol_counts(self) -> Tuple[int, ...]:
+        """Number of each Symbol on the side, in Symbol order."""
+        return self._symbol_counts
 
-class Dice:
-    def __init__(self, sides: Sequence[Side]):
-        self._sides = sides
+    @property
+    def net(self) -> Tuple[int, int, int, int]:
+        """Net (triumph, success, advantage, despair) of the side."""
+        return self._net
+
+    @property
+    def outcome(self) -> Tuple[int, ...]:
+        """Net outcome of the side along every axis of AXES, including Force points."""
+        return self._outcome
+
+
+# One shared instance of each standard die class, created on first use.
+_shared_dice = {}
 
-        mapping = collections.defaultdict(int)
-        for side in sides:
-            side_triumph = side.count_symbol(Symbol.Triumph)
-            side_success = (side.count_symbol(Symbol.Success) +
-                            side.count_symbol(Symbol.Triumph) +
-                            (-1 * side.count_symbol(Symbol.Failure)) +
-                            (-1 * side.count_symbol(Symbol.Despair)))
-            side_advantage = (side.count_symbol(Symbol.Advantage) +
-                              (-1 * side.count_symbol(Symbol.Threat)))
-            side_despair = side.count_symbol(Symbol.Despair)
 
-            mapping[(side_triumph, side_success, side_advantage, side_despair)] += 1
+class Dice:
+    """An immutable die.
+
+    The standard dice define their sides in ``SIDES`` and are flyweights: every
+    ``ProficiencyDice()`` is the same object, so their face tables and distributions are
+    only computed once per process.  Custom dice are built with ``Dice(sides)``.
+    """
+
+    __slots__ = ('_sides', '_face_table', '_distribution', '_marginals', '_mean')
+
+    SIDES = None  # type: Tuple[Side, ...]
+
+    def __new__(cls, sides: Sequence[Side] = None):
+        if sides is None:
+            try:
+                return _shared_dice[cls]
+            except KeyError:
+                dice = _shared_dice[cls] = super().__new__(cls)._init(cls.SIDES)
+                return dice
+        if cls.SIDES is not None:
+            # Pools and caches identify the standard dice by class, so their sides are fixed.
+            raise TypeError('{} has fixed sides; use Dice(sides) for a custom die.'.format(
+                cls.__name__))
+        return super().__new__(cls)._init(sides)
+
+    def _init(self, sides: Sequence[Side]) -> 'Dice':
+        self._sides = tuple(sides)
+        self._face_table = None
+        self._distribution = None
+        self._marginals = {}
+        self._mean = None
+        return self
 
-        self.distribution = QuadDistribution(mapping)
+    @property
+    def distribution(self) -> 'QuadDistribution':
+        if self._distribution is None:
+            from distribution import QuadDistribution
+            self._distribution = QuadDistribution(collections.Counter(
+                side.net for side in self._sides))
+        return self._distribution
+
+    def marginal_distribution(self, axes: Tuple[int, ...]) -> 'QuadDistribution':
+        """Return the distribution of just ``axes`` of AXES, in increasing order."""
+        if axes == NET_AXES:
+            return self.distribution
+        try:
+            return self._marginals[axes]
+        except KeyError:
+            from distribution import QuadDistribution
+            distribution = self._marginals[axes] = QuadDistribution(collections.Counter(
+                tuple(side.outcome[axis] for axis in axes) for side in self._sides))
+            return distribution
+
+    def mean(self) -> Tuple['fractions.Fraction', ...]:
+        """Return the exact mean net outcome of a roll along every axis of AXES."""
+        if self._mean is None:
+            import fractions
+            self._mean = tuple(fractions.Fraction(sum(axis_net), len(self._sides))
+                               for axis_net in zip(*(side.outcome for side in self._sides)))
+        return self._mean
 
     def num_sides(self) -> int:
         return len(self._sides)
@@ -74,93 +175,129 @@ class Dice:
     def roll(self) -> Sequence[Symbol]:
         return random.choice(self._sides).symbols
 
+    def face_table(self) -> 'numpy.ndarray':
+        """Return a read-only ``(num_sides, len(Symbol))`` array counting each Symbol on each
+        side."""
+        if self._face_table is None:
+            import numpy
+            face_table = numpy.array([side.symbol_counts for side in self._sides],
+                                     dtype=numpy.int16).reshape(-1, len(Symbol))
+            face_table.setflags(write=False)
+            self._face_table = face_table
+        return self._face_table
+
 
 class BoostDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
-            Side(symbols=[Symbol.Advantage]),
-            Side(symbols=[Symbol.Success, Symbol.Advantage]),
-            Side(symbols=[Symbol.Success])
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
+        Side(symbols=[Symbol.Advantage]),
+        Side(symbols=[Symbol.Success, Symbol.Advantage]),
+        Side(symbols=[Symbol.Success])
+    )
 
 
 class AbilityDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Success]),
-            Side(symbols=[Symbol.Success]),
-            Side(symbols=[Symbol.Success, Symbol.Success]),
-            Side(symbols=[Symbol.Advantage]),
-            Side(symbols=[Symbol.Advantage]),
-            Side(symbols=[Symbol.Success, Symbol.Advantage]),
-            Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Success]),
+        Side(symbols=[Symbol.Success]),
+        Side(symbols=[Symbol.Success, Symbol.Success]),
+        Side(symbols=[Symbol.Advantage]),
+        Side(symbols=[Symbol.Advantage]),
+        Side(symbols=[Symbol.Success, Symbol.Advantage]),
+        Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
+    )
 
 
 class ProficiencyDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Success]),
-            Side(symbols=[Symbol.Success]),
-            Side(symbols=[Symbol.Success, Symbol.Success]),
-            Side(symbols=[Symbol.Success, Symbol.Success]),
-            Side(symbols=[Symbol.Advantage]),
-            Side(symbols=[Symbol.Success, Symbol.Advantage]),
-            Side(symbols=[Symbol.Success, Symbol.Advantage]),
-            Side(symbols=[Symbol.Success, Symbol.Advantage]),
-            Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
-            Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
-            Side(symbols=[Symbol.Triumph]),
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Success]),
+        Side(symbols=[Symbol.Success]),
+        Side(symbols=[Symbol.Success, Symbol.Success]),
+        Side(symbols=[Symbol.Success, Symbol.Success]),
+        Side(symbols=[Symbol.Advantage]),
+        Side(symbols=[Symbol.Success, Symbol.Advantage]),
+        Side(symbols=[Symbol.Success, Symbol.Advantage]),
+        Side(symbols=[Symbol.Success, Symbol.Advantage]),
+        Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
+        Side(symbols=[Symbol.Advantage, Symbol.Advantage]),
+        Side(symbols=[Symbol.Triumph]),
+    )
 
 
 class SetbackDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Failure]),
-            Side(symbols=[Symbol.Failure]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Threat])
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Failure]),
+        Side(symbols=[Symbol.Failure]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Threat])
+    )
 
 
 class DifficultyDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Failure]),
-            Side(symbols=[Symbol.Failure, Symbol.Failure]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Threat, Symbol.Threat]),
-            Side(symbols=[Symbol.Failure, Symbol.Threat])
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Failure]),
+        Side(symbols=[Symbol.Failure, Symbol.Failure]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Threat, Symbol.Threat]),
+        Side(symbols=[Symbol.Failure, Symbol.Threat])
+    )
 
 
 class ChallengeDice(Dice):
-    def __init__(self):
-        super().__init__(sides=[
-            Side(symbols=[]),
-            Side(symbols=[Symbol.Failure]),
-            Side(symbols=[Symbol.Failure]),
-            Side(symbols=[Symbol.Failure, Symbol.Failure]),
-            Side(symbols=[Symbol.Failure, Symbol.Failure]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Threat]),
-            Side(symbols=[Symbol.Failure, Symbol.Threat]),
-            Side(symbols=[Symbol.Failure, Symbol.Threat]),
-            Side(symbols=[Symbol.Threat, Symbol.Threat]),
-            Side(symbols=[Symbol.Threat, Symbol.Threat]),
-            Side(symbols=[Symbol.Despair])
-        ])
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[]),
+        Side(symbols=[Symbol.Failure]),
+        Side(symbols=[Symbol.Failure]),
+        Side(symbols=[Symbol.Failure, Symbol.Failure]),
+        Side(symbols=[Symbol.Failure, Symbol.Failure]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Threat]),
+        Side(symbols=[Symbol.Failure, Symbol.Threat]),
+        Side(symbols=[Symbol.Failure, Symbol.Threat]),
+        Side(symbols=[Symbol.Threat, Symbol.Threat]),
+        Side(symbols=[Symbol.Threat, Symbol.Threat]),
+        Side(symbols=[Symbol.Despair])
+    )
+
+
+class ForceDice(Dice):
+    __slots__ = ()
+
+    SIDES = (
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark]),
+        Side(symbols=[Symbol.Dark, Symbol.Dark]),
+        Side(symbols=[Symbol.Light]),
+        Side(symbols=[Symbol.Light]),
+        Side(symbols=[Symbol.Light, Symbol.Light]),
+        Side(symbols=[Symbol.Light, Symbol.Light]),
+        Side(symbols=[Symbol.Light, Symbol.Light]),
+    )
 
 
 @enum.unique
@@ -171,6 +308,7 @@ class DiceColor(enum.Enum):
     k = SetbackDice
     p = DifficultyDice
     r = ChallengeDice
+    w = ForceDice
 
     @classmethod
     def names(cls) -> List[str]:
@@ -190,24 +328,92 @@ def dice_from_color_char(color_char: str) -> Dice:
     return dice_color.value()
 
 
-dice_color_to_ansi = {
-    DiceColor.y: colorama.Fore.YELLOW,
-    DiceColor.g: colorama.Fore.GREEN,
-    DiceColor.b: colorama.Fore.CYAN,
-    DiceColor.r: colorama.Fore.RED,
-    DiceColor.p: colorama.Fore.MAGENTA,
-    DiceColor.k: colorama.Fore.BLACK + colorama.Back.WHITE,
-}
+# Dice that upgrade into each other, as (lower, upper).
+UPGRADES = ((DiceColor.g, DiceColor.y), (DiceColor.p, DiceColor.r))
+
+
+@functools.lru_cache(maxsize=None)
+def _ansi_colors() -> Tuple[dict, dict]:
+    """Return the ``(symbol_to_ansi, dice_color_to_ansi)`` color codes.
+
+    Built on first use, so that colorama is only imported when printing in color.
+    """
+    import colorama
+    symbol_to_ansi = {
+        Symbol.Triumph: colorama.Fore.YELLOW,
+        Symbol.Success: colorama.Fore.GREEN,
+        Symbol.Advantage: colorama.Fore.CYAN,
+        Symbol.Despair: colorama.Fore.RED,
+        Symbol.Failure: colorama.Fore.MAGENTA,
+        Symbol.Threat: colorama.Fore.BLACK + colorama.Back.WHITE,
+        Symbol.Light: colorama.Fore.WHITE,
+        Symbol.Dark: colorama.Fore.BLACK + colorama.Back.WHITE,
+    }
+    dice_color_to_ansi = {
+        DiceColor.y: colorama.Fore.YELLOW,
+        DiceColor.g: colorama.Fore.GREEN,
+        DiceColor.b: colorama.Fore.CYAN,
+        DiceColor.r: colorama.Fore.RED,
+        DiceColor.p: colorama.Fore.MAGENTA,
+        DiceColor.k: colorama.Fore.BLACK + colorama.Back.WHITE,
+        DiceColor.w: colorama.Fore.WHITE,
+    }
+    return symbol_to_ansi, dice_color_to_ansi
+
+
+def __getattr__(name: str):
+    # Keep symbol_to_ansi and dice_color_to_ansi importable without importing colorama
+    # up front.  Module __getattr__ (PEP 562) is why Python 3.7 is required.
+    if name == 'symbol_to_ansi':
+        return _ansi_colors()[0]
+    if name == 'dice_color_to_ansi':
+        return _ansi_colors()[1]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+# Process-wide cache of pool distributions, shared by every DicePool.
+distribution_cache = DistributionCache()
+
+# Optional cache of pool distributions shared between processes, see use_disk_cache().
+disk_cache = None  # type: Optional[DiskCache]
+
+# Optional precomputed table answering queries without building distributions, see
+# table.use_pool_table().
+pool_table = None
+
+
+def dice_definitions_hash() -> str:
+    """Return a hash of the sides of every standard die, to version cached distributions."""
+    import hashlib
+    digest = hashlib.sha256()
+    for dice_color in DiceColor:
+        digest.update(dice_color.name.encode())
+        for side in dice_color.value.SIDES:
+            digest.update(''.join(symbol.value for symbol in side.symbols).encode() + b'|')
+    return digest.hexdigest()[:16]
+
+
+def use_disk_cache(directory: str = None,
+                   max_bytes: int = DEFAULT_DISK_MAX_BYTES) -> DiskCache:
+    """Store pool distributions on disk (by default under ``$XDG_CACHE_HOME/eote-dice``)
+    and read them back in later runs instead of rebuilding them."""
+    global disk_cache
+    disk_cache = DiskCache(dice_definitions_hash(), directory, max_bytes)
+    return disk_cache
 
 
 class DicePoolMean:
-    def __init__(self, mean: Tuple[float, float, float, float]):
+    def __init__(self, mean: Tuple[float, ...]):
+        """``mean`` has an entry per axis of AXES."""
         self.triumph = mean[0]
         self.success = mean[1]
         self.advantage = mean[2]
         self.despair = mean[3]
+        self.light = mean[4]
+        self.dark = mean[5]
 
     def __str__(self):  # pragma: no cover
+        import colorama
         if self.triumph > 0.0:
             triumph_color = colorama.Fore.GREEN
         else:
@@ -232,11 +438,18 @@ class DicePoolMean:
         else:
             despair_color = colorama.Fore.RESET
 
+        if self.light > 0.0 or self.dark > 0.0:
+            force = '\n\tLight: {}\n\tDark: {}'.format(
+                round(self.light, 2), round(self.dark, 2))
+        else:
+            # Only pools with Force dice show Force points.
+            force = ''
+
         return ('{9}Mean:\n'
                 '\tTriumph: {5}{0}{4}\n'
                 '\tSuccess: {6}{1}{4}\n'
                 '\tAdvantage: {7}{2}{4}\n'
-                '\tDespair: {8}{3}{4}'.format(
+                '\tDespair: {8}{3}{4}{10}'.format(
                     round(self.triumph, 2),
                     round(self.success, 2),
                     round(self.advantage, 2),
@@ -246,29 +459,380 @@ class DicePoolMean:
                     success_color,
                     advantage_color,
                     despair_color,
-                    colorama.Style.BRIGHT))
+                    colorama.Style.BRIGHT,
+                    force))
+
+
+# How one change to a pool, such as adding a die, changes its statistics (see
+# DicePool.sensitivity()).
+PoolChange = collections.namedtuple('PoolChange', [
+    # 'add', 'remove' or 'upgrade'.
+    'action',
+    # Color of the die added, removed or upgraded.
+    'color',
+    # The changed pool, as a canonical pool string, or None if it has non-standard dice.
+    'pool',
+    # Change of the mean (triumph, success, advantage, despair).
+    'mean',
+    # Change of probability_above() of each cutoff.
+    'probability_above',
+])
 
 
 class DicePool:
-    def __init__(self, pool: Sequence[Dice]):
+    # Whether pools compute exact integer frequencies (True) or float64 probabilities (False)
+    # when not chosen per pool.  Float probabilities are much faster for large pools, see
+    # QuadDistribution.normalized() for their error bounds.
+    default_exact = True
+
+    def __init__(self, pool: Sequence[Dice], exact: bool = None):
         self._pool = pool
+        self.exact = self.default_exact if exact is None else exact
+        self._distribution = None
+        self._force_mean = None
 
-        self.distribution = QuadDistribution()
-        for dice in self._pool:
-            self.distribution = self.distribution.add(dice.distribution)
+    @property
+    def dice(self) -> Tuple[Dice, ...]:
+        return tuple(self._pool)
+
+    @property
+    def distribution(self) -> 'QuadDistribution':
+        """The distribution of the pool, built or fetched from the caches on first use."""
+        if self._distribution is None:
+            self._distribution = self._cached_distribution(self._pool, self.exact)
+        return self._distribution
+
+    def marginal_distribution(self, axes: Sequence[int]) -> 'QuadDistribution':
+        """Return the distribution of just ``axes`` of AXES (0 for triumph, 1 success,
+        2 advantage, 3 despair, 4 light and 5 dark).
+
+        Unless the full distribution is already built, only those axes are convolved, which is
+        much cheaper for one or two axes.  Marginals are cached like full distributions.
+        """
+        axes = tuple(sorted(set(axes)))
+        if axes[-1] < len(NET_AXES) and (self._distribution is not None or axes == NET_AXES):
+            return self.distribution.marginal(axes)
+        return self._cached_distribution(self._pool, self.exact, axes)
 
     def probability_above(self,
                           triumph_cutoff: int = None,
                           success_cutoff: int = None,
                           advantage_cutoff: int = None,
-                          despair_cutoff: int = None) -> float:
-        return self.distribution.probability_above(cutoff=(triumph_cutoff,
-                                                           success_cutoff,
-                                                           advantage_cutoff,
-                                                           despair_cutoff))
+                          despair_cutoff: int = None,
+                          light_cutoff: int = None,
+                          dark_cutoff: int = None) -> float:
+        cutoff = (triumph_cutoff, success_cutoff, advantage_cutoff, despair_cutoff)
+        if light_cutoff is None and dark_cutoff is None:
+            if self._distribution is not None:
+                return self._distribution.probability_above(cutoff=cutoff)
+            if pool_table is not None:
+                probability = pool_table.probability_above(
+                    self._canonical_pool_string(self._pool), cutoff)
+                if probability is not None:
+                    return probability
+        cutoff += (light_cutoff, dark_cutoff)
+
+        # Only convolve the axes the cutoffs constrain.
+        axes = [axis for axis, cut in enumerate(cutoff)
+                if cut is not None and not (axis in NON_NEGATIVE_AXES and cut <= 0)]
+        if not axes:
+            return 1.0
+        return self.marginal_distribution(axes).probability_above(
+            cutoff=tuple(cutoff[axis] for axis in axes))
+
+    def probability_grid(self,
+                         triumph_cutoffs: Sequence[int] = None,
+                         success_cutoffs: Sequence[int] = None,
+                         advantage_cutoffs: Sequence[int] = None,
+                         despair_cutoffs: Sequence[int] = None,
+                         light_cutoffs: Sequence[int] = None,
+                         dark_cutoffs: Sequence[int] = None) -> 'numpy.ndarray':
+        """Return probability_above() for every combination of the given cutoffs at once.
+
+        The result has one dimension per axis given cutoffs, e.g.
+        ``grid = pool.probability_grid(success_cutoffs=range(-2, 6),
+        advantage_cutoffs=range(-3, 4))`` gives ``grid[i, j]``, the probability of at least
+        ``i - 2`` success and ``j - 3`` advantage.  Only those axes are convolved unless the
+        full distribution is already built.
+        """
+        cutoffs = (triumph_cutoffs, success_cutoffs, advantage_cutoffs, despair_cutoffs,
+                   light_cutoffs, dark_cutoffs)
+        cutoffs = [None if axis_cutoffs is None else list(axis_cutoffs)
+                   for axis_cutoffs in cutoffs]
+        axes = [axis for axis, axis_cutoffs in enumerate(cutoffs) if axis_cutoffs is not None]
+        if not axes or (self._distribution is not None and axes[-1] < len(NET_AXES)):
+            return self.distribution.probability_grid(cutoffs[:len(NET_AXES)])
+        return self.marginal_distribution(axes).probability_grid(
+            [cutoffs[axis] for axis in axes])
 
     def mean(self) -> DicePoolMean:
-        return DicePoolMean(self.distribution.mean())
+        if self._force_mean is None:
+            self._force_mean = self._dice_mean(FORCE_AXES)
+        if self._distribution is not None:
+            return DicePoolMean(self._distribution.mean() + self._force_mean)
+        if pool_table is not None:
+            mean = pool_table.mean(self._canonical_pool_string(self._pool))
+            if mean is not None:
+                return DicePoolMean(mean + self._force_mean)
+        return DicePoolMean(self._dice_mean(NET_AXES) + self._force_mean)
+
+    def _axis_distribution(self, axis: int) -> Tuple['QuadDistribution', int]:
+        """Return a distribution with ``axis`` of AXES, and the index of that axis in it.
+
+        That is the pool's distribution if it is built, so that its statistics of every axis
+        come from one pass over it, and otherwise the cheaper marginal of just ``axis``.
+        """
+        if not 0 <= axis < len(AXES):
+            raise ValueError('Invalid axis: {}.  Valid axes: 0 to {} ({})'.format(
+                axis, len(AXES) - 1, ', '.join(AXES)))
+        if axis < len(NET_AXES) and self._distribution is not None:
+            return self._distribution, axis
+        return self.marginal_distribution((axis,)), 0
+
+    def histogram(self, axis: int) -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+        """Return the ``(values, probabilities)`` arrays of the net result along ``axis`` of
+        AXES, from its lowest to its highest value."""
+        distribution, index = self._axis_distribution(axis)
+        return distribution.histogram(index)
+
+    def cdf(self, axis: int) -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+        """Return the ``(values, probabilities)`` arrays of the probability of at most each
+        net result along ``axis`` of AXES."""
+        distribution, index = self._axis_distribution(axis)
+        return distribution.cdf(index)
+
+    def quantile(self, q, axis: int) -> 'numpy.ndarray':
+        """Return the smallest net result along ``axis`` of AXES with a cdf() of at least
+        ``q``, for a probability or an array of them."""
+        distribution, index = self._axis_distribution(axis)
+        return distribution.quantile(q, index)
+
+    def variance(self) -> 'numpy.ndarray':
+        """Return the array of the variance of the net result along every axis of AXES."""
+        import numpy
+
+        variance = []
+        for axis in range(len(AXES)):
+            distribution, index = self._axis_distribution(axis)
+            variance.append(distribution.variance()[index])
+        return numpy.array(variance, dtype=numpy.float64)
+
+    def std(self) -> 'numpy.ndarray':
+        """Return the array of the standard deviation of the net result along every axis of
+        AXES."""
+        import numpy
+
+        return numpy.sqrt(self.variance())
+
+    def most_likely(self, n: int = 1) -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+        """Return the ``(outcomes, probabilities)`` arrays of the ``n`` most likely net
+        (triumph, success, advantage, despair) outcomes, most likely first."""
+        return self.distribution.most_likely(n)
+
+    def _dice_mean(self, axes: Sequence[int]) -> Tuple[float, ...]:
+        # The mean of a sum is the sum of the means, so no pool distribution is needed.  The
+        # exact fractions round to the same floats as the distribution's mean.
+        mean = [0] * len(axes)
+        for dice in self._pool:
+            dice_mean = dice.mean()
+            mean = [m + dice_mean[axis] for m, axis in zip(mean, axes)]
+        return tuple(float(m) for m in mean)
+
+    def with_added(self, dice: Union[Dice, str]) -> 'DicePool':
+        """Return a pool with one more die, given as a Dice or a color character.
+
+        If this pool's distribution is known, the new one is derived from it with a single
+        convolution instead of being rebuilt.
+        """
+        dice = self._to_dice(dice)
+        return self._derived(added=[dice])
+
+    def with_removed(self, dice: Union[Dice, str]) -> 'DicePool':
+        """Return a pool with one die fewer, given as a Dice or a color character.
+
+        Raises ValueError if the pool has no such die.  In exact mode a known distribution is
+        derived by dividing the die out of it instead of being rebuilt.
+        """
+        dice = self._to_dice(dice)
+        if not any(pool_dice is dice for pool_dice in self._pool):
+            raise ValueError('Pool has no {} to remove.'.format(self._dice_name(dice)))
+        return self._derived(removed=[dice])
+
+    def upgrade(self, color: str) -> 'DicePool':
+        """Return the pool after upgrading the ability (``'g'``) or difficulty (``'p'``) dice.
+
+        Following the rules, one ability die becomes a proficiency die (or difficulty becomes
+        challenge).  Without any die to upgrade, one ability (or difficulty) die is added.
+        """
+        lower, upper = self._upgrade_pair(color)
+        if not any(dice is lower for dice in self._pool):
+            return self._derived(added=[lower])
+        return self._derived(added=[upper], removed=[lower])
+
+    def downgrade(self, color: str) -> 'DicePool':
+        """Return the pool after downgrading the proficiency (``'y'``) or challenge (``'r'``)
+        dice: one becomes an ability (or difficulty) die.  Without any die to downgrade the
+        pool is unchanged."""
+        lower, upper = self._upgrade_pair(color)
+        if not any(dice is upper for dice in self._pool):
+            return self._derived()
+        return self._derived(added=[lower], removed=[upper])
+
+    def sensitivity(self, cutoffs: Sequence[Sequence[Optional[int]]] = ()) -> List[PoolChange]:
+        """Return how adding, removing or upgrading one die of each standard color changes the
+        mean and the probability_above() of each cutoff.
+
+        A cutoff has an entry per axis of AXES (missing trailing entries are None).  Dice are
+        only removed if the pool has one, and upgraded as :meth:`upgrade` does.  Force dice are
+        left out, they change none of the statistics.
+
+        Every change is derived from this pool's distribution of just the axes the cutoffs
+        constrain, with one extra convolution (and in exact mode, one division to remove a
+        die) rather than a rebuild.
+        """
+        cutoffs = [tuple(cutoff) + (None,) * (len(AXES) - len(cutoff)) for cutoff in cutoffs]
+        axes = tuple(sorted({axis for cutoff in cutoffs for axis, cut in enumerate(cutoff)
+                             if cut is not None and not (axis in NON_NEGATIVE_AXES and cut <= 0)}))
+        axis_cutoffs = [tuple(cutoff[axis] for axis in axes) for cutoff in cutoffs]
+
+        def probabilities(distribution: Optional['QuadDistribution']) -> Tuple[float, ...]:
+            if distribution is None:
+                # No cutoff constrains anything.
+                return (1.0,) * len(cutoffs)
+            return tuple(distribution.probability_above(cutoff) for cutoff in axis_cutoffs)
+
+        base = self.marginal_distribution(axes) if axes else None
+        base_probabilities = probabilities(base)
+
+        edits = []
+        for dice_color in DiceColor:
+            if dice_color is DiceColor.w:
+                continue
+            dice = dice_color.value()
+            edits.append(('add', dice_color.name, [dice], []))
+            if any(pool_dice is dice for pool_dice in self._pool):
+                edits.append(('remove', dice_color.name, [], [dice]))
+        for lower, upper in UPGRADES:
+            if any(pool_dice is lower.value() for pool_dice in self._pool):
+                edits.append(('upgrade', lower.name, [upper.value()], [lower.value()]))
+            else:
+                edits.append(('upgrade', lower.name, [lower.value()], []))
+
+        changes = []
+        for action, color, added, removed in edits:
+            pool = list(self._pool)
+            for dice in removed:
+                pool.remove(dice)
+            pool.extend(added)
+            mean = tuple(float(sum(dice.mean()[axis] for dice in added) -
+                               sum(dice.mean()[axis] for dice in removed))
+                         for axis in NET_AXES)
+            distribution = None
+            if base is not None:
+                distribution = self._changed_distribution(base, pool, added, removed, axes)
+            changes.append(PoolChange(
+                action, color, self._canonical_pool_string(pool), mean,
+                tuple(p - base_p for p, base_p in zip(probabilities(distribution),
+                                                      base_probabilities))))
+        return changes
+
+    def _changed_distribution(self, distribution: 'QuadDistribution', pool: Sequence[Dice],
+                              added: Sequence[Dice], removed: Sequence[Dice],
+                              axes: Tuple[int, ...]) -> 'QuadDistribution':
+        """Return the distribution of ``axes`` of ``pool``, from ``distribution`` of this
+        pool with the ``removed`` dice divided out and the ``added`` dice added."""
+        try:
+            return self._edited_distribution(distribution, added, removed, axes)
+        except ValueError:
+            # Float probabilities cannot be divided exactly, so rebuild from the cache.
+            return self._cached_distribution(pool, self.exact, axes)
+
+    def _derived(self, added: Sequence[Dice] = (),
+                 removed: Sequence[Dice] = ()) -> 'DicePool':
+        pool = list(self._pool)
+        for dice in removed:
+            del pool[next(i for i, pool_dice in enumerate(pool) if pool_dice is dice)]
+        pool.extend(added)
+        try:
+            pool.sort(key=lambda dice: self._sort_dice_by_power(DiceColor(type(dice)).name))
+        except ValueError:
+            # Custom dice, keep the order they were given in.
+            pass
+        derived = DicePool(pool, self.exact)
+
+        pool_string = self._canonical_pool_string(self._pool)
+        distribution = self._distribution
+        if distribution is None and pool_string is not None:
+            distribution = distribution_cache.get(pool_string, self.exact)
+        if distribution is None:
+            # Nothing to derive from, the distribution will be built when needed.
+            return derived
+
+        derived_pool_string = self._canonical_pool_string(pool)
+        if derived_pool_string is not None:
+            derived._distribution = distribution_cache.get(derived_pool_string, self.exact)
+            if derived._distribution is not None:
+                return derived
+
+        try:
+            distribution = self._edited_distribution(distribution, added, removed)
+        except ValueError:
+            # Float probabilities cannot be divided exactly, so rebuild from the cache.
+            return derived
+        derived._distribution = distribution
+        if derived_pool_string is not None:
+            distribution_cache.put(derived_pool_string, distribution)
+        return derived
+
+    @staticmethod
+    def _to_dice(dice: Union[Dice, str]) -> Dice:
+        if isinstance(dice, str):
+            return dice_from_color_char(dice)
+        return dice
+
+    @staticmethod
+    def _dice_name(dice: Dice) -> str:
+        try:
+            return DiceColor(type(dice)).name
+        except ValueError:
+            return type(dice).__name__
+
+    def _edited_distribution(self, distribution: 'QuadDistribution', added: Sequence[Dice],
+                             removed: Sequence[Dice],
+                             axes: Tuple[int, ...] = NET_AXES) -> 'QuadDistribution':
+        """Return ``distribution`` of ``axes`` of this pool with the ``removed`` dice divided
+        out and the ``added`` dice added.
+
+        Dice that add nothing along ``axes`` are skipped, as _build_distribution() leaves them
+        out.  Raises ValueError if a die cannot be divided out, e.g. of float probabilities.
+        """
+        for dice in removed:
+            dice_distribution = dice.marginal_distribution(axes)
+            if not self._adds_nothing(dice_distribution):
+                distribution = distribution.remove(dice_distribution)
+        for dice in added:
+            dice_distribution = dice.marginal_distribution(axes)
+            if self._adds_nothing(dice_distribution):
+                continue
+            if not self.exact:
+                dice_distribution = dice_distribution.normalized()
+            distribution = distribution.add(dice_distribution)
+        return distribution
+
+    @staticmethod
+    def _adds_nothing(distribution: 'QuadDistribution') -> bool:
+        """Whether the distribution is a single outcome of zero, such as a Force die's on the
+        net axes.  Adding such a die only scales the exact counts, so it is left out."""
+        return distribution.num_outcomes() == 1 and not any(distribution.offset)
+
+    @staticmethod
+    def _upgrade_pair(color: str) -> Tuple[Dice, Dice]:
+        """Return the (lower, upper) dice that ``color`` (either of them) upgrades between."""
+        for lower, upper in UPGRADES:
+            if color in (lower.name, upper.name):
+                return lower.value(), upper.value()
+        raise ValueError('Only ability (g/y) and difficulty (p/r) dice can be upgraded or '
+                         'downgraded, not: {}'.format(color))
 
     def roll(self) -> List[Symbol]:
         symbols = []
@@ -276,6 +840,66 @@ class DicePool:
             symbols.extend(dice.roll())
         return symbols
 
+    def roll_many(self, n: int, rng: 'numpy.random.Generator' = None, raw: bool = False):
+        """Roll the pool ``n`` times with a single draw of every face.
+
+        Returns an ``(n, 4)`` array of the net (triumph, success, advantage, despair) of each
+        roll.  If ``raw`` is set, also returns an ``(n, len(Symbol))`` array counting each
+        Symbol rolled, in Symbol order, which includes the Force points.  Pass a seeded
+        ``numpy.random.Generator`` as ``rng`` to make the rolls reproducible.
+        """
+        import numpy
+        if rng is None:
+            rng = numpy.random.default_rng()
+
+        raw_counts = self._roll_symbol_counts(n, rng)
+        net_counts = raw_counts @ numpy.array(symbol_to_net, dtype=numpy.int16)[:, NET_AXES]
+        if raw:
+            return net_counts, raw_counts
+        return net_counts
+
+    def roll_stream(self, count: int, rng: 'numpy.random.Generator' = None,
+                    batch_size: int = ROLL_BATCH_SIZE) -> Iterator['numpy.ndarray']:
+        """Roll the pool ``count`` times, yielding ``(batch, len(Symbol))`` arrays of at most
+        ``batch_size`` rolls that count each Symbol rolled, as roll_many() with ``raw`` set.
+
+        Only one batch is held at a time, so ``count`` can be far larger than fits in memory.
+        """
+        import numpy
+        if count < 0:
+            raise ValueError('Cannot roll a negative number of times: {}'.format(count))
+        if batch_size < 1:
+            raise ValueError('Batch size must be positive: {}'.format(batch_size))
+        if rng is None:
+            rng = numpy.random.default_rng()
+        for start in range(0, count, batch_size):
+            yield self._roll_symbol_counts(min(batch_size, count - start), rng)
+
+    def _roll_symbol_counts(self, n: int, rng: 'numpy.random.Generator') -> 'numpy.ndarray':
+        import numpy
+        num_sides = [dice.num_sides() for dice in self._pool]
+        sides = rng.integers(0, num_sides, size=(n, len(self._pool)), dtype=numpy.uint8)
+
+        raw_counts = numpy.zeros((n, len(Symbol)), dtype=numpy.int16)
+        for i, dice in enumerate(self._pool):
+            raw_counts += dice.face_table()[sides[:, i]]
+        return raw_counts
+
+    @staticmethod
+    def cancel_symbol_counts(raw_counts: 'numpy.ndarray') -> 'numpy.ndarray':
+        """Return the symbol counts left once Success and Failure, and Advantage and Threat,
+        cancel out: the vectorized _cancel_symbols() of ``(n, len(Symbol))`` counts."""
+        import numpy
+        symbols = list(Symbol)
+        cancelled = raw_counts.copy()
+        for positive, negative in ((Symbol.Success, Symbol.Failure),
+                                   (Symbol.Advantage, Symbol.Threat)):
+            i, j = symbols.index(positive), symbols.index(negative)
+            net = raw_counts[..., i] - raw_counts[..., j]
+            cancelled[..., i] = numpy.maximum(net, 0)
+            cancelled[..., j] = numpy.maximum(-net, 0)
+        return cancelled
+
     def roll_ascii(self) -> Tuple[str, str]:
         symbols = self.roll()
         symbols.sort(key=self._sort_symbol_by_power)
@@ -286,10 +910,12 @@ class DicePool:
         return self._symbols_to_ascii_(symbols), self._symbols_to_ascii_(cancelled_symbols)
 
     def __str__(self):
+        import colorama
+        _, dice_color_codes = _ansi_colors()
         s = ''
         for dice in self._pool:
             dice_color = DiceColor(type(dice))
-            color_code = dice_color_to_ansi[dice_color]
+            color_code = dice_color_codes[dice_color]
 
             # Do not turn on bright style for black die as it makes it harder to read.
             brightness_code = colorama.Style.BRIGHT
@@ -299,14 +925,108 @@ class DicePool:
                                    colorama.Style.RESET_ALL)
         return s
 
+    @classmethod
+    def _canonical_pool_string(cls, pool: Sequence[Dice]) -> Optional[str]:
+        """Return the pool as a string sorted by power, or None if it has non-standard dice."""
+        dice_chars = []
+        for dice in pool:
+            try:
+                dice_chars.append(DiceColor(type(dice)).name)
+            except ValueError:
+                return None
+        dice_chars.sort(key=cls._sort_dice_by_power)
+        return ''.join(dice_chars)
+
+    @classmethod
+    def _cached_distribution(cls, pool: Sequence[Dice], exact: bool,
+                             axes: Tuple[int, ...] = None) -> 'QuadDistribution':
+        """Look the pool up in the cache, building it from the largest cached sub-pool.
+
+        If ``axes`` is given, the marginal distribution of those axes is looked up or built.
+        """
+        pool_string = cls._canonical_pool_string(pool)
+        if pool_string is None:
+            return cls._build_distribution(pool, exact, axes)
+
+        distribution = distribution_cache.get(pool_string, exact, axes)
+        if distribution is not None:
+            return distribution
+
+        if disk_cache is not None:
+            distribution = disk_cache.get(pool_string, exact, axes)
+            if distribution is None and axes is not None and axes[-1] < len(NET_AXES):
+                # A full distribution on disk has every marginal of the net axes.
+                distribution = disk_cache.get(pool_string, exact)
+                if distribution is not None:
+                    distribution = distribution.marginal(axes)
+            if distribution is not None:
+                distribution_cache.put(pool_string, distribution, axes)
+                return distribution
+
+        sub_pool_string, sub_distribution = distribution_cache.longest_sub_pool(pool_string,
+                                                                                exact, axes)
+        sub_color_counts = collections.Counter(sub_pool_string)
+        remaining_dice = []
+        for dice in pool:
+            dice_char = DiceColor(type(dice)).name
+            if sub_color_counts[dice_char] > 0:
+                sub_color_counts[dice_char] -= 1
+            else:
+                remaining_dice.append(dice)
+
+        distribution = cls._build_distribution(remaining_dice, exact, axes)
+        if sub_distribution is not None:
+            distribution = sub_distribution.add(distribution)
+        distribution_cache.put(pool_string, distribution, axes)
+        if disk_cache is not None:
+            disk_cache.put(pool_string, distribution, axes)
+        return distribution
+
+    @staticmethod
+    def _build_distribution(pool: Sequence[Dice], exact: bool = True,
+                            axes: Tuple[int, ...] = None) -> 'QuadDistribution':
+        """Raise each color's distribution to its count, then combine the colors.
+
+        The per-color results are combined from the smallest to the largest number of
+        outcomes to keep the intermediate convolutions small.  If ``axes`` is given, the
+        distribution of just those axes of every die is combined instead.  Dice with nothing
+        on the axes, such as Force dice on the net axes, are skipped.
+        """
+        from distribution import QuadDistribution
+        # Standard dice are shared instances, so equal dice group together.
+        dice_by_color = collections.OrderedDict()
+        for dice in pool:
+            dice_by_color.setdefault(dice, []).append(dice)
+
+        color_distributions = []
+        for same_color_dice in dice_by_color.values():
+            dice = same_color_dice[0]
+            if axes is None:
+                dice_distribution = dice.distribution
+            else:
+                dice_distribution = dice.marginal_distribution(axes)
+            if DicePool._adds_nothing(dice_distribution):
+                continue
+            if not exact:
+                dice_distribution = dice_distribution.normalized()
+            color_distributions.append(dice_distribution.power(len(same_color_dice)))
+        color_distributions.sort(key=QuadDistribution.num_outcomes)
+
+        distribution = QuadDistribution.identity(len(NET_AXES) if axes is None else len(axes))
+        for color_distribution in color_distributions:
+            distribution = distribution.add(color_distribution)
+        return distribution
+
     @staticmethod
     def _symbols_to_ascii_(symbols: Sequence[Symbol]) -> str:
+        import colorama
+        symbol_codes, _ = _ansi_colors()
         s = ''
         for symbol in symbols:
             brightness_code = colorama.Style.BRIGHT
-            if symbol is Symbol.Threat:
+            if symbol in (Symbol.Threat, Symbol.Dark):
                 brightness_code = ''
-            s += '{}{}{}{}'.format(brightness_code, symbol_to_ansi[symbol], symbol.value,
+            s += '{}{}{}{}'.format(brightness_code, symbol_codes[symbol], symbol.value,
                                    colorama.Style.RESET_ALL)
         return s
 
@@ -364,6 +1084,10 @@ class DicePool:
             return 5
         elif symbol is Symbol.Threat:
             return 6
+        elif symbol is Symbol.Light:
+            return 7
+        elif symbol is Symbol.Dark:
+            return 8
 
     @staticmethod
     def _sort_dice_by_power(dice_char: str) -> int:
@@ -381,11 +1105,18 @@ class DicePool:
                 return 5
             elif dice_color is DiceColor.k:
                 return 6
+            elif dice_color is DiceColor.w:
+                return 7
         except KeyError:
             raise ValueError('Invalid dice character given: {}'.format(dice_char))
 
     @classmethod
-    def from_string(cls, pool_string: str) -> 'DicePool':
+    def canonical_string(cls, pool_string: str) -> str:
+        """Return the pool string sorted by power, so equal pools have equal strings."""
+        return ''.join(sorted(pool_string, key=cls._sort_dice_by_power))
+
+    @classmethod
+    def from_string(cls, pool_string: str, exact: bool = None) -> 'DicePool':
         dice_chars = []
         for char in pool_string:
             dice_chars.append(char)
@@ -395,4 +1126,4 @@ class DicePool:
         for dice_char in dice_chars:
             pool.append(dice_from_color_char(dice_char))
 
-        return cls(pool)
+        return cls(pool, exact)
@@ -1,24 +1,569 @@
 #!/usr/bin/env python3
 
 import collections
-from typing import Mapping, Tuple
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+import numpy
+
+# Kernels with at most this many non-zero outcomes are convolved directly by shifting and
+# scaling the larger array.  Anything bigger goes through an FFT.
+_DIRECT_MAX_TERMS = 32
+
+# Frequencies are kept as int64 while the total number of outcomes fits, then fall back to
+# Python ints (object arrays) so that exact counts never overflow.
+_INT64_MAX = int(numpy.iinfo(numpy.int64).max)
+
+# A float64 FFT convolution rounds back to the exact integer counts as long as the total
+# stays well below 2 ** 53 (the error grows with the total and with log2 of the size).
+_FFT_EXACT_MAX = 2 ** 40
+
+# Distributions with at least this many cells, of which at most this fraction are non-zero
+# outcomes, are stored sparsely (see _SparseCounts).  Below that, the dense array is both
+# smaller and faster to convolve.
+_SPARSE_MIN_CELLS = 4096
+_SPARSE_MAX_DENSITY = 0.25
+
+# Bits per axis of a packed outcome key.  Four axes fit in a non-negative int64.
+_KEY_BITS = 15
 
 
 class QuadDistribution:
+    """Distribution of net (triumph, success, advantage, despair) outcomes.
+
+    Frequencies are stored densely: ``counts[i, j, k, l]`` is the frequency of the outcome
+    ``offset + (i, j, k, l)``.  Large distributions that are mostly zero, such as many dice
+    of a single color, are instead stored sparsely and only made dense where needed (see
+    :meth:`compact`).
+
+    Frequencies are either exact integer counts, or float64 probabilities summing to 1 (see
+    :meth:`normalized`).  Adding an exact distribution to a float one gives a float one.
+
+    A marginal distribution (see :meth:`marginal`) keeps only some of the four axes; its
+    offset, mean() and cutoffs then only have those axes.  Distributions can have any number
+    of axes, e.g. the light and dark points of the Force die, given by the length of the
+    outcomes they are built from.
+    """
+
+    __slots__ = ('_counts', '_sparse', '_shape', '_offset', '_total_cache', '_mean',
+                 '_survival', '_axis_frequencies', '_cdfs', '_variance', '_ranking')
+
+    def __init__(self, distribution: Mapping[Tuple[int, int, int, int], int] = None):
+        if distribution is None:
+            distribution = {(0, 0, 0, 0): 1}
+
+        ndim = len(next(iter(distribution)))
+        values = numpy.array(list(distribution.keys()), dtype=numpy.int64).reshape(-1, ndim)
+        frequencies = list(distribution.values())
+        offset = values.min(axis=0)
+        shape = values.max(axis=0) - offset + 1
+
+        counts = numpy.zeros(shape, dtype=_count_dtype(sum(frequencies)))
+        for index, frequency in zip(values - offset, frequencies):
+            counts[tuple(index)] += frequency
+
+        self._set_counts(counts, offset)
+
+    @classmethod
+    def identity(cls, ndim: int = 4) -> 'QuadDistribution':
+        """Return the distribution of an empty pool, with ``ndim`` axes."""
+        return cls.from_array(numpy.ones((1,) * ndim, dtype=numpy.int64), (0,) * ndim)
+
+    @classmethod
+    def from_array(cls, counts: numpy.ndarray, offset: Sequence[int]) -> 'QuadDistribution':
+        distribution = cls.__new__(cls)
+        distribution._set_counts(counts, offset)
+        return distribution
+
+    def _set_counts(self, counts: Optional[numpy.ndarray], offset: Sequence[int],
+                    sparse: '_SparseCounts' = None) -> None:
+        # Exactly one of _counts and _sparse is set.
+        self._counts = counts
+        self._sparse = sparse
+        self._shape = counts.shape if sparse is None else sparse.shape
+        self._offset = tuple(int(o) for o in offset)
+        # Derived values, computed on first use.
+        self._total_cache = None
+        self._mean = None
+        self._survival = None
+        self._axis_frequencies = None
+        self._cdfs = None
+        self._variance = None
+        self._ranking = None
+
+    @property
+    def counts(self) -> numpy.ndarray:
+        """The dense frequency array.  A sparse distribution builds it on every access."""
+        if self._sparse is not None:
+            return self._sparse.to_dense()
+        return self._counts
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def offset(self) -> Tuple[int, int, int, int]:
+        return self._offset
+
+    @property
+    def sparse(self) -> bool:
+        return self._sparse is not None
+
+    @property
+    def exact(self) -> bool:
+        return self._frequencies().dtype != numpy.float64
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the frequencies, including Python int frequencies."""
+        frequencies = self._frequencies()
+        nbytes = frequencies.nbytes
+        if self._sparse is not None:
+            nbytes += self._sparse.keys.nbytes
+        if frequencies.dtype == object:
+            # Estimated as a CPython int as large as the total: sys.getsizeof() raises on PyPy.
+            nbytes += frequencies.size * ((int(self._total()).bit_length() + 7) // 8 + 28)
+        return nbytes
+
+    def _frequencies(self) -> numpy.ndarray:
+        """Return the stored frequencies: the dense array, or the non-zero sparse ones."""
+        return self._counts if self._sparse is None else self._sparse.values
+
+    def compact(self) -> 'QuadDistribution':
+        """Return the distribution stored sparsely if it is large and mostly zero, and densely
+        otherwise.  Sums of distributions are already stored that way."""
+        sparse = _prefers_sparse(self.num_outcomes(), self._shape)
+        if sparse == (self._sparse is not None):
+            return self
+        if sparse:
+            distribution = QuadDistribution.__new__(QuadDistribution)
+            distribution._set_counts(None, self._offset, _SparseCounts.from_dense(self._counts))
+            return distribution
+        return QuadDistribution.from_array(self.counts, self._offset)
+
+    def to_mapping(self) -> Mapping[Tuple[int, int, int, int], int]:
+        """Return the non-zero outcomes as a ``{value: frequency}`` dict."""
+        if self._sparse is not None:
+            indices = numpy.stack(self._sparse.indices(), axis=1)
+            frequencies = self._sparse.values
+        else:
+            indices = numpy.argwhere(self._counts)
+            frequencies = self._counts[tuple(indices.T)]
+        mapping = {}
+        for index, frequency in zip(indices, frequencies):
+            value = tuple(int(i + o) for i, o in zip(index, self._offset))
+            if frequency != 0:
+                mapping[value] = int(frequency) if self.exact else float(frequency)
+        return mapping
+
+    def marginal(self, axes: Sequence[int]) -> 'QuadDistribution':
+        """Return the distribution of just ``axes`` (in increasing order), summing out the
+        other axes."""
+        other_axes = tuple(axis for axis in range(len(self._shape)) if axis not in axes)
+        counts = self.counts
+        counts = counts.sum(axis=other_axes) if other_axes else counts
+        return QuadDistribution.from_array(counts, [self._offset[axis] for axis in axes])
+
+    def normalized(self) -> 'QuadDistribution':
+        """Return the distribution as float64 probabilities instead of exact counts.
+
+        Float distributions avoid the cost of arbitrary-precision counts for large pools, and
+        can always be convolved with an FFT.  Every probability is a sum of non-negative
+        products, so adding a die with k outcomes through a direct convolution grows the
+        relative error of each probability by at most about (k + 1) * 2 ** -53, i.e. well
+        under 1e-13 for a 30-die pool.  An FFT convolution instead adds an absolute error of
+        about 2 ** -53 * log2(N) for N cells (around 1e-15 here); round-off that would make a
+        probability negative is clipped to zero.  Summed over the at most a few hundred
+        thousand cells of a pool, probability_above() and mean() stay within 1e-10 of the
+        exact values.
+        """
+        if not self.exact:
+            return self
+        total = float(self._total())
+        if self._sparse is not None:
+            sparse = self._sparse
+            distribution = QuadDistribution.__new__(QuadDistribution)
+            distribution._set_counts(None, self._offset, _SparseCounts(
+                sparse.keys, sparse.values.astype(numpy.float64) / total, sparse.shape))
+            return distribution
+        counts = self._counts.astype(numpy.float64) / total
+        return QuadDistribution.from_array(counts, self._offset)
+
+    def _total(self):
+        if self._total_cache is None:
+            total = self._frequencies().sum()
+            self._total_cache = int(total) if self.exact else float(total)
+        return self._total_cache
+
+    def _probabilities(self, frequencies: numpy.ndarray) -> numpy.ndarray:
+        """Return ``frequencies`` divided by the total, as float64."""
+        total = self._total()
+        if self.exact and total > 2 ** 53:
+            # Counts too large for float64, divide them as Python ints as probability_above()
+            # does.
+            return numpy.vectorize(lambda f: int(f) / total, otypes=[numpy.float64])(frequencies)
+        return numpy.asarray(frequencies / total, dtype=numpy.float64)
+
+    def axis_frequencies(self) -> Tuple[numpy.ndarray, ...]:
+        """Return the frequency of each value along each axis, built on first use.
+
+        ``axis_frequencies()[axis][i]`` is the total frequency of the outcomes whose value
+        along ``axis`` is ``offset[axis] + i``.  The histograms, CDFs, quantiles, mean and
+        variance are all derived from these, so a sparse distribution is never made dense for
+        them.
+        """
+        if self._axis_frequencies is None:
+            if self._sparse is not None:
+                values = self._sparse.values
+                frequencies = []
+                for indices, size in zip(self._sparse.indices(), self._shape):
+                    axis_frequencies = numpy.zeros(size, dtype=values.dtype)
+                    numpy.add.at(axis_frequencies, indices, values)
+                    frequencies.append(axis_frequencies)
+            else:
+                counts = self._counts
+                frequencies = [counts.sum(axis=tuple(a for a in range(counts.ndim) if a != axis))
+                               for axis in range(counts.ndim)]
+            self._axis_frequencies = tuple(frequencies)
+        return self._axis_frequencies
+
+    def _axis_values(self, axis: int) -> numpy.ndarray:
+        return numpy.arange(self._offset[axis], self._offset[axis] + self._shape[axis])
+
+    def _moments(self, power: int) -> List:
+        """Return the sum of ``frequency * value ** power`` along each axis."""
+        moments = []
+        for axis, frequencies in enumerate(self.axis_frequencies()):
+            values = self._axis_values(axis)
+            if self.exact:
+                # Python ints, so the weighted sum cannot overflow.
+                frequencies = frequencies.astype(object)
+                values = values.astype(object)
+            moments.append((frequencies * values ** power).sum())
+        return moments
+
+    def mean(self) -> Tuple[float, float, float, float]:
+        if self._mean is None:
+            total = self._total()
+            self._mean = tuple(float(moment / total) for moment in self._moments(1))
+        return self._mean
+
+    def variance(self) -> numpy.ndarray:
+        """Return the array of the variance along each axis."""
+        if self._variance is None:
+            total = self._total()
+            variance = []
+            for first, second in zip(self._moments(1), self._moments(2)):
+                if self.exact:
+                    # Exact up to the final division.
+                    variance.append((second * total - first * first) / (total * total))
+                else:
+                    variance.append(max(second / total - (first / total) ** 2, 0.0))
+            self._variance = numpy.array([float(v) for v in variance], dtype=numpy.float64)
+        return self._variance
+
+    def std(self) -> numpy.ndarray:
+        """Return the array of the standard deviation along each axis."""
+        return numpy.sqrt(self.variance())
+
+    def histogram(self, axis: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the ``(values, probabilities)`` arrays of every value from the lowest to the
+        highest along ``axis``."""
+        return self._axis_values(axis), self._probabilities(self.axis_frequencies()[axis])
+
+    def cdf(self, axis: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the ``(values, probabilities)`` arrays of the probability of at most each
+        value along ``axis``.  The last probability is 1."""
+        if self._cdfs is None:
+            self._cdfs = tuple(self._probabilities(numpy.cumsum(frequencies))
+                               for frequencies in self.axis_frequencies())
+        return self._axis_values(axis), self._cdfs[axis]
+
+    def quantile(self, q, axis: int) -> numpy.ndarray:
+        """Return the smallest value along ``axis`` with a cdf() of at least ``q``, for a
+        probability or an array of them."""
+        q = numpy.asarray(q, dtype=numpy.float64)
+        if numpy.any((q < 0.0) | (q > 1.0)):
+            raise ValueError('Quantiles must be between 0 and 1: {}'.format(q))
+        values, cdf = self.cdf(axis)
+        if not self.exact:
+            # Float probabilities may sum to slightly less than 1.
+            return values[numpy.minimum(numpy.searchsorted(cdf, q), len(values) - 1)]
+
+        # Compare the counts exactly: the float cdf() can round up to q short of a rare value.
+        cumulative = numpy.cumsum(self.axis_frequencies()[axis]).tolist()
+        total = self._total()
+
+        def index(probability: float) -> int:
+            numerator, denominator = float(probability).as_integer_ratio()
+            return next(i for i, frequency in enumerate(cumulative)
+                        if frequency * denominator >= numerator * total)
+
+        return values[numpy.vectorize(index, otypes=[numpy.intp])(q)]
+
+    def most_likely(self, n: int = 1) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return the ``(outcomes, probabilities)`` arrays of the ``n`` most likely outcomes,
+        most likely first.  ``outcomes`` has a row per outcome; ties are in outcome order.
+
+        The ranking of every outcome is built on first use.
+        """
+        if self._ranking is None:
+            if self._sparse is not None:
+                indices = numpy.stack(self._sparse.indices(), axis=1)
+                frequencies = self._sparse.values
+            else:
+                flat_indices = numpy.flatnonzero(self._counts)
+                indices = numpy.stack(numpy.unravel_index(flat_indices, self._shape), axis=1)
+                frequencies = self._counts.ravel()[flat_indices]
+            order = numpy.argsort(-frequencies, kind='stable')
+            self._ranking = (indices[order] + numpy.array(self._offset, dtype=numpy.int64),
+                             self._probabilities(frequencies[order]))
+        outcomes, probabilities = self._ranking
+        return outcomes[:n], probabilities[:n]
+
+    def survival(self) -> numpy.ndarray:
+        """Return the "at least" tensor, built on first use.
+
+        ``survival()[i, j, k, l]`` is the total frequency of the outcomes that are at least
+        ``offset + (i, j, k, l)`` on every axis.
+        """
+        if self._survival is None:
+            survival = self.counts
+            for axis in range(survival.ndim):
+                survival = numpy.flip(numpy.cumsum(numpy.flip(survival, axis), axis), axis)
+            self._survival = survival
+        return self._survival
+
+    def probability_above(self,
+                          cutoff: Tuple[int, int, int, int] = (None, None, None, None)) -> float:
+        index = []
+        for cut, offset, size in zip(cutoff, self._offset, self._shape):
+            start = 0 if cut is None else max(cut - offset, 0)
+            if start >= size:
+                # No outcome makes the cut.
+                return 0.0
+            index.append(start)
+        hits = self.survival()[tuple(index)]
+        return (int(hits) if self.exact else float(hits)) / self._total()
+
+    def probability_grid(self, cutoffs: Sequence[Optional[Sequence[int]]]) -> numpy.ndarray:
+        """Return probability_above() of every combination of cutoffs in one pass.
+
+        ``cutoffs`` has an entry per axis: None for no cutoff, or a sequence of cutoffs.  The
+        result has one dimension per axis with cutoffs, so ``grid[i, j]`` is the probability
+        of at least the i-th cutoff of the first such axis and the j-th of the second.
+        """
+        axes = [axis for axis, axis_cutoffs in enumerate(cutoffs) if axis_cutoffs is not None]
+        if not axes:
+            return numpy.ones(())
+        distribution = self.marginal(axes) if len(axes) < len(self._shape) else self
+        # Pad every axis with a zero, where cutoffs above the largest outcome end up.
+        survival = numpy.pad(distribution.survival(), [(0, 1)] * len(axes))
+        indices = []
+        for axis, offset, size in zip(axes, distribution.offset, distribution.shape):
+            indices.append([min(max(cut - offset, 0), size) for cut in cutoffs[axis]])
+        return self._probabilities(survival[numpy.ix_(*indices)])
+
+    def add(self, that: 'QuadDistribution') -> 'QuadDistribution':
+        """Return the distribution of the sum of this one and ``that``, stored as
+        :meth:`compact` would."""
+        offset = tuple(a + b for a, b in zip(self._offset, that._offset))
+        if self.exact and that.exact:
+            a, b, total = self, that, self._total() * that._total()
+        else:
+            a, b, total = self.normalized(), that.normalized(), None
+        if a.num_outcomes() < b.num_outcomes():
+            a, b = b, a
+
+        shape = tuple(m + n - 1 for m, n in zip(a._shape, b._shape))
+        distribution = QuadDistribution.__new__(QuadDistribution)
+        if (a._sparse is not None and b.num_outcomes() <= _DIRECT_MAX_TERMS and
+                _fits_keys(shape)):
+            dtype = numpy.float64 if total is None else _count_dtype(total)
+            sparse = a._sparse.convolve(b.counts, dtype)
+            if _prefers_sparse(len(sparse.keys), sparse.shape):
+                distribution._set_counts(None, offset, sparse)
+                return distribution
+            counts = sparse.to_dense()
+        else:
+            counts = _convolve(a.counts, b.counts, total)
+        distribution._set_counts(counts, offset)
+        return distribution.compact()
+
+    def remove(self, that: 'QuadDistribution') -> 'QuadDistribution':
+        """Return the distribution that gives this one when ``that`` is added to it.
+
+        The inverse of :meth:`add`, by exact long division, so both distributions must be
+        exact and ``that`` must be a term of this one, e.g. a die of the pool.  Raises
+        ValueError if the division shows it is not, or if ``that`` has no edge along any axis
+        with a single outcome to divide by.
+        """
+        if not (self.exact and that.exact):
+            raise ValueError('Only exact distributions can be removed.')
+        if len(self._shape) == 1:
+            # Divide along a second axis of a single value, which the slices need.
+            quotient = self._with_unit_axis().remove(that._with_unit_axis())
+            return QuadDistribution.from_array(quotient.counts[:, 0], quotient.offset[:1])
+        edge = _single_outcome_edge(that.counts)
+        if edge is None:
+            raise ValueError('Cannot divide by a distribution without a single outcome edge.')
+        axis, from_end = edge
+
+        total, remainder = divmod(self._total(), that._total())
+        shape = tuple(m - n + 1 for m, n in zip(self._shape, that._shape))
+        if remainder or min(shape) < 1:
+            raise ValueError('Distribution is not a term of this one.')
+
+        # Divide slice by slice along the axis, starting from the edge whose slice of the
+        # divisor is a single outcome, so each quotient slice is a shifted and scaled slice of
+        # what remains of the dividend.
+        dividend = numpy.moveaxis(self.counts, axis, 0)
+        divisor = numpy.moveaxis(that.counts, axis, 0)
+        if from_end:
+            dividend, divisor = dividend[::-1], divisor[::-1]
+        dividend = dividend.astype(object if dividend.dtype == object else numpy.int64)
+        shape = (shape[axis],) + shape[:axis] + shape[axis + 1:]
+        (position,) = numpy.argwhere(divisor[0])
+        weight = divisor[0][tuple(position)]
+        window = tuple(slice(p, p + n) for p, n in zip(position, shape[1:]))
+
+        quotient = numpy.zeros(shape, dtype=dividend.dtype)
+        for i in range(shape[0]):
+            quotient[i] = dividend[i][window] // weight
+            # Take the contributions of this quotient slice out of this and the following
+            # slices.  What remains of this slice must then be zero.
+            dividend[i][window] -= quotient[i] * weight
+            for k in range(1, min(len(divisor), len(dividend) - i)):
+                for index in numpy.argwhere(divisor[k]):
+                    target = tuple(slice(j, j + n) for j, n in zip(index, shape[1:]))
+                    dividend[i + k][target] -= quotient[i] * divisor[k][tuple(index)]
+        if numpy.count_nonzero(dividend) or numpy.any(quotient < 0):
+            raise ValueError('Distribution is not a term of this one.')
+
+        if from_end:
+            quotient = quotient[::-1]
+        quotient = numpy.ascontiguousarray(numpy.moveaxis(quotient, 0, axis))
+        if quotient.dtype == object and _count_dtype(total) is not object:
+            quotient = quotient.astype(numpy.int64)
+        offset = tuple(a - b for a, b in zip(self._offset, that._offset))
+        return QuadDistribution.from_array(quotient, offset)
+
+    def _with_unit_axis(self) -> 'QuadDistribution':
+        """Return this distribution with an extra last axis that only has the value 0."""
+        return QuadDistribution.from_array(self.counts[..., numpy.newaxis], self._offset + (0,))
+
+    def power(self, n: int) -> 'QuadDistribution':
+        """Return the distribution of the sum of ``n`` independent copies of this one.
+
+        Uses repeated squaring, so only O(log n) convolutions are needed.
+        """
+        if n < 0:
+            raise ValueError('Power must not be negative: {}'.format(n))
+
+        result = QuadDistribution.identity(len(self._shape))
+        # square is the sum of this many copies of self.
+        square, copies = self, 1
+        while n > 0:
+            if n & 1:
+                result = result.add(square)
+            n >>= 1
+            if n == 0:
+                break
+
+            if self.exact and square._total() ** 2 > _FFT_EXACT_MAX:
+                # Squaring would need a direct convolution of two large operands, which is
+                # slower than folding in the remaining copies one at a time.
+                for _ in range(n * copies * 2):
+                    result = result.add(self)
+                break
+            square, copies = square.add(square), copies * 2
+        return result
+
+    def num_outcomes(self) -> int:
+        return int(numpy.count_nonzero(self._frequencies()))
+
+
+class _SparseCounts:
+    """The non-zero frequencies of a dense array of ``shape``, in C order.
+
+    Each outcome's index is packed into an int64 key, _KEY_BITS bits per axis with the first
+    axis highest, so keys sort in C order and adding two keys adds the indices.
+    """
+
+    __slots__ = ('keys', 'values', 'shape')
+
+    def __init__(self, keys: numpy.ndarray, values: numpy.ndarray, shape: Tuple[int, ...]):
+        self.keys = keys
+        self.values = values
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, counts: numpy.ndarray) -> '_SparseCounts':
+        indices = numpy.nonzero(counts)
+        return cls(_pack(indices), counts[indices], counts.shape)
+
+    def indices(self) -> Tuple[numpy.ndarray, ...]:
+        """Return the index arrays of the non-zero outcomes, as numpy.nonzero() does."""
+        mask = (1 << _KEY_BITS) - 1
+        return tuple((self.keys >> shift) & mask for shift in _key_shifts(len(self.shape)))
+
+    def to_dense(self) -> numpy.ndarray:
+        counts = numpy.zeros(self.shape, dtype=self.values.dtype)
+        counts[self.indices()] = self.values
+        return counts
+
+    def convolve(self, kernel: numpy.ndarray, dtype: type) -> '_SparseCounts':
+        """Convolve with a small dense ``kernel``, giving ``dtype`` frequencies.
+
+        Every shifted and scaled copy is written into one pair of key and value buffers, then
+        the keys are sorted and equal keys summed.  The copies are each sorted already, which
+        the stable sort (a merge sort) takes advantage of.
+        """
+        kernel_indices = numpy.nonzero(kernel)
+        shifts = _pack(kernel_indices)
+        weights = kernel[kernel_indices]
+        n = len(self.keys)
+        keys = numpy.empty(n * len(shifts), dtype=numpy.int64)
+        values = numpy.empty(n * len(shifts), dtype=dtype)
+        source = self.values.astype(dtype, copy=False)
+        for i, (shift, weight) in enumerate(zip(shifts, weights)):
+            weight = int(weight) if dtype is object else weight
+            numpy.add(self.keys, shift, out=keys[i * n:(i + 1) * n])
+            numpy.multiply(source, weight, out=values[i * n:(i + 1) * n])
+
+        order = numpy.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+        shape = tuple(m + n - 1 for m, n in zip(self.shape, kernel.shape))
+        return _SparseCounts(keys[starts], numpy.add.reduceat(values[order], starts), shape)
+
+
+class DictQuadDistribution:
+    """Sparse, pure Python reference implementation of :class:`QuadDistribution`.
+
+    It is much slower, but simple enough to be obviously correct, so it is kept around to
+    check the dense backend against.
+    """
+
     def __init__(self, distribution: Mapping[Tuple[int, int, int, int], int] = None):
         if distribution is None:
             distribution = {(0, 0, 0, 0): 1}
         self._distribution = distribution
 
+    def to_mapping(self) -> Mapping[Tuple[int, int, int, int], int]:
+        return {value: frequency for value, frequency in self._distribution.items()
+                if frequency != 0}
+
     def _total(self) -> int:
         return sum(self._distribution.values())
 
-    def mean(self) -> Tuple[float, float, float, float]:
-        val_sum = [0, 0, 0, 0]
+    def mean(self) -> Tuple[float, ...]:
+        ndim = len(next(iter(self._distribution)))
+        val_sum = [0] * ndim
         for value, frequency in self._distribution.items():
-            for i in range(0, 4):
+            for i in range(0, ndim):
                 val_sum[i] = val_sum[i] + value[i] * frequency
-        for i in range(0, 4):
+        for i in range(0, ndim):
             val_sum[i] /= self._total()
         return tuple(val_sum)
 
@@ -35,14 +580,91 @@ class QuadDistribution:
                 hits += frequency
         return hits / self._total()
 
-    def add(self, that: 'QuadDistribution') -> 'QuadDistribution':
+    def add(self, that: 'DictQuadDistribution') -> 'DictQuadDistribution':
         elements = collections.defaultdict(int)
         for value_i, frequency_i in self._distribution.items():
             for value_j, frequency_j in that._distribution.items():
-                value = [0, 0, 0, 0]
-                for i in range(0, 4):
+                value = [0] * len(value_i)
+                for i in range(0, len(value_i)):
                     value[i] = value_i[i] + value_j[i]
                 frequency = frequency_i * frequency_j
                 elements[tuple(value)] += frequency
 
-        return QuadDistribution(elements)
+        return DictQuadDistribution(elements)
+
+
+def _count_dtype(total: int) -> type:
+    if total <= _INT64_MAX:
+        return numpy.int64
+    return object
+
+
+def _key_shifts(ndim: int) -> Tuple[int, ...]:
+    return tuple(_KEY_BITS * (ndim - 1 - axis) for axis in range(ndim))
+
+
+def _pack(indices: Sequence[numpy.ndarray]) -> numpy.ndarray:
+    """Pack index arrays, one per axis, into keys as _SparseCounts stores them."""
+    keys = numpy.zeros(len(indices[0]) if indices else 1, dtype=numpy.int64)
+    for index, shift in zip(indices, _key_shifts(len(indices))):
+        keys |= index.astype(numpy.int64) << shift
+    return keys
+
+
+def _fits_keys(shape: Sequence[int]) -> bool:
+    return len(shape) * _KEY_BITS < 64 and max(shape, default=1) <= 1 << _KEY_BITS
+
+
+def _prefers_sparse(num_outcomes: int, shape: Sequence[int]) -> bool:
+    size = int(numpy.prod(shape))
+    return (size >= _SPARSE_MIN_CELLS and num_outcomes <= size * _SPARSE_MAX_DENSITY and
+            _fits_keys(shape))
+
+
+def _single_outcome_edge(counts: numpy.ndarray) -> Optional[Tuple[int, bool]]:
+    """Return an (axis, from_end) whose first (or last, if from_end) slice of ``counts`` has a
+    single non-zero outcome, or None."""
+    for axis in range(counts.ndim):
+        for from_end in (False, True):
+            edge = numpy.take(counts, -1 if from_end else 0, axis=axis)
+            if numpy.count_nonzero(edge) == 1:
+                return axis, from_end
+    return None
+
+
+def _convolve(a: numpy.ndarray, b: numpy.ndarray, total: Optional[int]) -> numpy.ndarray:
+    """Full N-D convolution of two frequency arrays.
+
+    ``total`` is the sum of the exact integer frequencies of the result, or None if both
+    arrays hold float64 probabilities.
+    """
+    # Shift the smaller kernel over the larger array.
+    if numpy.count_nonzero(a) < numpy.count_nonzero(b):
+        a, b = b, a
+    shape = tuple(m + n - 1 for m, n in zip(a.shape, b.shape))
+    if total is None:
+        dtype = numpy.float64
+        use_fft = True
+    else:
+        dtype = _count_dtype(total)
+        use_fft = total <= _FFT_EXACT_MAX
+
+    if numpy.count_nonzero(b) > _DIRECT_MAX_TERMS and use_fft:
+        axes = tuple(range(len(shape)))
+        product = numpy.fft.rfftn(a, shape, axes) * numpy.fft.rfftn(b, shape, axes)
+        result = numpy.fft.irfftn(product, shape, axes)
+        if total is None:
+            return numpy.maximum(result, 0.0)
+        return numpy.rint(result).astype(dtype)
+
+    a = a.astype(dtype, copy=False)
+    result = numpy.zeros(shape, dtype=dtype)
+    # Every scaled copy of a is written into the same buffer rather than a new array.
+    scaled = numpy.empty(a.shape, dtype=dtype)
+    for index in numpy.argwhere(b):
+        index = tuple(index)
+        weight = int(b[index]) if dtype is object else b[index]
+        window = tuple(slice(i, i + n) for i, n in zip(index, a.shape))
+        numpy.multiply(a, weight, out=scaled)
+        result[window] += scaled
+    return result
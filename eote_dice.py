@@ -1,11 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import os
 import sys
+from typing import Iterable, List, TextIO, Tuple
 
-import colorama
+from dice import DicePool, use_disk_cache
 
-from dice import DicePool
+CUTOFF_NAMES = ('triumph_cutoff', 'success_cutoff', 'advantage_cutoff', 'despair_cutoff',
+                'light_cutoff', 'dark_cutoff')
+AXIS_NAMES = ('triumph', 'success', 'advantage', 'despair', 'light', 'dark')
+
+
+def parse_grid(text: str) -> Tuple[int, List[int]]:
+    """Parse a grid axis such as ``'success=-2:5'`` into (axis, cutoffs from -2 to 5)."""
+    try:
+        name, _, bounds = text.partition('=')
+        low, high = bounds.split(':')
+        return AXIS_NAMES.index(name.strip()), list(range(int(low), int(high) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected AXIS=LOW:HIGH with AXIS one of {}, got: {}'.format(', '.join(AXIS_NAMES),
+                                                                         text))
 
 
 def parse_arguments():
@@ -13,17 +30,47 @@ def parse_arguments():
     parser.add_argument('-p',
                         '--pool',
                         type=str,
-                        required=True,
                         help='A string containing the EotE dice pool, annotated using the first '
                              'letter of color of the die (except for black Setback dice, '
-                             'which use "k".  Example: "yygbrppk".')
+                             'which use "k", and white Force dice, which use "w").  Example: '
+                             '"yygbrppk".')
 
     parser.add_argument('-r',
                         '--roll',
                         action='store_true',
                         help='Roll the dice pool.')
+    parser.add_argument('-n',
+                        '--count',
+                        type=int,
+                        default=None,
+                        help='With --roll, roll the pool this many times and stream a line per '
+                             'roll, with the full and net symbols separated by a tab.')
+    parser.add_argument('--roll-format',
+                        choices=('color', 'plain', 'csv', 'binary'),
+                        default='plain',
+                        help='Output of --count: symbols in color, plain symbols, CSV of the net '
+                             'results, or binary records of the net results as six signed bytes '
+                             '(triumph, success, advantage, despair, light, dark) (default: '
+                             'plain).')
 
-    subparsers = parser.add_subparsers()
+    parser.add_argument('--disk-cache',
+                        nargs='?',
+                        const='',
+                        default=None,
+                        metavar='DIRECTORY',
+                        help='Keep pool distributions on disk and reuse them in later runs '
+                             '(default directory: $XDG_CACHE_HOME/eote-dice).')
+    parser.add_argument('--table',
+                        type=str,
+                        metavar='PATH',
+                        help='Answer queries from a table precomputed with the table command '
+                             'when it covers them.')
+    parser.add_argument('--float',
+                        action='store_true',
+                        help='Compute float64 probabilities instead of exact counts.  Much faster '
+                             'for large pools, accurate to about 1e-10.')
+
+    subparsers = parser.add_subparsers(dest='command')
     analysis_parser = subparsers.add_parser('analyze', help='Analysis commands.')
     analysis_parser.add_argument('-t',
                                  '--triumph-cutoff',
@@ -49,29 +96,471 @@ def parse_arguments():
                                  required=False,
                                  default=None,
                                  help='Return probability of at least this many despair.')
+    analysis_parser.add_argument('--light-cutoff',
+                                 type=int,
+                                 required=False,
+                                 default=None,
+                                 help='Return probability of at least this many light side Force '
+                                      'points.')
+    analysis_parser.add_argument('--dark-cutoff',
+                                 type=int,
+                                 required=False,
+                                 default=None,
+                                 help='Return probability of at least this many dark side Force '
+                                      'points.')
+    analysis_parser.add_argument('--grid',
+                                 type=parse_grid,
+                                 action='append',
+                                 metavar='AXIS=LOW:HIGH',
+                                 help='Print the probability of every cutoff from LOW to HIGH on '
+                                      'AXIS (triumph, success, advantage, despair, light or '
+                                      'dark) as a JSON '
+                                      'matrix, e.g. --grid success=-2:5 --grid advantage=-3:3.  '
+                                      'Other cutoffs given apply to every cell.')
+    analysis_parser.add_argument('--sensitivity',
+                                 action='store_true',
+                                 help='Report how adding, removing or upgrading one die of each '
+                                      'color changes the mean and the probability of the '
+                                      'cutoffs given.')
+    analysis_parser.add_argument('--monte-carlo',
+                                 action='store_true',
+                                 help='Estimate the mean and probability by rolling the pool '
+                                      'many times instead of computing its distribution, for '
+                                      'very large pools.')
+    analysis_parser.add_argument('--precision',
+                                 type=float,
+                                 default=0.01,
+                                 help='With --monte-carlo, stop once every 95%% confidence '
+                                      'interval is within this of the estimate (default: '
+                                      '0.01).')
+    analysis_parser.add_argument('--time-budget',
+                                 type=float,
+                                 default=5.0,
+                                 help='With --monte-carlo, stop after this many seconds '
+                                      '(default: 5).')
+    analysis_parser.add_argument('--seed',
+                                 type=int,
+                                 default=None,
+                                 help='With --monte-carlo or --simulate, seed the rolls to make '
+                                      'the results reproducible.')
+    analysis_parser.add_argument('--simulate',
+                                 type=int,
+                                 default=None,
+                                 metavar='ROLLS',
+                                 help='Roll the pool this many times across --workers processes '
+                                      'and print the mean and probability of the rolls.  A '
+                                      'given --seed gives the same result for any number of '
+                                      'workers.')
+    analysis_parser.add_argument('--workers',
+                                 type=int,
+                                 default=1,
+                                 help='With --simulate, number of worker processes (default: '
+                                      '1).')
+
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Answer a stream of queries, one JSON object per line, e.g. '
+             '{"pool": "yygp", "success_cutoff": 1, "distribution": true}.')
+    batch_parser.add_argument('input',
+                              nargs='?',
+                              type=argparse.FileType('r'),
+                              default=sys.stdin,
+                              help='File of JSON queries (default: stdin).')
+    batch_parser.add_argument('--distribution',
+                              action='store_true',
+                              help='Include the full distribution in every answer.')
+    batch_parser.add_argument('--line-buffered',
+                              action='store_true',
+                              help='Flush after every answer, for interactive use over a pipe.')
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Run a local HTTP server answering /analyze, /probability, /roll and /stats.')
+    serve_parser.add_argument('--host',
+                              type=str,
+                              default='127.0.0.1',
+                              help='Address to listen on (default: 127.0.0.1).')
+    serve_parser.add_argument('--port',
+                              type=int,
+                              default=8000,
+                              help='Port to listen on (default: 8000).')
+    serve_parser.add_argument('--workers',
+                              type=int,
+                              default=None,
+                              help='Number of worker threads building pools.')
+
+    table_parser = subparsers.add_parser(
+        'table',
+        help='Precompute the statistics of every pool with up to --max-per-color dice of each '
+             'color into a table file, for use with --table.')
+    table_parser.add_argument('output',
+                              type=str,
+                              help='Table file to write.')
+    table_parser.add_argument('--max-per-color',
+                              type=int,
+                              default=6,
+                              help='Largest number of dice of each color (default: 6).')
+    table_parser.add_argument('--triumph-max',
+                              type=int,
+                              default=1,
+                              help='Largest triumph cutoff stored (default: 1).')
+    table_parser.add_argument('--success-range',
+                              type=int,
+                              nargs=2,
+                              default=(-3, 3),
+                              metavar=('LOW', 'HIGH'),
+                              help='Range of success cutoffs stored (default: -3 3).')
+    table_parser.add_argument('--advantage-range',
+                              type=int,
+                              nargs=2,
+                              default=(-3, 3),
+                              metavar=('LOW', 'HIGH'),
+                              help='Range of advantage cutoffs stored (default: -3 3).')
+    table_parser.add_argument('--despair-max',
+                              type=int,
+                              default=1,
+                              help='Largest despair cutoff stored (default: 1).')
+    table_parser.add_argument('--workers',
+                              type=int,
+                              default=None,
+                              help='Number of worker processes (default: one per core).')
+
+    sweep_parser = subparsers.add_parser(
+        'sweep',
+        help='Compute the mean and cutoff probabilities of every pool in a range of dice '
+             'counts, in parallel, e.g. --range g 0 5 --range p 0 5 --cutoff success=1.')
+    sweep_parser.add_argument('--range',
+                              nargs=3,
+                              action='append',
+                              required=True,
+                              dest='ranges',
+                              metavar=('COLOR', 'LOW', 'HIGH'),
+                              help='Number of dice of a color to sweep over.  Repeat for each '
+                                   'color.')
+    sweep_parser.add_argument('--cutoff',
+                              action='append',
+                              default=[],
+                              dest='cutoffs',
+                              help='Probability to compute for every pool, e.g. '
+                                   '"success=1,advantage=2".  May be repeated.')
+    sweep_parser.add_argument('--format',
+                              choices=('csv', 'json'),
+                              default='csv',
+                              help='Output format (default: csv).')
+    sweep_parser.add_argument('--workers',
+                              type=int,
+                              default=None,
+                              help='Number of worker processes (default: one per core).')
+
+    optimize_parser = subparsers.add_parser(
+        'optimize',
+        help='Find the pools with the fewest dice that reach a target probability, on top of '
+             'the --pool dice if given, e.g. --pool yyg optimize --range p 0 5 --range r 0 3 '
+             '--cutoff success=1 --target 0.4 --at-most.')
+    optimize_parser.add_argument('--range',
+                                 nargs=3,
+                                 action='append',
+                                 required=True,
+                                 dest='ranges',
+                                 metavar=('COLOR', 'LOW', 'HIGH'),
+                                 help='Number of dice of a color to add.  Repeat for each '
+                                      'color.')
+    optimize_parser.add_argument('--cutoff',
+                                 required=True,
+                                 help='Cutoff whose probability to reach, e.g. '
+                                      '"success=1,advantage=2".')
+    optimize_parser.add_argument('--target',
+                                 type=float,
+                                 required=True,
+                                 help='Probability to reach, between 0 and 1.')
+    optimize_parser.add_argument('--at-most',
+                                 action='store_true',
+                                 help='Find the pools whose probability is at most the target '
+                                      'rather than at least.')
+
+    args = parser.parse_args()
+    if args.pool is None and args.command not in ('batch', 'optimize', 'serve', 'sweep',
+                                                  'table'):
+        parser.error('the following arguments are required: -p/--pool')
+    if args.count is not None and (not args.roll or args.command is not None):
+        parser.error('argument -n/--count: only allowed with -r/--roll and no command')
+    return args
+
+
+def answer_query(query: dict, dice_pool: DicePool = None, distribution: bool = False) -> dict:
+    """Answer one batch query, with ``dice_pool`` if the pool of the query is already built.
+
+    Distributions are shared between queries by the process-wide distribution cache, which
+    keeps within its byte limit.
+    """
+    pool_string = query['pool']
+    if dice_pool is None:
+        dice_pool = DicePool.from_string(pool_string)
+
+    mean = dice_pool.mean()
+    answer = {
+        'pool': pool_string,
+        'mean': {
+            'triumph': mean.triumph,
+            'success': mean.success,
+            'advantage': mean.advantage,
+            'despair': mean.despair,
+            'light': mean.light,
+            'dark': mean.dark,
+        },
+    }
+
+    cutoffs = {name: query.get(name) for name in CUTOFF_NAMES}
+    for name, cutoff in cutoffs.items():
+        if cutoff is not None and (not isinstance(cutoff, int) or isinstance(cutoff, bool)):
+            raise ValueError('{} must be an integer, not {!r}.'.format(name, cutoff))
+    if any(cutoff is not None for cutoff in cutoffs.values()):
+        answer['probability_above'] = dice_pool.probability_above(**cutoffs)
 
-    return parser.parse_args()
+    if query.get('distribution', distribution):
+        answer['distribution'] = [list(value) + [frequency] for value, frequency
+                                  in sorted(dice_pool.distribution.to_mapping().items())]
+    return answer
+
+
+def run_batch(lines: Iterable[str], output: TextIO, distribution: bool = False,
+              line_buffered: bool = False) -> None:
+    """Write one JSON answer line to ``output`` for every JSON query line."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            query = json.loads(line)
+            answer = answer_query(query, distribution=distribution)
+        except (ValueError, KeyError, TypeError) as e:
+            answer = {'error': str(e)}
+        output.write(json.dumps(answer))
+        output.write('\n')
+        if line_buffered:
+            output.flush()
+    output.flush()
+
+
+def grid_answer(dice_pool: DicePool, args: argparse.Namespace) -> dict:
+    """Return the --grid probabilities of the pool as a JSON-serializable dict."""
+    fixed_cutoffs = tuple(getattr(args, name) for name in CUTOFF_NAMES)
+    cutoffs = [None if cut is None else [cut] for cut in fixed_cutoffs]
+    grid_axes = []
+    for axis, axis_cutoffs in args.grid:
+        cutoffs[axis] = axis_cutoffs
+        if axis not in grid_axes:
+            grid_axes.append(axis)
+    grid_axes.sort()
+
+    grid = dice_pool.probability_grid(*cutoffs)
+    # Drop the dimensions of the fixed cutoffs, which have a single entry.
+    grid = grid[tuple(slice(None) if axis in grid_axes else 0
+                      for axis, axis_cutoffs in enumerate(cutoffs) if axis_cutoffs is not None)]
+    return {
+        'pool': DicePool.canonical_string(args.pool),
+        'axes': [AXIS_NAMES[axis] for axis in grid_axes],
+        'cutoffs': {AXIS_NAMES[axis]: cutoffs[axis] for axis in grid_axes},
+        'fixed_cutoffs': {AXIS_NAMES[axis]: cut for axis, cut in enumerate(fixed_cutoffs)
+                          if cut is not None and axis not in grid_axes},
+        'probability_above': grid.tolist(),
+    }
+
+
+def print_cutoffs(args: argparse.Namespace) -> None:
+    if args.triumph_cutoff is not None:
+        print('\tTriumph: {}'.format(args.triumph_cutoff))
+    if args.success_cutoff is not None:
+        print('\tSuccess: {}'.format(args.success_cutoff))
+    if args.advantage_cutoff is not None:
+        print('\tAdvantage: {}'.format(args.advantage_cutoff))
+    if args.despair_cutoff is not None:
+        print('\tDespair: {}'.format(args.despair_cutoff))
+    if args.light_cutoff is not None:
+        print('\tLight: {}'.format(args.light_cutoff))
+    if args.dark_cutoff is not None:
+        print('\tDark: {}'.format(args.dark_cutoff))
+
+
+def print_sensitivity(dice_pool: DicePool, args: argparse.Namespace) -> None:
+    import colorama
+
+    cutoff = tuple(getattr(args, name) for name in CUTOFF_NAMES)
+    has_cutoff = any(cut is not None for cut in cutoff)
+    changes = dice_pool.sensitivity([cutoff] if has_cutoff else [])
+    print('{}Sensitivity:'.format(colorama.Style.BRIGHT))
+    for change in changes:
+        line = '\t{:<7} {}: '.format(change.action, change.color)
+        line += '  '.join('{} {:+.2f}'.format(name, delta)
+                          for name, delta in zip(AXIS_NAMES, change.mean))
+        if has_cutoff:
+            delta = change.probability_above[0]
+            if delta > 0.0:
+                color = colorama.Fore.GREEN
+            elif delta < 0.0:
+                color = colorama.Fore.RED
+            else:
+                color = colorama.Fore.RESET
+            line += '  probability {}{:+.2f}%{}'.format(color, delta * 100, colorama.Fore.RESET)
+        print(line)
+    if has_cutoff:
+        print_cutoffs(args)
+
+
+def print_simulation(dice_pool: DicePool, args: argparse.Namespace) -> None:
+    import colorama
+
+    import simulation
+
+    if args.light_cutoff is not None or args.dark_cutoff is not None:
+        raise ValueError('--simulate does not roll Force points, whose distribution is cheap to '
+                         'compute exactly.')
+    result = simulation.simulate(dice_pool, args.simulate, args.seed, args.workers)
+
+    print('{}Simulated:{} {} rolls with --seed {}'.format(
+        colorama.Style.BRIGHT, colorama.Style.RESET_ALL, result.samples, result.seed))
+    print('{}Mean:{} {}'.format(colorama.Style.BRIGHT, colorama.Style.RESET_ALL,
+                                tuple(round(m, 3) for m in result.histogram.mean())))
+    cutoff = (args.triumph_cutoff, args.success_cutoff, args.advantage_cutoff,
+              args.despair_cutoff)
+    if any(cut is not None for cut in cutoff):
+        print('{}Probability Above: {}%'.format(
+            colorama.Style.BRIGHT,
+            round(result.histogram.probability_above(cutoff) * 100, 2)))
+        print_cutoffs(args)
+
+
+def print_monte_carlo(dice_pool: DicePool, args: argparse.Namespace) -> None:
+    import colorama
+    import numpy
+
+    import simulation
+
+    if args.light_cutoff is not None or args.dark_cutoff is not None:
+        raise ValueError('--monte-carlo does not estimate Force points, whose distribution is '
+                         'cheap to compute exactly.')
+    cutoff = (args.triumph_cutoff, args.success_cutoff, args.advantage_cutoff,
+              args.despair_cutoff)
+    result = simulation.monte_carlo(dice_pool, cutoff, args.precision, args.time_budget,
+                                    rng=numpy.random.default_rng(args.seed))
+
+    print('{}Monte Carlo:{} {} rolls in {:.2f}s{}'.format(
+        colorama.Style.BRIGHT, colorama.Style.RESET_ALL, result.samples, result.elapsed,
+        '' if result.converged else ', time budget reached before the requested precision'))
+    print('{}Mean (95% confidence):'.format(colorama.Style.BRIGHT))
+    for name, estimate in zip(('Triumph', 'Success', 'Advantage', 'Despair'), result.mean):
+        print('\t{}: {}'.format(name, simulation.format_estimate(estimate)))
+    if result.probability_above is not None:
+        print('{}Probability Above: {}%'.format(
+            colorama.Style.BRIGHT,
+            simulation.format_estimate(result.probability_above, scale=100, digits=2)))
+        print_cutoffs(args)
+
+    if result.exact_mean is not None:
+        print('{}Exact:{} mean {}'.format(colorama.Style.BRIGHT, colorama.Style.RESET_ALL,
+                                          tuple(round(m, 3) for m in result.exact_mean)),
+              end='')
+        if result.exact_probability_above is not None:
+            print(', probability above {}%'.format(
+                round(result.exact_probability_above * 100, 2)), end='')
+        print()
+        mismatches = simulation.exact_mismatches(result)
+        if mismatches:
+            print('{}Outside the confidence interval: {}'.format(colorama.Fore.RED,
+                                                                 ', '.join(mismatches)))
 
 
 def main() -> None:
-    colorama.init(autoreset=True, strip=False)
     args = parse_arguments()
+    if args.float:
+        DicePool.default_exact = False
+    if args.disk_cache is not None:
+        use_disk_cache(args.disk_cache or None)
+    if args.table is not None:
+        import table
+        table.use_pool_table(args.table)
+    if args.command == 'batch':
+        run_batch(args.input, sys.stdout, args.distribution, args.line_buffered)
+        return
+    if args.command == 'table':
+        import table
+        table.generate(args.output,
+                       table.TableLayout(args.max_per_color, args.triumph_max, args.success_range,
+                                         args.advantage_range, args.despair_max),
+                       args.workers)
+        return
+    if args.command == 'sweep':
+        import sweep
+        try:
+            ranges = {color: (int(low), int(high)) for color, low, high in args.ranges}
+            cutoffs = [sweep.parse_cutoff(cutoff) for cutoff in args.cutoffs]
+            results = sweep.sweep(ranges, cutoffs, workers=args.workers)
+            write = sweep.write_csv if args.format == 'csv' else sweep.write_json
+            write(results, sys.stdout, cutoffs)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        return
+    if args.command == 'optimize':
+        import optimize
+        import sweep
+        try:
+            ranges = {color: (int(low), int(high)) for color, low, high in args.ranges}
+            cutoff = sweep.parse_cutoff(args.cutoff, AXIS_NAMES)
+            for result in optimize.optimize(args.pool or '', ranges, cutoff, args.target,
+                                            args.at_most):
+                print(json.dumps({'pool': result.pool, 'probability_above': result.probability}))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        return
+    if args.command == 'serve':
+        import server
+        server.serve(args.host, args.port, args.workers)
+        return
+
+    if args.count is not None:
+        import rolls
+        try:
+            rolls.write_rolls(DicePool.from_string(args.pool), args.count, sys.stdout.buffer,
+                              args.roll_format)
+            sys.stdout.flush()
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(2)
+        except BrokenPipeError:
+            # The reader stopped early, e.g. head.  Keep the interpreter from failing to flush
+            # stdout again on exit.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        return
+
+    if args.command == 'analyze' and args.grid:
+        try:
+            print(json.dumps(grid_answer(DicePool.from_string(args.pool), args)))
+        except ValueError as e:
+            print(e)
+        return
+
+    # Only the interactive commands print in color.
+    import colorama
+    colorama.init(autoreset=True, strip=False)
 
     try:
         dice_pool = DicePool.from_string(args.pool)
         print('Dice Pool: {}'.format(dice_pool))
 
-        if hasattr(args, 'triumph_cutoff'):
+        if args.command == 'analyze' and args.monte_carlo:
+            print_monte_carlo(dice_pool, args)
+        elif args.command == 'analyze' and args.simulate is not None:
+            print_simulation(dice_pool, args)
+        elif args.command == 'analyze' and args.sensitivity:
+            print(dice_pool.mean())
+            print_sensitivity(dice_pool, args)
+        elif args.command == 'analyze':
             print(dice_pool.mean())
-            if (args.triumph_cutoff is not None or
-               args.success_cutoff is not None or
-               args.advantage_cutoff is not None or
-               args.despair_cutoff is not None):
-                probability_above = dice_pool.probability_above(
-                    triumph_cutoff=args.triumph_cutoff,
-                    success_cutoff=args.success_cutoff,
-                    advantage_cutoff=args.advantage_cutoff,
-                    despair_cutoff=args.despair_cutoff)
+            cutoffs = {name: getattr(args, name) for name in CUTOFF_NAMES}
+            if any(cutoff is not None for cutoff in cutoffs.values()):
+                probability_above = dice_pool.probability_above(**cutoffs)
                 if probability_above >= 0.5:
                     probability_color = colorama.Fore.GREEN
                 else:
@@ -82,14 +571,7 @@ def main() -> None:
                     probability_color,
                     round(probability_above, 2) * 100,
                     colorama.Style.RESET_ALL))
-                if args.triumph_cutoff is not None:
-                    print('\tTriumph: {}'.format(args.triumph_cutoff))
-                if args.success_cutoff is not None:
-                    print('\tSuccess: {}'.format(args.success_cutoff))
-                if args.advantage_cutoff is not None:
-                    print('\tAdvantage: {}'.format(args.advantage_cutoff))
-                if args.despair_cutoff is not None:
-                    print('\tDespair: {}'.format(args.despair_cutoff))
+                print_cutoffs(args)
         elif args.roll:
             symbols_ascii, cancelled_symbols_ascii = dice_pool.roll_ascii()
             print('Full Roll: {}'.format(symbols_ascii))
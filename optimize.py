@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Search for the pools with the fewest dice that reach a target probability.
+
+Every candidate pool has the same fixed dice plus a number of dice of each variable color.
+Only the axes the cutoff constrains are convolved: the search starts from the distribution of
+the fixed dice and adds one die at a time while walking the counts, so no candidate is built
+from scratch.
+
+Dice that can only move the probability one way prune the search.  If every outcome of a die
+is at least zero on the constrained axes, adding it can only raise probability_above(), and if
+every outcome is at most zero it can only lower it.  Extra dice that move away from the target
+never give a minimal pool, and once a die that moves toward it reaches the target, more of it
+cannot either.
+"""
+
+import collections
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+from dice import AXES, dice_from_color_char, DicePool, NON_NEGATIVE_AXES
+from distribution import QuadDistribution
+
+Counts = Tuple[int, ...]
+
+OptimizedPool = collections.namedtuple('OptimizedPool', [
+    # The canonical pool string, fixed dice included.
+    'pool',
+    # Number of dice of each variable color, in the order of the ranges.
+    'counts',
+    'probability',
+])
+
+# How adding a die moves probability_above(), see _direction().
+_RAISES = 1
+_LOWERS = -1
+_NEITHER = 0
+
+
+def _direction(distribution: QuadDistribution) -> Optional[int]:
+    """Return how adding a die with this (marginal) distribution moves probability_above(),
+    or None if it can move it both ways."""
+    outcomes = list(distribution.to_mapping())
+    if all(value == 0 for outcome in outcomes for value in outcome):
+        return _NEITHER
+    if all(value >= 0 for outcome in outcomes for value in outcome):
+        return _RAISES
+    if all(value <= 0 for outcome in outcomes for value in outcome):
+        return _LOWERS
+    return None
+
+
+def _minimal(candidates: Sequence[Tuple[Counts, float]]) -> List[Tuple[Counts, float]]:
+    """Return the candidates without another candidate that has at most as many dice of every
+    color."""
+    return [(counts, probability) for counts, probability in candidates
+            if not any(other != counts and all(o <= c for o, c in zip(other, counts))
+                       for other, _ in candidates)]
+
+
+def optimize(fixed: str,
+             ranges: Mapping[str, Tuple[int, int]],
+             cutoff: Sequence[Optional[int]],
+             target: float,
+             at_most: bool = False,
+             exact: bool = None) -> List[OptimizedPool]:
+    """Return the minimal pools whose probability_above(cutoff) is at least ``target``, or at
+    most ``target`` if ``at_most`` is set.
+
+    ``fixed`` is a pool string of the dice every pool has, ``ranges`` maps each variable color
+    to the lowest and highest number of its dice, e.g. ``{'p': (0, 5), 'r': (0, 3)}``, and
+    ``cutoff`` has an entry per axis of AXES (missing trailing entries are None).  A pool is
+    minimal if no other pool reaching the target has at most as many dice of every variable
+    color.  Pools are sorted by their number of variable dice.
+    """
+    if exact is None:
+        exact = DicePool.default_exact
+    if not 0.0 <= target <= 1.0:
+        raise ValueError('Target probability must be between 0 and 1: {}'.format(target))
+    for color, (low, high) in ranges.items():
+        dice_from_color_char(color)
+        if not 0 <= low <= high:
+            raise ValueError('Invalid range for {}: {} to {}'.format(color, low, high))
+    cutoff = tuple(cutoff) + (None,) * (len(AXES) - len(cutoff))
+    axes = tuple(axis for axis, cut in enumerate(cutoff)
+                 if cut is not None and not (axis in NON_NEGATIVE_AXES and cut <= 0))
+    if not axes:
+        raise ValueError('The cutoff must constrain at least one axis.')
+    axis_cutoff = tuple(cutoff[axis] for axis in axes)
+
+    colors = list(ranges)
+    dice_distributions = {}
+    directions = {}
+    for color in colors:
+        dice_distribution = dice_from_color_char(color).marginal_distribution(axes)
+        if not exact:
+            dice_distribution = dice_distribution.normalized()
+        dice_distributions[color] = dice_distribution
+        directions[color] = _direction(dice_distribution)
+    toward = _LOWERS if at_most else _RAISES
+
+    # Every pool starts with the fixed dice and the lowest count of each color.  Colors that
+    # never move toward the target stay there, the others are searched: those that can move
+    # both ways first, then those that move toward the target, so that every color after one
+    # of those moves toward it too.
+    base = DicePool.from_string(fixed, exact).marginal_distribution(axes)
+    for color in colors:
+        base = base.add(dice_distributions[color].power(ranges[color][0]))
+    searched = ([color for color in colors if directions[color] is None] +
+                [color for color in colors if directions[color] == toward])
+
+    # most[i] adds the highest count of every searched color from the i-th on, for those that
+    # move toward the target: the furthest toward it the rest of the search can get.
+    most = [QuadDistribution.identity(len(axes))]
+    for color in reversed(searched):
+        if directions[color] != toward:
+            break
+        low, high = ranges[color]
+        most.insert(0, most[0].add(dice_distributions[color].power(high - low)))
+    most = [None] * (len(searched) + 1 - len(most)) + most
+
+    def probability(distribution: QuadDistribution) -> float:
+        return distribution.probability_above(axis_cutoff)
+
+    def reaches(distribution: QuadDistribution) -> bool:
+        if at_most:
+            return probability(distribution) <= target
+        return probability(distribution) >= target
+
+    counts = {color: low for color, (low, _) in ranges.items()}
+    candidates = []
+
+    def record(distribution: QuadDistribution) -> None:
+        candidates.append((tuple(counts[color] for color in colors), probability(distribution)))
+
+    def visit(distribution: QuadDistribution, depth: int) -> None:
+        if depth == len(searched):
+            if reaches(distribution):
+                record(distribution)
+            return
+        if most[depth] is not None and not reaches(distribution.add(most[depth])):
+            # Not even the most dice of every remaining color reach the target.
+            return
+
+        color = searched[depth]
+        low, high = ranges[color]
+        for count in range(low, high + 1):
+            if count > low:
+                distribution = distribution.add(dice_distributions[color])
+            counts[color] = count
+            if directions[color] == toward:
+                # The remaining colors are at their lowest counts.  Once that reaches the
+                # target, any pool with more of this color has more dice than this one.
+                if reaches(distribution):
+                    record(distribution)
+                    break
+                if depth + 1 < len(searched):
+                    visit(distribution, depth + 1)
+            else:
+                visit(distribution, depth + 1)
+        counts[color] = low
+
+    visit(base, 0)
+
+    results = []
+    for pool_counts, pool_probability in _minimal(candidates):
+        pool_string = fixed + ''.join(color * count for color, count in zip(colors, pool_counts))
+        results.append(OptimizedPool(DicePool.canonical_string(pool_string), pool_counts,
+                                     pool_probability))
+    results.sort(key=lambda result: (sum(result.counts), result.counts))
+    return results
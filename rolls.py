@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Stream many rolls of a pool to a binary output, in large chunks.
+
+Rolls come from DicePool.roll_stream() a batch at a time, and each batch is formatted with
+array operations into one write: the text of a line is looked up from the count of each
+symbol, or each net value, rather than built roll by roll.  The binary format writes each roll
+as a record of NET_RECORD, the net outcome along every axis of AXES as a signed byte.
+"""
+
+from typing import BinaryIO, Sequence, Tuple
+
+import numpy
+
+from dice import AXES, DicePool, ROLL_BATCH_SIZE, Symbol, symbol_to_net
+
+FORMATS = ('color', 'plain', 'csv', 'binary')
+
+NET_RECORD = numpy.dtype([(name, 'i1') for name in AXES])
+
+
+# Rows of a chunk joined at a time, so the padded rows take at most this many bytes.
+_JOIN_MAX_BYTES = 1 << 24
+
+
+def _symbol_text(symbol: Symbol, format: str) -> bytes:
+    if format == 'color':
+        return DicePool._symbols_to_ascii_([symbol]).encode()
+    return symbol.value.encode()
+
+
+def _join_columns(columns: Sequence[Tuple[Sequence[bytes], numpy.ndarray]]) -> bytes:
+    """Return the texts picked by each column's ``(texts, indices)``, concatenated across the
+    columns of every row and then row after row.
+
+    Each column's texts are padded into a byte table, the tables are indexed for every row, and
+    the padding is masked out, so no row is formatted on its own.
+    """
+    tables = []
+    for texts, indices in columns:
+        lengths = numpy.array([len(text) for text in texts])
+        table = numpy.zeros((len(texts), max(lengths.max(), 1)), dtype=numpy.uint8)
+        for i, text in enumerate(texts):
+            table[i, :len(text)] = numpy.frombuffer(text, dtype=numpy.uint8)
+        padding = numpy.arange(table.shape[1]) >= lengths[:, numpy.newaxis]
+        tables.append((table, padding, indices))
+
+    width = sum(table.shape[1] for table, _, _ in tables)
+    rows = len(columns[0][1]) if columns else 0
+    step = max(1, _JOIN_MAX_BYTES // width)
+    chunks = []
+    for start in range(0, rows, step):
+        part = slice(start, start + step)
+        padded = numpy.hstack([table[indices[part]] for table, _, indices in tables])
+        mask = ~numpy.hstack([padding[indices[part]] for _, padding, indices in tables])
+        chunks.append(padded[mask].tobytes())
+    return b''.join(chunks)
+
+
+def _constant(text: bytes, rows: int) -> Tuple[Sequence[bytes], numpy.ndarray]:
+    return [text], numpy.zeros(rows, dtype=numpy.intp)
+
+
+def format_chunk(raw_counts: numpy.ndarray, format: str) -> bytes:
+    """Return the output of a batch of rolls, as yielded by DicePool.roll_stream().
+
+    The text formats have a line per roll with the full and the net symbols separated by a tab,
+    as the Full Roll and Net Roll of ``--roll``.  CSV has a line per roll with the net outcome
+    along each of AXES.
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown roll format: {}.  Valid formats: {}'.format(
+            format, ', '.join(FORMATS)))
+    net = raw_counts @ numpy.array(symbol_to_net, dtype=numpy.int16)
+    if format == 'binary':
+        return net.astype(numpy.int8).view(NET_RECORD).tobytes()
+
+    rows = len(raw_counts)
+    columns = []
+    if format == 'csv':
+        for axis in range(len(AXES)):
+            if axis:
+                columns.append(_constant(b',', rows))
+            low = int(net[:, axis].min(initial=0))
+            high = int(net[:, axis].max(initial=0))
+            columns.append(([str(value).encode() for value in range(low, high + 1)],
+                            net[:, axis] - low))
+    else:
+        cancelled = DicePool.cancel_symbol_counts(raw_counts)
+        # Symbol order is the order of power, as DicePool._sort_symbol_by_power().
+        for i, symbol_counts in enumerate((raw_counts, cancelled)):
+            if i:
+                columns.append(_constant(b'\t', rows))
+            for symbol, counts in zip(Symbol, symbol_counts.T):
+                text = _symbol_text(symbol, format)
+                columns.append(([text * count for count in range(int(counts.max(initial=0)) + 1)],
+                                counts))
+    columns.append(_constant(b'\n', rows))
+    return _join_columns(columns)
+
+
+def _check_binary_range(pool: DicePool) -> None:
+    most = sum(int(abs(dice.face_table() @ numpy.array(symbol_to_net)).max())
+               for dice in pool.dice)
+    if most > numpy.iinfo(numpy.int8).max:
+        raise ValueError('Binary records only hold net results up to {}, but a pool of {} dice '
+                         'can roll {}.'.format(numpy.iinfo(numpy.int8).max, len(pool.dice), most))
+
+
+def write_rolls(pool: DicePool,
+                count: int,
+                output: BinaryIO,
+                format: str = 'plain',
+                rng: numpy.random.Generator = None,
+                batch_size: int = ROLL_BATCH_SIZE) -> None:
+    """Roll ``pool`` ``count`` times and write every roll to ``output`` in ``format``, one of
+    FORMATS, with a write per batch of rolls.  CSV starts with a header row."""
+    if format not in FORMATS:
+        raise ValueError('Unknown roll format: {}.  Valid formats: {}'.format(
+            format, ', '.join(FORMATS)))
+    if format == 'binary':
+        _check_binary_range(pool)
+    if format == 'csv':
+        output.write((','.join(AXES) + '\n').encode())
+    for raw_counts in pool.roll_stream(count, rng, batch_size):
+        output.write(format_chunk(raw_counts, format))
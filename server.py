@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""Local asyncio HTTP server answering dice pool analysis and roll requests.
+
+Endpoints (all ``GET``, parameters in the query string):
+
+- ``/analyze?pool=yygp[&success_cutoff=1...][&distribution=1]``
+- ``/probability?pool=yygp&success_cutoff=1[&advantage_cutoff=2...]``
+- ``/roll?pool=yygp[&count=10][&seed=42]``
+- ``/stats``
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+import traceback
+from typing import Dict, Tuple
+import urllib.parse
+
+import numpy
+
+from dice import DicePool
+from eote_dice import answer_query, CUTOFF_NAMES
+
+MAX_ROLL_COUNT = 10000
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ServerStats:
+    """Latency and throughput counters, reported by ``/stats``."""
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.requests = collections.Counter()
+        self.errors = 0
+        self.latency_total = collections.defaultdict(float)
+        self.latency_max = collections.defaultdict(float)
+        self.computations = 0
+        self.coalesced = 0
+
+    def record(self, path: str, latency: float, status: int) -> None:
+        self.requests[path] += 1
+        self.latency_total[path] += latency
+        self.latency_max[path] = max(self.latency_max[path], latency)
+        if status >= 400:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        uptime = time.monotonic() - self.start_time
+        total_requests = sum(self.requests.values())
+        return {
+            'uptime': uptime,
+            'requests': total_requests,
+            'errors': self.errors,
+            'requests_per_second': total_requests / uptime if uptime > 0 else 0.0,
+            'computations': self.computations,
+            'coalesced': self.coalesced,
+            'endpoints': {
+                path: {
+                    'requests': count,
+                    'mean_latency': self.latency_total[path] / count,
+                    'max_latency': self.latency_max[path],
+                } for path, count in self.requests.items()
+            },
+        }
+
+
+def _build_pool(pool_string: str) -> DicePool:
+    dice_pool = DicePool.from_string(pool_string)
+    # Do the lazy work up front, while still off the event loop.
+    dice_pool.distribution.survival()
+    dice_pool.mean()
+    return dice_pool
+
+
+def _roll(pool_string: str, count: int, seed: int = None) -> numpy.ndarray:
+    return DicePool.from_string(pool_string).roll_many(count, numpy.random.default_rng(seed))
+
+
+class AnalysisServer:
+    """Answers requests on the event loop, building pools and answers in a worker pool.
+
+    Concurrent requests for the same canonical pool share a single computation.
+    """
+
+    def __init__(self, executor: concurrent.futures.Executor = None):
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor()
+        self._executor = executor
+        self._in_flight = {}
+        self.stats = ServerStats()
+
+    async def pool(self, pool_string: str) -> DicePool:
+        pool_string = DicePool.canonical_string(pool_string)
+        future = self._in_flight.get(pool_string)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _build_pool, pool_string)
+            self._in_flight[pool_string] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(pool_string, None))
+            self.stats.computations += 1
+        else:
+            self.stats.coalesced += 1
+        # Shield the shared computation from clients that disconnect.
+        return await asyncio.shield(future)
+
+    async def _answer(self, query: dict, dice_pool: DicePool) -> dict:
+        # Force marginals and the full distribution mapping are not built by _build_pool, so
+        # keep them off the event loop too.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, answer_query, query, dice_pool)
+
+    async def analyze(self, params: Dict[str, str]) -> dict:
+        query = _query_from_params(params)
+        dice_pool = await self.pool(query['pool'])
+        return await self._answer(query, dice_pool)
+
+    async def probability(self, params: Dict[str, str]) -> dict:
+        query = _query_from_params(params)
+        if all(query.get(name) is None for name in CUTOFF_NAMES):
+            raise HTTPError(400, 'At least one cutoff is required: {}'.format(
+                ', '.join(CUTOFF_NAMES)))
+        dice_pool = await self.pool(query['pool'])
+        answer = await self._answer(query, dice_pool)
+        return {'pool': answer['pool'], 'probability_above': answer['probability_above']}
+
+    async def roll(self, params: Dict[str, str]) -> dict:
+        pool_string = _require(params, 'pool')
+        count = _int_param(params, 'count', 1)
+        if not 0 < count <= MAX_ROLL_COUNT:
+            raise HTTPError(400, 'count must be between 1 and {}'.format(MAX_ROLL_COUNT))
+        seed = _int_param(params, 'seed', None)
+
+        loop = asyncio.get_running_loop()
+        rolls = await loop.run_in_executor(self._executor, _roll, pool_string, count, seed)
+        return {'pool': pool_string, 'rolls': rolls.tolist()}
+
+    async def dispatch(self, method: str, path: str, params: Dict[str, str]) -> dict:
+        routes = {
+            '/analyze': self.analyze,
+            '/probability': self.probability,
+            '/roll': self.roll,
+        }
+        if path == '/stats':
+            return self.stats.to_dict()
+        if path not in routes:
+            raise HTTPError(404, 'Unknown endpoint: {}'.format(path))
+        if method != 'GET':
+            raise HTTPError(405, 'Only GET is supported.')
+        try:
+            return await routes[path](params)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        start = time.perf_counter()
+        path = None
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            # Skip the headers, nothing in them is needed.
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            method, target, _ = request_line.split(' ', 2)
+            url = urllib.parse.urlsplit(target)
+            path = url.path
+            params = dict(urllib.parse.parse_qsl(url.query))
+            status, body = 200, await self.dispatch(method, path, params)
+        except HTTPError as e:
+            status, body = e.status, {'error': str(e)}
+        except ValueError:
+            status, body = 400, {'error': 'Malformed request.'}
+        except Exception:
+            traceback.print_exc()
+            status, body = 500, {'error': 'Internal server error.'}
+
+        _write_response(writer, status, body)
+        try:
+            await writer.drain()
+        except ConnectionError:  # pragma: no cover
+            pass
+        writer.close()
+        self.stats.record(path or '<malformed>', time.perf_counter() - start, status)
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, body: dict) -> None:
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+    content = json.dumps(body).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\n'
+                 'Content-Type: application/json\r\n'
+                 'Content-Length: {}\r\n'
+                 'Connection: close\r\n'
+                 '\r\n'.format(status, reasons[status], len(content)).encode('latin-1'))
+    writer.write(content)
+
+
+def _require(params: Dict[str, str], name: str) -> str:
+    try:
+        return params[name]
+    except KeyError:
+        raise HTTPError(400, 'Missing parameter: {}'.format(name))
+
+
+def _int_param(params: Dict[str, str], name: str, default):
+    try:
+        return int(params[name])
+    except KeyError:
+        return default
+    except ValueError:
+        raise HTTPError(400, 'Parameter {} must be an integer.'.format(name))
+
+
+def _query_from_params(params: Dict[str, str]) -> dict:
+    query = {'pool': _require(params, 'pool')}
+    for name in CUTOFF_NAMES:
+        query[name] = _int_param(params, name, None)
+    query['distribution'] = params.get('distribution', '0').lower() in ('1', 'true', 'yes')
+    return query
+
+
+async def start_server(host: str, port: int,
+                       workers: int = None) -> Tuple[asyncio.AbstractServer, AnalysisServer]:
+    analysis_server = AnalysisServer(concurrent.futures.ThreadPoolExecutor(workers))
+    server = await asyncio.start_server(analysis_server.handle, host, port)
+    return server, analysis_server
+
+
+def serve(host: str, port: int, workers: int = None) -> None:  # pragma: no cover
+    async def run():
+        server, _ = await start_server(host, port, workers)
+        address = server.sockets[0].getsockname()
+        print('Serving on http://{}:{}'.format(address[0], address[1]), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
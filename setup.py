@@ -14,7 +14,7 @@ setuptools.setup(
     url='https://github.com/johnthagen/eote-dice',
 
     install_requires=open('requirements.txt').readlines(),
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     zip_safe=False,
 
     license='MIT',
@@ -27,8 +27,6 @@ setuptools.setup(
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: Implementation :: CPython',
@@ -36,7 +34,8 @@ setuptools.setup(
         'Topic :: Games/Entertainment :: Role-Playing',
     ],
 
-    py_modules=['eote_dice', 'dice', 'distribution'],
+    py_modules=['eote_dice', 'cache', 'dice', 'distribution', 'optimize', 'rolls', 'server',
+                'simulation', 'sweep', 'table'],
 
     scripts=['eote_dice.py'],
 
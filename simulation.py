@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""Monte Carlo estimates of pool statistics, for pools too large to enumerate interactively.
+
+Rolls are drawn in batches with DicePool.roll_many() until every requested statistic is
+known to within ``precision`` at the given confidence, or the time budget runs out.
+
+simulate() instead rolls a fixed number of times across worker processes and returns the
+histogram of the rolls, reproducibly: see its documentation.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import math
+import time
+from typing import Optional, Sequence, Tuple
+
+import numpy
+
+from dice import DiceColor, DicePool, NET_AXES, symbol_to_net
+from distribution import QuadDistribution
+
+# Cross-check against the exact distribution when its dense array would have at most this many
+# cells, which takes well under a second to build as float probabilities.
+EXACT_MAX_CELLS = 1000000
+
+DEFAULT_BATCH_SIZE = 100000
+
+# Rolls of each independent stream of simulate().
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+class Estimate(collections.namedtuple('Estimate', ['value', 'half_width'])):
+    """An estimated value and the half width of its confidence interval."""
+
+    __slots__ = ()
+
+    def contains(self, value: float) -> bool:
+        return abs(value - self.value) <= self.half_width
+
+
+MonteCarloResult = collections.namedtuple('MonteCarloResult', [
+    'samples',
+    'elapsed',
+    # Whether every interval reached the requested precision before the time budget ran out.
+    'converged',
+    # Estimates of (triumph, success, advantage, despair).
+    'mean',
+    # Estimate, or None if no cutoff was given.
+    'probability_above',
+    # The exact values, if they were cheap enough to compute, otherwise None.
+    'exact_mean',
+    'exact_probability_above',
+])
+
+
+SimulationResult = collections.namedtuple('SimulationResult', [
+    'samples',
+    # The entropy of the master seed, which reproduces the simulation when passed back.
+    'seed',
+    # QuadDistribution counting the rolls of each net (triumph, success, advantage, despair).
+    'histogram',
+])
+
+
+def z_score(confidence: float) -> float:
+    """Return the two-sided standard normal quantile of ``confidence``, e.g. 1.96 for 0.95."""
+    if not 0.0 < confidence < 1.0:
+        raise ValueError('Confidence must be between 0 and 1: {}'.format(confidence))
+    # Bisect erf(z / sqrt(2)) = confidence.
+    low, high = 0.0, 40.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def exact_cells(pool: DicePool) -> int:
+    """Return the number of cells of the dense distribution of ``pool``, a proxy for the cost
+    of computing it."""
+    spans = [1, 1, 1, 1]
+    for dice in pool.dice:
+        for axis, size in enumerate(dice.distribution.shape):
+            spans[axis] += size - 1
+    return int(numpy.prod(spans))
+
+
+def _proportion_estimate(hits: int, n: int, z: float) -> Estimate:
+    # Wilson score interval, which stays meaningful when no (or every) roll is a hit.
+    p = hits / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return Estimate(p, half_width + abs(center - p))
+
+
+def monte_carlo(pool: DicePool,
+                cutoff: Sequence[Optional[int]] = (None, None, None, None),
+                precision: float = 0.01,
+                time_budget: float = 5.0,
+                confidence: float = 0.95,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                rng: numpy.random.Generator = None,
+                cross_check: bool = True) -> MonteCarloResult:
+    """Estimate the mean of ``pool`` and, if any cutoff is set, its probability_above().
+
+    Sampling stops once every confidence interval is narrower than ``precision`` on each side,
+    or after ``time_budget`` seconds.  If ``cross_check`` is set and the pool is small enough
+    (see EXACT_MAX_CELLS), the exact values are computed too.
+    """
+    z = z_score(confidence)
+    if rng is None:
+        rng = numpy.random.default_rng()
+    has_cutoff = any(cut is not None for cut in cutoff)
+
+    n = 0
+    hits = 0
+    net_sum = numpy.zeros(4, dtype=numpy.int64)
+    net_square_sum = numpy.zeros(4, dtype=numpy.int64)
+    start = time.perf_counter()
+    while True:
+        net = pool.roll_many(batch_size, rng).astype(numpy.int64)
+        n += batch_size
+        net_sum += net.sum(axis=0)
+        net_square_sum += (net * net).sum(axis=0)
+        if has_cutoff:
+            made_cut = numpy.ones(batch_size, dtype=bool)
+            for axis, cut in enumerate(cutoff):
+                if cut is not None:
+                    made_cut &= net[:, axis] >= cut
+            hits += int(numpy.count_nonzero(made_cut))
+
+        mean = net_sum / n
+        variance = numpy.maximum(net_square_sum / n - mean * mean, 0.0) * n / max(n - 1, 1)
+        mean = tuple(Estimate(float(m), float(z * math.sqrt(v / n)))
+                     for m, v in zip(mean, variance))
+        probability = _proportion_estimate(hits, n, z) if has_cutoff else None
+
+        elapsed = time.perf_counter() - start
+        converged = all(estimate.half_width <= precision
+                        for estimate in mean + ((probability,) if has_cutoff else ()))
+        if converged or elapsed >= time_budget:
+            break
+
+    exact_mean = exact_probability = None
+    if cross_check and exact_cells(pool) <= EXACT_MAX_CELLS:
+        distribution = DicePool(pool.dice, exact=False).distribution
+        exact_mean = distribution.mean()
+        if has_cutoff:
+            exact_probability = distribution.probability_above(tuple(cutoff))
+
+    return MonteCarloResult(n, elapsed, converged, mean, probability, exact_mean,
+                            exact_probability)
+
+
+def format_estimate(estimate: Estimate, scale: float = 1.0, digits: int = 3) -> str:
+    return '{} +/- {}'.format(round(estimate.value * scale, digits),
+                              round(estimate.half_width * scale, digits))
+
+
+def exact_mismatches(result: MonteCarloResult) -> Tuple[str, ...]:
+    """Return the names of the estimates whose interval misses the exact value."""
+    names = []
+    if result.exact_mean is not None:
+        for name, estimate, exact in zip(('triumph', 'success', 'advantage', 'despair'),
+                                         result.mean, result.exact_mean):
+            if not estimate.contains(exact):
+                names.append(name)
+    if (result.exact_probability_above is not None and
+            not result.probability_above.contains(result.exact_probability_above)):
+        names.append('probability_above')
+    return tuple(names)
+
+
+def _net_bounds(pool: DicePool) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Return the lowest and highest net outcome ``pool`` can roll along each of NET_AXES."""
+    net = numpy.array(symbol_to_net, dtype=numpy.int64)[:, NET_AXES]
+    low = numpy.zeros(len(NET_AXES), dtype=numpy.int64)
+    high = numpy.zeros(len(NET_AXES), dtype=numpy.int64)
+    for dice in pool.dice:
+        side_net = dice.face_table() @ net
+        low += side_net.min(axis=0)
+        high += side_net.max(axis=0)
+    return low, high
+
+
+def _roll_histogram(pool_string: str, samples: int, seed: numpy.random.SeedSequence,
+                    low: numpy.ndarray,
+                    shape: Tuple[int, ...]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Roll the pool ``samples`` times from ``seed`` and return the flat indices of the net
+    outcomes rolled, and how many times each was."""
+    # The batches split the draws of the stream, so their size is part of the result too.
+    pool = DicePool.from_string(pool_string)
+    rng = numpy.random.default_rng(seed)
+    histogram = numpy.zeros(int(numpy.prod(shape)), dtype=numpy.int64)
+    for start in range(0, samples, DEFAULT_BATCH_SIZE):
+        net = pool.roll_many(min(DEFAULT_BATCH_SIZE, samples - start), rng)
+        indices = numpy.ravel_multi_index(tuple((net - low).T), shape)
+        counts = numpy.bincount(indices)
+        histogram[:len(counts)] += counts
+    rolled = numpy.flatnonzero(histogram)
+    return rolled, histogram[rolled]
+
+
+def simulate(pool: DicePool,
+             samples: int,
+             seed: Optional[int] = None,
+             workers: int = 1,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> SimulationResult:
+    """Roll ``pool`` ``samples`` times in ``workers`` processes and count each net outcome.
+
+    The rolls are split into chunks of ``chunk_size``, and the i-th chunk rolls with the i-th
+    child stream spawned from ``numpy.random.SeedSequence(seed)``, whichever process runs it.
+    Workers send back the counts of the outcomes they rolled rather than the rolls, and the
+    counts are summed as integers, so a given seed and chunk size give exactly the same
+    histogram for any number of workers.  If ``seed`` is None, fresh entropy is drawn and
+    returned in the result.
+    """
+    if samples < 1:
+        raise ValueError('Cannot simulate fewer than one roll: {}'.format(samples))
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be positive: {}'.format(chunk_size))
+    seed_sequence = numpy.random.SeedSequence(seed)
+    chunks = [min(chunk_size, samples - start) for start in range(0, samples, chunk_size)]
+    streams = seed_sequence.spawn(len(chunks))
+
+    pool_string = ''.join(DiceColor(type(dice)).name for dice in pool.dice)
+    low, high = _net_bounds(pool)
+    shape = tuple(int(size) for size in high - low + 1)
+    arguments = (itertools.repeat(pool_string), chunks, streams, itertools.repeat(low),
+                 itertools.repeat(shape))
+
+    histogram = numpy.zeros(int(numpy.prod(shape)), dtype=numpy.int64)
+    if workers == 1:
+        for rolled, counts in map(_roll_histogram, *arguments):
+            histogram[rolled] += counts
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for rolled, counts in executor.map(_roll_histogram, *arguments):
+                histogram[rolled] += counts
+
+    return SimulationResult(samples, seed_sequence.entropy,
+                            QuadDistribution.from_array(histogram.reshape(shape), low))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Parameter sweeps: the statistics of every pool in a range of dice counts.
+
+Each color's die is raised to every count in its range once, up front.  The worker processes
+receive those per-color distributions when they start and only combine them, so no worker
+rebuilds a color.  Results come back in pool order as soon as they are computed.
+"""
+
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, TextIO, Tuple
+
+from dice import dice_from_color_char, DiceColor, DicePool
+from distribution import QuadDistribution
+
+Cutoff = Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]
+
+CUTOFF_AXES = ('triumph', 'success', 'advantage', 'despair')
+
+SweepResult = collections.namedtuple('SweepResult', ['pool', 'mean', 'probabilities'])
+
+# Per-color distributions of the current worker process, set by _init_worker().
+_color_powers = None  # type: Dict[str, List[QuadDistribution]]
+
+
+def parse_cutoff(text: str, names: Sequence[str] = CUTOFF_AXES) -> Cutoff:
+    """Parse a cutoff such as ``'success=1,advantage=2'`` into a tuple with an entry per axis
+    of ``names``, by default (triumph, success, advantage, despair)."""
+    cutoff = [None] * len(names)
+    for term in text.split(','):
+        name, _, value = term.partition('=')
+        try:
+            cutoff[names.index(name.strip())] = int(value)
+        except ValueError:
+            raise ValueError('Invalid cutoff: {}.  Expected e.g. "success=1,advantage=2" with '
+                             'names from: {}'.format(term, ', '.join(names)))
+    return tuple(cutoff)
+
+
+def format_cutoff(cutoff: Cutoff) -> str:
+    return ','.join('{}>={}'.format(name, cut) for name, cut in zip(CUTOFF_AXES, cutoff)
+                    if cut is not None) or 'any'
+
+
+def sweep_pools(ranges: Mapping[str, Tuple[int, int]]) -> List[str]:
+    """Return every pool with ``low`` to ``high`` dice of each color of ``ranges``."""
+    for color, (low, high) in ranges.items():
+        dice_from_color_char(color)
+        if not 0 <= low <= high:
+            raise ValueError('Invalid range for {}: {} to {}'.format(color, low, high))
+    counts = itertools.product(*(range(low, high + 1) for low, high in ranges.values()))
+    return [DicePool.canonical_string(''.join(color * count
+                                              for color, count in zip(ranges, pool_counts)))
+            for pool_counts in counts]
+
+
+def _color_power_table(ranges: Mapping[str, Tuple[int, int]],
+                       exact: bool) -> Dict[str, List[QuadDistribution]]:
+    """Return the distribution of 0 to ``high`` dice of each color."""
+    color_powers = {}
+    for color, (_, high) in ranges.items():
+        die_distribution = DiceColor[color].value().distribution
+        if not exact:
+            die_distribution = die_distribution.normalized()
+        powers = [QuadDistribution()]
+        for _ in range(high):
+            powers.append(powers[-1].add(die_distribution))
+        color_powers[color] = powers
+    return color_powers
+
+
+def _init_worker(color_powers: Dict[str, List[QuadDistribution]]) -> None:
+    global _color_powers
+    _color_powers = color_powers
+
+
+def _pool_statistics(pool_string: str, cutoffs: Sequence[Cutoff]) -> SweepResult:
+    color_counts = collections.Counter(pool_string)
+    color_distributions = [_color_powers[color][count]
+                           for color, count in color_counts.items()]
+    # Smallest first, as in DicePool._build_distribution().
+    color_distributions.sort(key=QuadDistribution.num_outcomes)
+    distribution = QuadDistribution()
+    for color_distribution in color_distributions:
+        distribution = distribution.add(color_distribution)
+    return SweepResult(pool_string, distribution.mean(),
+                       tuple(distribution.probability_above(cutoff) for cutoff in cutoffs))
+
+
+def sweep(ranges: Mapping[str, Tuple[int, int]],
+          cutoffs: Sequence[Cutoff] = (),
+          exact: bool = None,
+          workers: int = None) -> Iterator[SweepResult]:
+    """Yield the mean and the probability of each cutoff for every pool of the sweep.
+
+    ``ranges`` maps a color to the lowest and highest number of its dice, e.g.
+    ``{'g': (0, 5), 'p': (0, 5)}``.  Pools are computed in ``workers`` processes and yielded
+    in the order of :func:`sweep_pools` while later pools are still being computed.
+
+    Raises ValueError for invalid ranges right away rather than once iterated.
+    """
+    if exact is None:
+        exact = DicePool.default_exact
+    pool_strings = sweep_pools(ranges)
+    cutoffs = [tuple(cutoff) for cutoff in cutoffs]
+    color_powers = _color_power_table(ranges, exact)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    return _stream(pool_strings, cutoffs, color_powers, workers)
+
+
+def _stream(pool_strings: Sequence[str], cutoffs: Sequence[Cutoff],
+            color_powers: Dict[str, List[QuadDistribution]],
+            workers: int) -> Iterator[SweepResult]:
+    # Small chunks keep the results streaming, while amortizing the round trips.
+    chunksize = max(1, len(pool_strings) // (workers * 16))
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                initargs=(color_powers,)) as executor:
+        yield from executor.map(_pool_statistics, pool_strings,
+                                itertools.repeat(cutoffs), chunksize=chunksize)
+
+
+def write_csv(results: Iterable[SweepResult], output: TextIO, cutoffs: Sequence[Cutoff]) -> None:
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(['pool'] + ['mean_' + name for name in CUTOFF_AXES] +
+                    [format_cutoff(cutoff) for cutoff in cutoffs])
+    for result in results:
+        writer.writerow([result.pool] + list(result.mean) + list(result.probabilities))
+        output.flush()
+
+
+def write_json(results: Iterable[SweepResult], output: TextIO, cutoffs: Sequence[Cutoff]) -> None:
+    """Write one JSON object per pool and line, as the batch command does."""
+    for result in results:
+        output.write(json.dumps({
+            'pool': result.pool,
+            'mean': dict(zip(CUTOFF_AXES, result.mean)),
+            'probability_above': dict(zip((format_cutoff(cutoff) for cutoff in cutoffs),
+                                          result.probabilities)),
+        }))
+        output.write('\n')
+        output.flush()
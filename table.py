@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""Precomputed, memory-mapped table of pool statistics.
+
+The table covers every pool with up to ``max_per_color`` dice of each color.  For each pool
+it stores the mean and the probability of every combination of cutoffs in a window:
+``None`` or 1 to ``triumph_max`` triumph, ``None`` or ``success_range`` success, ``None`` or
+``advantage_range`` advantage, and ``None`` or 1 to ``despair_max`` despair.  Pools and
+cutoffs outside the table fall back to computing the distribution.
+
+Statistics are computed from float64 probabilities (see QuadDistribution.normalized()).
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import os
+import struct
+import tempfile
+from typing import Iterable, Optional, Sequence, Tuple
+
+import numpy
+
+import dice
+from dice import dice_definitions_hash, DiceColor
+from distribution import QuadDistribution
+
+_MAGIC = b'EOTETBL1'
+# Magic, die definitions hash, colors in index order, max per color, then the cutoff window:
+# triumph max, success range, advantage range, despair max.
+_HEADER = struct.Struct('<8s16s8sHbbbbbb')
+_DATA_OFFSET = 64
+
+# Force dice add nothing to the statistics the table stores, so they are not one of its colors
+# and pools are looked up without them.
+COLORS = ''.join(dice_color.name for dice_color in DiceColor if dice_color is not DiceColor.w)
+
+
+class TableLayout:
+    """Shape of a table: which pools it covers and which cutoffs it stores."""
+
+    def __init__(self,
+                 max_per_color: int = 6,
+                 triumph_max: int = 1,
+                 success_range: Tuple[int, int] = (-3, 3),
+                 advantage_range: Tuple[int, int] = (-3, 3),
+                 despair_max: int = 1,
+                 colors: str = COLORS):
+        self.max_per_color = max_per_color
+        self.triumph_max = triumph_max
+        self.success_range = tuple(success_range)
+        self.advantage_range = tuple(advantage_range)
+        self.despair_max = despair_max
+        self.colors = colors
+
+        # The cutoffs stored along each axis, where None means "don't care".
+        self.cutoffs = (
+            [None] + list(range(1, triumph_max + 1)),
+            [None] + list(range(success_range[0], success_range[1] + 1)),
+            [None] + list(range(advantage_range[0], advantage_range[1] + 1)),
+            [None] + list(range(1, despair_max + 1)),
+        )
+        self.window_shape = tuple(len(cutoffs) for cutoffs in self.cutoffs)
+        self.num_pools = (max_per_color + 1) ** len(colors)
+
+    def pool_index(self, pool_string: str) -> Optional[int]:
+        """Return the index of the pool in the table, or None if the table does not cover it."""
+        color_counts = collections.Counter(pool_string)
+        del color_counts[DiceColor.w.name]
+        index = 0
+        for color in self.colors:
+            count = color_counts.pop(color, 0)
+            if count > self.max_per_color:
+                return None
+            index = index * (self.max_per_color + 1) + count
+        if color_counts:
+            return None
+        return index
+
+    def window_index(self, cutoff: Sequence[Optional[int]]) -> Optional[Tuple[int, ...]]:
+        """Return the index of the cutoffs in the window, or None if they are not stored."""
+        index = []
+        for axis, cut in enumerate(cutoff):
+            # Triumph and despair are never negative, so a cutoff of 0 or less is no cutoff.
+            if cut is not None and axis in (0, 3) and cut <= 0:
+                cut = None
+            try:
+                index.append(self.cutoffs[axis].index(cut))
+            except ValueError:
+                return None
+        return tuple(index)
+
+    def pack_header(self) -> bytes:
+        return _HEADER.pack(_MAGIC, dice_definitions_hash().encode(), self.colors.encode(),
+                            self.max_per_color, self.triumph_max,
+                            self.success_range[0], self.success_range[1],
+                            self.advantage_range[0], self.advantage_range[1],
+                            self.despair_max)
+
+    @classmethod
+    def unpack_header(cls, header: bytes) -> 'TableLayout':
+        (magic, version, colors, max_per_color, triumph_max, success_low, success_high,
+         advantage_low, advantage_high, despair_max) = _HEADER.unpack(header[:_HEADER.size])
+        if magic != _MAGIC:
+            raise ValueError('Not a pool table.')
+        if version.decode() != dice_definitions_hash():
+            raise ValueError('Pool table was built for different dice definitions.')
+        return cls(max_per_color, triumph_max, (success_low, success_high),
+                   (advantage_low, advantage_high), despair_max, colors.rstrip(b'\0').decode())
+
+    def arrays(self, path: str, mode: str) -> Tuple[numpy.memmap, numpy.memmap]:
+        """Memory-map the means and probabilities of a table file."""
+        means = numpy.memmap(path, dtype='<f8', mode=mode, offset=_DATA_OFFSET,
+                             shape=(self.num_pools, 4))
+        probabilities = numpy.memmap(path, dtype='<f8', mode=mode,
+                                     offset=_DATA_OFFSET + means.nbytes,
+                                     shape=(self.num_pools,) + self.window_shape)
+        return means, probabilities
+
+    def file_size(self) -> int:
+        return _DATA_OFFSET + 8 * self.num_pools * (4 + int(numpy.prod(self.window_shape)))
+
+
+class PoolTable:
+    """Read-only lookup of pool statistics from a table file written by :func:`generate`."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.layout = TableLayout.unpack_header(f.read(_HEADER.size))
+        self._means, self._probabilities = self.layout.arrays(path, 'r')
+
+    def __contains__(self, pool_string: str) -> bool:
+        return self.layout.pool_index(pool_string) is not None
+
+    def mean(self, pool_string: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+        index = None if pool_string is None else self.layout.pool_index(pool_string)
+        if index is None:
+            return None
+        return tuple(float(m) for m in self._means[index])
+
+    def probability_above(self, pool_string: Optional[str],
+                          cutoff: Sequence[Optional[int]]) -> Optional[float]:
+        """Return the probability, or None if the pool or cutoffs are not in the table."""
+        index = None if pool_string is None else self.layout.pool_index(pool_string)
+        window_index = self.layout.window_index(cutoff)
+        if index is None or window_index is None:
+            return None
+        return float(self._probabilities[(index,) + window_index])
+
+
+def use_pool_table(path: str) -> PoolTable:
+    """Answer DicePool.mean() and probability_above() from a table file when it covers the
+    query."""
+    dice.pool_table = PoolTable(path)
+    return dice.pool_table
+
+
+def _window(distribution: QuadDistribution, layout: TableLayout) -> numpy.ndarray:
+    """Return the probabilities of every cutoff combination of the window."""
+    # Pad every axis with a zero, where cutoffs above the largest outcome end up.
+    survival = numpy.pad(distribution.survival(), [(0, 1)] * 4)
+    indices = []
+    for cutoffs, offset, size in zip(layout.cutoffs, distribution.offset,
+                                     distribution.shape):
+        indices.append([0 if cut is None else min(max(cut - offset, 0), size)
+                        for cut in cutoffs])
+    return survival[numpy.ix_(*indices)] / survival[0, 0, 0, 0]
+
+
+def _fill_block(path: str, layout: TableLayout, prefix: Tuple[int, ...]) -> None:
+    """Compute every pool whose counts of the first colors are ``prefix``."""
+    die_distributions = [DiceColor[color].value().distribution.normalized()
+                         for color in layout.colors]
+    means, probabilities = layout.arrays(path, 'r+')
+
+    base = QuadDistribution()
+    for die_distribution, count in zip(die_distributions, prefix):
+        base = base.add(die_distribution.power(count))
+
+    def visit(distribution: QuadDistribution, depth: int, index: int) -> None:
+        if depth == len(layout.colors):
+            means[index] = distribution.mean()
+            probabilities[index] = _window(distribution, layout)
+            return
+        for count in range(layout.max_per_color + 1):
+            if count > 0:
+                distribution = distribution.add(die_distributions[depth])
+            visit(distribution, depth + 1, index * (layout.max_per_color + 1) + count)
+
+    prefix_index = 0
+    for count in prefix:
+        prefix_index = prefix_index * (layout.max_per_color + 1) + count
+    visit(base, len(prefix), prefix_index)
+    means.flush()
+    probabilities.flush()
+
+
+def generate(path: str, layout: TableLayout = None, workers: int = None) -> None:
+    """Compute every pool of ``layout`` in parallel and write the table to ``path``.
+
+    The table is written to a temporary file next to ``path`` and renamed into place once
+    complete.
+    """
+    if layout is None:
+        layout = TableLayout()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(layout.pack_header())
+            f.truncate(layout.file_size())
+
+        # Split the work on the counts of the first two colors, giving each worker process a
+        # contiguous block of the file to fill.
+        prefixes = itertools.product(range(layout.max_per_color + 1), repeat=2)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_fill_block, temp_path, layout, prefix)
+                       for prefix in prefixes]
+            for future in futures:
+                future.result()
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def pools(layout: TableLayout) -> Iterable[str]:
+    """Yield every pool string covered by the table, in index order."""
+    for counts in itertools.product(range(layout.max_per_color + 1), repeat=len(layout.colors)):
+        yield ''.join(color * count for color, count in zip(layout.colors, counts))
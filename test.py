@@ -2,12 +2,37 @@
 
 """eote-dice tests."""
 
+import argparse
+import asyncio
+import collections
+from fractions import Fraction
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 from unittest import mock
 
-from dice import (AbilityDice, BoostDice, ChallengeDice, dice_from_color_char, DicePool,
-                  DifficultyDice, ProficiencyDice, SetbackDice, Side, Symbol)
-from distribution import QuadDistribution
+import numpy
+
+import benchmark
+from cache import DiskCache, DistributionCache
+import dice
+from dice import (AbilityDice, BoostDice, ChallengeDice, Dice, dice_from_color_char, DicePool,
+                  DifficultyDice, distribution_cache, ForceDice, ProficiencyDice, SetbackDice,
+                  Side, Symbol)
+from distribution import DictQuadDistribution, QuadDistribution
+from eote_dice import grid_answer, main, parse_grid, run_batch
+import optimize
+import rolls
+import server
+import simulation
+import sweep
+import table
 
 
 class SideTestCase(unittest.TestCase):
@@ -18,6 +43,24 @@ class SideTestCase(unittest.TestCase):
         self.assertEqual(side.count_symbol(Symbol.Success), 0)
         self.assertEqual(side.count_symbol(Symbol.Advantage), 0)
 
+    def test_net(self):
+        side = Side(symbols=[Symbol.Triumph, Symbol.Failure, Symbol.Threat, Symbol.Threat])
+        self.assertEqual(side.symbol_counts, (1, 0, 0, 0, 1, 2, 0, 0))
+        self.assertEqual(side.net, (1, 0, -2, 0))
+        self.assertEqual(side.outcome, (1, 0, -2, 0, 0, 0))
+
+    def test_force_outcome(self):
+        side = Side(symbols=[Symbol.Light, Symbol.Light])
+        self.assertEqual(side.net, (0, 0, 0, 0))
+        self.assertEqual(side.outcome, (0, 0, 0, 0, 2, 0))
+
+    def test_immutable(self):
+        side = Side(symbols=[Symbol.Success])
+        with self.assertRaises(AttributeError):
+            side.symbols = ()
+        with self.assertRaises(AttributeError):
+            side.extra = 1
+
 
 class DiceFromColorTestCase(unittest.TestCase):
     def test_invalid_dice_char(self):
@@ -31,9 +74,26 @@ class DiceFromColorTestCase(unittest.TestCase):
         self.assertIsInstance(dice_from_color_char('k'), SetbackDice)
         self.assertIsInstance(dice_from_color_char('p'), DifficultyDice)
         self.assertIsInstance(dice_from_color_char('r'), ChallengeDice)
+        self.assertIsInstance(dice_from_color_char('w'), ForceDice)
 
 
 class DiceTestCase(unittest.TestCase):
+    def test_shared_instances(self):
+        self.assertIs(ProficiencyDice(), ProficiencyDice())
+        self.assertIs(dice_from_color_char('g'), AbilityDice())
+        self.assertIsNot(AbilityDice(), ProficiencyDice())
+        self.assertIs(AbilityDice().distribution, AbilityDice().distribution)
+        with self.assertRaises(AttributeError):
+            AbilityDice().extra = 1
+
+    def test_custom_dice(self):
+        dice = Dice(sides=[Side(symbols=[]), Side(symbols=[Symbol.Success, Symbol.Triumph])])
+        self.assertIsNot(dice, Dice(sides=[Side(symbols=[])]))
+        self.assertEqual(dice.num_sides(), 2)
+        self.assertEqual(dice.distribution.to_mapping(), {(0, 0, 0, 0): 1, (1, 2, 0, 0): 1})
+        with self.assertRaises(TypeError):
+            ProficiencyDice(ProficiencyDice.SIDES)
+
     def test_num_sides(self):
         self.assertEqual(ProficiencyDice().num_sides(), 12)
         self.assertEqual(BoostDice().num_sides(), 6)
@@ -52,6 +112,20 @@ class DiceTestCase(unittest.TestCase):
             self.assertIs(symbols[0], Symbol.Advantage)
             self.assertIs(symbols[1], Symbol.Advantage)
 
+    def test_face_table(self):
+        table = BoostDice().face_table()
+        self.assertEqual(table.shape, (6, 8))
+        self.assertEqual(table[2].tolist(), [0, 0, 2, 0, 0, 0, 0, 0])
+        self.assertEqual(table[4].tolist(), [0, 1, 1, 0, 0, 0, 0, 0])
+
+    def test_force_dice(self):
+        dice = ForceDice()
+        self.assertEqual(dice.num_sides(), 12)
+        self.assertEqual(dice.distribution.to_mapping(), {(0, 0, 0, 0): 12})
+        self.assertEqual(dice.marginal_distribution((4, 5)).to_mapping(),
+                         {(0, 1): 6, (0, 2): 1, (1, 0): 2, (2, 0): 3})
+        self.assertEqual(dice.mean()[4:], (Fraction(2, 3), Fraction(2, 3)))
+
     def test_difficulty_roll(self):
         symbols = DifficultyDice().roll()
         self.assertGreaterEqual(len(symbols), 0)
@@ -99,8 +173,611 @@ class QuadDistributionTestCase(unittest.TestCase):
         self.assertEqual(dice.mean(), (0.0, 0.0, 0.0, 0.0))
         self.assertEqual(dice.probability_above(tuple([1, 0, 0, 0])), 0.0)
 
+    def test_add_matches_reference(self):
+        mapping = {(0, 1, 0, 0): 1, (0, 2, -1, 0): 3, (1, 1, 1, 0): 2, (0, -1, 2, 1): 5}
+        dense = QuadDistribution(mapping)
+        reference = DictQuadDistribution(mapping)
+        for _ in range(4):
+            dense = dense.add(QuadDistribution(mapping))
+            reference = reference.add(DictQuadDistribution(mapping))
+        self.assertEqual(dense.to_mapping(), reference.to_mapping())
+        self.assertEqual(dense.mean(), reference.mean())
+        self.assertEqual(dense.probability_above((None, 3, 1, None)),
+                         reference.probability_above((None, 3, 1, None)))
+
+    def test_add_fft_matches_direct(self):
+        pool = DicePool.from_string('yggrp')
+        # Both operands have too many outcomes for the direct convolution.
+        squared = pool.distribution.add(pool.distribution)
+        reference = DictQuadDistribution(pool.distribution.to_mapping())
+        self.assertEqual(squared.to_mapping(), reference.add(reference).to_mapping())
+
+    def test_survival(self):
+        mapping = {(0, 1, 0, 0): 1, (0, 2, -1, 0): 3, (1, 1, 1, 0): 2, (0, -1, 2, 1): 5}
+        dense = QuadDistribution(mapping).power(3)
+        reference = DictQuadDistribution(dense.to_mapping())
+        for cutoff in ((None, None, None, None), (1, None, None, None), (None, 2, 0, None),
+                       (0, -10, 10, None), (None, 4, 2, 1), (3, 3, 3, 0)):
+            self.assertEqual(dense.probability_above(cutoff), reference.probability_above(cutoff))
+        self.assertEqual(dense.survival()[0, 0, 0, 0], 11 ** 3)
+        self.assertIs(dense.survival(), dense.survival())
+
+    def test_power(self):
+        dice = QuadDistribution({(0, 1, 0, 0): 1, (0, 0, 1, 0): 2, (1, 1, 0, 0): 1})
+        folded = QuadDistribution()
+        for n in range(0, 7):
+            self.assertEqual(dice.power(n).to_mapping(), folded.to_mapping())
+            folded = folded.add(dice)
+        with self.assertRaises(ValueError):
+            dice.power(-1)
+
+    def test_probability_grid(self):
+        distribution = DicePool.from_string('yygbpr').distribution
+        cutoffs = [None, range(-3, 6), [-2, 0, 7], [0, 1, 2]]
+        grid = distribution.probability_grid(cutoffs)
+        self.assertEqual(grid.shape, (9, 3, 3))
+        for i, success in enumerate(cutoffs[1]):
+            for j, advantage in enumerate(cutoffs[2]):
+                for k, despair in enumerate(cutoffs[3]):
+                    self.assertEqual(grid[i, j, k], distribution.probability_above(
+                        (None, success, advantage, despair)))
+        self.assertEqual(distribution.probability_grid([None] * 4), 1.0)
+
+        big = QuadDistribution({(0, 0, 0, 0): 2 ** 60 + 1, (0, 1, 0, 0): 3})
+        self.assertEqual(big.probability_grid([None, [1], None, None])[0],
+                         big.probability_above((None, 1, None, None)))
+
+    def test_remove(self):
+        for pool_string in ('yygbrppk', 'bbkk', 'yyyrrr'):
+            pool = DicePool.from_string(pool_string).distribution
+            for char in set(pool_string):
+                expected = DicePool.from_string(pool_string.replace(char, '', 1)).distribution
+                removed = pool.remove(dice_from_color_char(char).distribution)
+                self.assertEqual(removed.offset, expected.offset)
+                numpy.testing.assert_array_equal(removed.counts, expected.counts)
+
+    def test_remove_beyond_int64(self):
+        dice = QuadDistribution({(0, 0, 0, 0): 2 ** 40, (0, 1, 0, 0): 1, (1, 1, 0, 0): 3})
+        self.assertEqual(dice.power(3).remove(dice).to_mapping(), dice.power(2).to_mapping())
+
+    def test_remove_one_axis(self):
+        pool = DicePool.from_string('yygp')
+        for axes in ((1,), (0, 1)):
+            removed = pool.marginal_distribution(axes).remove(
+                dice_from_color_char('g').marginal_distribution(axes))
+            self.assertEqual(removed.to_mapping(),
+                             DicePool.from_string('yyp').marginal_distribution(axes).to_mapping())
+
+    def test_remove_not_a_term(self):
+        # The totals divide, but the division leaves a remainder or leftover outcomes.
+        with self.assertRaises(ValueError):
+            QuadDistribution({(0,): 1, (1,): 2, (2,): 1}).remove(
+                QuadDistribution({(0,): 1, (2,): 1}))
+        with self.assertRaises(ValueError):
+            DicePool.from_string('yg').distribution.remove(
+                dice_from_color_char('b').distribution)
+        with self.assertRaises(ValueError):
+            DicePool.from_string('yg').marginal_distribution((1,)).remove(
+                dice_from_color_char('k').marginal_distribution((1,)))
+
+    def test_remove_invalid(self):
+        dice = QuadDistribution({(0, 0, 0, 0): 1, (0, 1, 0, 0): 1})
+        with self.assertRaises(ValueError):
+            dice.power(2).normalized().remove(dice)
+        with self.assertRaises(ValueError):
+            dice.power(2).remove(QuadDistribution({(0, 0, 0, 0): 3}))
+        with self.assertRaises(ValueError):
+            dice.remove(QuadDistribution({(0, 0, 0, 0): 1, (1, 1, 0, 0): 1, (1, 0, 0, 0): 1,
+                                          (0, 1, 0, 0): 1}))
+
+    def test_marginal(self):
+        dice = QuadDistribution({(0, 1, 0, 0): 1, (0, 0, -1, 0): 2, (1, 1, 0, 1): 1})
+        success = dice.marginal([1])
+        self.assertEqual(success.to_mapping(), {(0,): 2, (1,): 2})
+        self.assertEqual(dice.marginal([1, 2]).to_mapping(),
+                         {(1, 0): 2, (0, -1): 2})
+        self.assertEqual(success.power(3).to_mapping(),
+                         dice.power(3).marginal([1]).to_mapping())
+        self.assertEqual(success.mean(), (dice.mean()[1],))
+        self.assertEqual(success.probability_above((1,)), 0.5)
+
+    def test_normalized(self):
+        dice = QuadDistribution({(0, 1, 0, 0): 1, (0, 0, 1, 0): 2, (1, 1, 0, 1): 1})
+        normalized = dice.normalized()
+        self.assertFalse(normalized.exact)
+        self.assertIs(normalized.normalized(), normalized)
+        self.assertEqual(normalized.to_mapping(),
+                         {(0, 1, 0, 0): 0.25, (0, 0, 1, 0): 0.5, (1, 1, 0, 1): 0.25})
+        self.assertEqual(normalized.mean(), dice.mean())
+        self.assertEqual(normalized.probability_above((None, 1, None, None)), 0.5)
+
+        mixed = dice.add(normalized)
+        self.assertFalse(mixed.exact)
+        self.assertAlmostEqual(mixed.probability_above((None, 2, None, None)), 0.25)
+
+    def test_float_matches_exact(self):
+        exact = DicePool.from_string('yyyyyyggggggrrrrrrpppppp', exact=True)
+        approximate = DicePool.from_string('yyyyyyggggggrrrrrrpppppp', exact=False)
+        self.assertTrue(exact.distribution.exact)
+        self.assertFalse(approximate.distribution.exact)
+        numpy.testing.assert_allclose(approximate.distribution.counts,
+                                      exact.distribution.normalized().counts, rtol=0, atol=1e-15)
+        for cutoffs in ({'success_cutoff': 1}, {'success_cutoff': 3, 'advantage_cutoff': -1},
+                        {'triumph_cutoff': 2, 'despair_cutoff': 1}):
+            self.assertAlmostEqual(approximate.probability_above(**cutoffs),
+                                   exact.probability_above(**cutoffs), delta=1e-10)
+        self.assertAlmostEqual(approximate.mean().success, exact.mean().success, delta=1e-10)
+
+    def test_add_exact_beyond_int64(self):
+        distribution = QuadDistribution({(0, 0, 0, 0): 2 ** 40, (0, 1, 0, 0): 2 ** 40})
+        squared = distribution.add(distribution)
+        self.assertEqual(squared.to_mapping(), {(0, 0, 0, 0): 2 ** 80,
+                                                (0, 1, 0, 0): 2 ** 81,
+                                                (0, 2, 0, 0): 2 ** 80})
+        self.assertEqual(squared.probability_above((None, 1, None, None)), 0.75)
+
+    def test_nbytes_of_python_ints(self):
+        distribution = QuadDistribution({(0, 0, 0, 0): 2 ** 70, (0, 1, 0, 0): 2 ** 70})
+        self.assertEqual(distribution.counts.dtype, object)
+        # PyPy's sys.getsizeof() always raises TypeError.
+        with mock.patch('sys.getsizeof', side_effect=TypeError):
+            nbytes = distribution.nbytes
+        # Two cells of an int as large as the 72 bit total.
+        self.assertEqual(nbytes, distribution.counts.nbytes + 2 * (9 + 28))
+
+    def test_sparse_matches_dense(self):
+        # Many dice of one color leave most of the dense array empty.
+        sparse = DicePool.from_string('y' * 12).distribution
+        self.assertTrue(sparse.sparse)
+        dense = QuadDistribution.from_array(sparse.counts, sparse.offset)
+        self.assertFalse(dense.sparse)
+        self.assertLess(sparse.nbytes, dense.nbytes)
+        self.assertEqual(sparse.to_mapping(), dense.to_mapping())
+        self.assertEqual(sparse.mean(), dense.mean())
+        self.assertEqual(sparse.num_outcomes(), dense.num_outcomes())
+        self.assertEqual(sparse.probability_above((1, 4, 2, None)),
+                         dense.probability_above((1, 4, 2, None)))
+        self.assertTrue(dense.compact().sparse)
+        self.assertIs(sparse.compact(), sparse)
+
+        proficiency = dice_from_color_char('y').distribution
+        self.assertEqual(sparse.add(proficiency).to_mapping(),
+                         dense.add(proficiency).to_mapping())
+        self.assertEqual(sparse.normalized().to_mapping(), dense.normalized().to_mapping())
+        numpy.testing.assert_array_equal(sparse.remove(proficiency).counts,
+                                         dense.remove(proficiency).counts)
+
+    def test_sparse_beyond_int64(self):
+        distribution = QuadDistribution({(0, 0, 0, 0): 2 ** 40, (0, 0, 0, 1): 2 ** 40,
+                                         (0, 0, 1, 0): 1, (1, 0, 0, 0): 1})
+        sparse = distribution.power(16)
+        self.assertTrue(sparse.sparse)
+        self.assertEqual(sparse.counts.dtype, object)
+        reference = DictQuadDistribution(distribution.to_mapping())
+        folded = DictQuadDistribution()
+        for _ in range(16):
+            folded = folded.add(reference)
+        self.assertEqual(sparse.to_mapping(), folded.to_mapping())
+
+    def assert_statistics(self, distribution):
+        """Check the statistics of ``distribution`` against its outcomes."""
+        mapping = distribution.to_mapping()
+        total = sum(mapping.values())
+        for axis in range(len(distribution.offset)):
+            frequencies = collections.Counter()
+            for outcome, frequency in mapping.items():
+                frequencies[outcome[axis]] += frequency
+            values, probabilities = distribution.histogram(axis)
+            self.assertEqual(values[0], min(frequencies))
+            self.assertEqual(values[-1], max(frequencies))
+            numpy.testing.assert_allclose(probabilities,
+                                          [frequencies[value] / total for value in values])
+            cdf_values, cdf = distribution.cdf(axis)
+            numpy.testing.assert_array_equal(cdf_values, values)
+            numpy.testing.assert_allclose(cdf, numpy.cumsum(probabilities))
+            self.assertAlmostEqual(cdf[-1], 1.0)
+
+            mean = sum(value * frequency for value, frequency in frequencies.items()) / total
+            variance = sum((value - mean) ** 2 * frequency
+                           for value, frequency in frequencies.items()) / total
+            self.assertAlmostEqual(distribution.variance()[axis], variance)
+            self.assertAlmostEqual(distribution.std()[axis], variance ** 0.5)
+
+            self.assertEqual(distribution.quantile(0.0, axis), values[0])
+            self.assertEqual(distribution.quantile(1.0, axis), values[-1])
+            for q in (0.1, 0.5, 0.9):
+                self.assertEqual(distribution.quantile(q, axis),
+                                 min(value for value, p in zip(values, cdf) if p >= q))
+
+        outcomes, probabilities = distribution.most_likely(3)
+        ranked = sorted(mapping.items(), key=lambda item: -item[1])
+        self.assertEqual([tuple(outcome) for outcome in outcomes],
+                         [outcome for outcome, _ in ranked[:3]])
+        numpy.testing.assert_allclose(probabilities,
+                                      [frequency / total for _, frequency in ranked[:3]])
+
+    def test_statistics(self):
+        distribution = DicePool.from_string('yygprk').distribution
+        self.assert_statistics(distribution)
+        self.assert_statistics(distribution.normalized())
+        self.assert_statistics(distribution.marginal([1, 2]))
+        sparse = dice_from_color_char('y').distribution.power(16)
+        self.assertTrue(sparse.sparse)
+        self.assert_statistics(sparse)
+        self.assertIsInstance(sparse.variance(), numpy.ndarray)
+        self.assertIsInstance(sparse.std(), numpy.ndarray)
+        numpy.testing.assert_array_equal(sparse.variance(), sparse.compact().variance())
+
+        numpy.testing.assert_array_equal(distribution.quantile([0.25, 0.75], 1),
+                                         [distribution.quantile(0.25, 1),
+                                          distribution.quantile(0.75, 1)])
+        with self.assertRaises(ValueError):
+            distribution.quantile(1.5, 1)
+
+
+class DistributionCacheTestCase(unittest.TestCase):
+    def test_get_put(self):
+        cache = DistributionCache()
+        self.assertIsNone(cache.get('yg'))
+        distribution = QuadDistribution()
+        cache.put('yg', distribution)
+        self.assertIs(cache.get('yg'), distribution)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evicts_least_recently_used(self):
+        distribution = QuadDistribution()
+        cache = DistributionCache(max_bytes=2 * distribution.nbytes)
+        cache.put('y', distribution)
+        cache.put('g', distribution)
+        cache.get('y')
+        cache.put('b', distribution)
+        self.assertIn('y', cache)
+        self.assertNotIn('g', cache)
+        self.assertIn('b', cache)
+        self.assertEqual(cache.nbytes, 2 * distribution.nbytes)
+
+        cache.resize(0)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_longest_sub_pool(self):
+        cache = DistributionCache()
+        self.assertEqual(cache.longest_sub_pool('yygg'), ('', None))
+        for pool_string in ('y', 'yyg', 'yyggg', 'yp'):
+            cache.put(pool_string, QuadDistribution())
+        self.assertEqual(cache.longest_sub_pool('yyggpp')[0], 'yyg')
+
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = DiskCache('v1', self.directory)
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('yg'))
+        distribution = DicePool.from_string('yg').distribution
+        self.cache.put('yg', distribution)
+        cached = self.cache.get('yg')
+        self.assertIsInstance(cached.counts, numpy.memmap)
+        self.assertEqual(cached.to_mapping(), distribution.to_mapping())
+        self.assertEqual(cached.probability_above((None, 2, 1, None)),
+                         distribution.probability_above((None, 2, 1, None)))
+        self.assertIsNone(self.cache.get('yg', exact=False))
+        self.assertIsNone(DiskCache('v2', self.directory).get('yg'))
+
+    def test_float(self):
+        distribution = DicePool.from_string('yg', exact=False).distribution
+        self.cache.put('yg', distribution)
+        self.assertIsNone(self.cache.get('yg'))
+        self.assertEqual(self.cache.get('yg', exact=False).to_mapping(),
+                         distribution.to_mapping())
+
+    def test_skips_bignum_counts(self):
+        self.cache.put('y', QuadDistribution({(0, 0, 0, 0): 2 ** 70}))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_corrupt_file(self):
+        with open(self.cache.path('y'), 'wb') as f:
+            f.write(b'EOTE')
+        self.assertIsNone(self.cache.get('y'))
+        self.assertFalse(os.path.exists(self.cache.path('y')))
+
+    def test_read_only_files(self):
+        distribution = DicePool.from_string('yg').distribution
+        self.cache.put('yg', distribution)
+        with mock.patch('os.utime', side_effect=PermissionError), \
+                mock.patch('os.remove', side_effect=PermissionError):
+            cached = self.cache.get('yg')
+            self.assertEqual(cached.to_mapping(), distribution.to_mapping())
+            with open(self.cache.path('y'), 'wb') as f:
+                f.write(b'EOTE')
+            self.assertIsNone(self.cache.get('y'))
+            self.cache.clear()
+        self.assertTrue(os.path.exists(self.cache.path('yg')))
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('y', QuadDistribution())
+        self.cache.max_bytes = 2 * os.path.getsize(self.cache.path('y'))
+        self.cache.put('g', QuadDistribution())
+        os.utime(self.cache.path('y'), (0, 0))
+        self.cache.put('b', QuadDistribution())
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(os.path.basename(self.cache.path(pool)) for pool in 'bg'))
+
+    def test_dice_pool(self):
+        distribution_cache.clear()
+        with mock.patch('dice.disk_cache', DiskCache('v1', self.directory)):
+            distribution = DicePool.from_string('yygp').distribution
+            distribution_cache.clear()
+            cached_distribution = DicePool.from_string('yygp').distribution
+        self.assertIsInstance(cached_distribution.counts, numpy.memmap)
+        self.assertEqual(cached_distribution.to_mapping(), distribution.to_mapping())
+
+    def test_marginals(self):
+        # Queries on some axes store and read their marginal, under its own file.
+        distribution_cache.clear()
+        with mock.patch('dice.disk_cache', DiskCache('v1', self.directory)):
+            probability = DicePool.from_string('yygp').probability_above(success_cutoff=1,
+                                                                         advantage_cutoff=1)
+            self.assertEqual(os.listdir(self.directory),
+                             [os.path.basename(self.cache.path('yygp', axes=(1, 2)))])
+            distribution_cache.clear()
+            with mock.patch.object(DicePool, '_build_distribution', autospec=True) as build:
+                self.assertEqual(DicePool.from_string('yygp').probability_above(
+                    success_cutoff=1, advantage_cutoff=1), probability)
+                build.assert_not_called()
+
+            # Without its file, a marginal comes from the full distribution on disk.
+            full = DicePool.from_string('yyg').distribution
+            distribution_cache.clear()
+            with mock.patch.object(DicePool, '_build_distribution', autospec=True) as build:
+                marginal = DicePool.from_string('yyg').marginal_distribution([0, 3])
+                build.assert_not_called()
+        self.assertEqual(marginal.to_mapping(), full.marginal([0, 3]).to_mapping())
+        self.assertIsNone(self.cache.get('yygp'))
+        # The full distribution already has it, so it is not stored again.
+        self.assertIsNone(self.cache.get('yyg', axes=(0, 3)))
+
 
 class DicePoolTestCase(unittest.TestCase):
+    def setUp(self):
+        distribution_cache.clear()
+
+    def test_cache_hit(self):
+        pool = DicePool.from_string('gyp')
+        self.assertIs(DicePool.from_string('ypg').distribution, pool.distribution)
+        self.assertEqual((distribution_cache.hits, distribution_cache.misses), (1, 1))
+
+    def test_default_exact(self):
+        with mock.patch.object(DicePool, 'default_exact', False):
+            pool = DicePool.from_string('yg')
+        self.assertFalse(pool.distribution.exact)
+        self.assertTrue(DicePool.from_string('yg').distribution.exact)
+        self.assertEqual(distribution_cache.misses, 2)
+
+    def test_cache_builds_from_sub_pool(self):
+        DicePool.from_string('yygg').distribution
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True,
+                               wraps=DicePool._build_distribution) as build:
+            pool = DicePool.from_string('yyggpp')
+            pool.distribution
+            build.assert_called_once()
+            self.assertEqual(len(build.call_args[0][0]), 2)
+        folded = QuadDistribution()
+        for char in 'yyggpp':
+            folded = folded.add(dice_from_color_char(char).distribution)
+        self.assertEqual(pool.distribution.to_mapping(), folded.to_mapping())
+
+    def test_marginal_distribution(self):
+        pool = DicePool.from_string('yyggbpprk')
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True,
+                               wraps=DicePool._build_distribution) as build:
+            for cutoff in [(None, 1, None, None), (None, 2, -1, None), (1, None, None, 1),
+                           (0, None, 2, 0), (None, None, None, None)]:
+                pool.probability_above(*cutoff)
+            self.assertIsNone(pool._distribution)
+            self.assertEqual([call[0][2] for call in build.call_args_list],
+                             [(1,), (1, 2), (0, 3), (2,)])
+
+        distribution = pool.distribution
+        for cutoff in [(None, 1, None, None), (None, 2, -1, None), (1, None, None, 1),
+                       (0, None, 2, 0), (None, None, None, None)]:
+            self.assertEqual(DicePool.from_string('yyggbpprk').probability_above(*cutoff),
+                             distribution.probability_above(cutoff))
+        self.assertEqual(pool.marginal_distribution([2, 1]).to_mapping(),
+                         distribution.marginal([1, 2]).to_mapping())
+        self.assertIs(DicePool.from_string('yyggbpprk').marginal_distribution([1]),
+                      distribution_cache.get('yyggbrppk', axes=(1,)))
+
+    def test_probability_grid(self):
+        pool = DicePool.from_string('yygbpr')
+        grid = pool.probability_grid(success_cutoffs=range(-2, 4), advantage_cutoffs=[0, 2])
+        self.assertIsNone(pool._distribution)
+        self.assertEqual(grid.shape, (6, 2))
+        for i, success in enumerate(range(-2, 4)):
+            for j, advantage in enumerate([0, 2]):
+                self.assertEqual(grid[i, j], pool.distribution.probability_above(
+                    (None, success, advantage, None)))
+        numpy.testing.assert_array_equal(
+            pool.probability_grid(success_cutoffs=range(-2, 4), advantage_cutoffs=[0, 2]), grid)
+
+    def test_mean_without_distribution(self):
+        pool = DicePool.from_string('yyggbpprk')
+        mean = pool.mean()
+        self.assertIsNone(pool._distribution)
+        self.assertEqual((mean.triumph, mean.success, mean.advantage, mean.despair),
+                         pool.distribution.mean())
+
+    def test_force_pool(self):
+        pool = DicePool.from_string('wygw')
+        self.assertEqual(DicePool._canonical_pool_string(pool.dice), 'ygww')
+        # Force dice add nothing to the net axes, not even a factor to the counts.
+        self.assertEqual(pool.distribution.to_mapping(),
+                         DicePool.from_string('yg').distribution.to_mapping())
+
+        force = DicePool.from_string('ww').marginal_distribution([4, 5])
+        reference = DictQuadDistribution(ForceDice().marginal_distribution((4, 5)).to_mapping())
+        self.assertEqual(force.to_mapping(), reference.add(reference).to_mapping())
+        self.assertEqual(pool.probability_above(light_cutoff=2),
+                         reference.add(reference).probability_above((2, None)))
+        # The Force points are independent of the other axes.
+        self.assertAlmostEqual(pool.probability_above(success_cutoff=1, light_cutoff=2),
+                               pool.probability_above(success_cutoff=1) *
+                               pool.probability_above(light_cutoff=2))
+        self.assertEqual(pool.probability_above(success_cutoff=1, light_cutoff=0),
+                         pool.probability_above(success_cutoff=1))
+        self.assertEqual(pool.probability_grid(dark_cutoffs=[1, 2]).tolist(),
+                         [pool.probability_above(dark_cutoff=1),
+                          pool.probability_above(dark_cutoff=2)])
+
+        mean = pool.mean()
+        self.assertEqual((mean.light, mean.dark), (4 / 3, 4 / 3))
+        pool.distribution
+        self.assertEqual(pool.mean().light, 4 / 3)
+        self.assertEqual(DicePool.from_string('yg').mean().light, 0.0)
+
+        numpy.testing.assert_array_equal(pool.with_added('w').distribution.counts,
+                                         pool.distribution.counts)
+        numpy.testing.assert_array_equal(pool.with_removed('w').distribution.counts,
+                                         pool.distribution.counts)
+
+    def test_statistics(self):
+        pool = DicePool.from_string('yygw')
+        distribution = DicePool.from_string('yygw').distribution
+        variance = pool.variance()
+        self.assertIsInstance(variance, numpy.ndarray)
+        self.assertIsInstance(pool.std(), numpy.ndarray)
+        self.assertEqual(variance.shape, (6,))
+        # Without the pool's distribution, each axis comes from its own marginal.
+        self.assertIsNone(pool._distribution)
+        for axis in range(4):
+            self.assertAlmostEqual(variance[axis], distribution.variance()[axis])
+        self.assertAlmostEqual(variance[4], ForceDice().marginal_distribution((4,)).variance()[0])
+        self.assertAlmostEqual(pool.std()[1], variance[1] ** 0.5)
+
+        for axis in range(4):
+            for statistic in (DicePool.histogram, DicePool.cdf):
+                for marginal, full in zip(statistic(pool, axis), statistic(
+                        DicePool.from_string('yygw'), axis)):
+                    numpy.testing.assert_allclose(marginal, full)
+        values, probabilities = pool.histogram(5)
+        numpy.testing.assert_array_equal(values, [0, 1, 2])
+        numpy.testing.assert_allclose(probabilities, [5 / 12, 1 / 2, 1 / 12])
+        self.assertEqual(pool.quantile(0.5, 5), 1)
+        numpy.testing.assert_array_equal(pool.quantile([0.0, 1.0], 1),
+                                         distribution.quantile([0.0, 1.0], 1))
+
+        outcomes, probabilities = pool.most_likely(2)
+        self.assertEqual(outcomes.shape, (2, 4))
+        self.assertEqual(outcomes.tolist(), distribution.most_likely(2)[0].tolist())
+        with self.assertRaises(ValueError):
+            pool.histogram(6)
+
+    def test_edit_pool(self):
+        pool = DicePool.from_string('yggpr')
+        pool.distribution
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True) as build:
+            edits = [
+                (pool.with_added('b'), 'yggbpr'),
+                (pool.with_added(SetbackDice()), 'yggprk'),
+                (pool.with_removed('g'), 'ygpr'),
+                (pool.upgrade('g'), 'yygpr'),
+                (pool.upgrade('r'), 'yggrr'),
+                (pool.downgrade('y'), 'gggpr'),
+                (pool.with_removed('y').downgrade('y'), 'ggpr'),
+                (pool.with_removed('g').with_removed('g').upgrade('g'), 'ygpr'),
+            ]
+            build.assert_not_called()
+        for edited, pool_string in edits:
+            self.assertEqual(DicePool._canonical_pool_string(edited.dice),
+                             DicePool.canonical_string(pool_string))
+            self.assertIsNotNone(edited._distribution)
+            expected = DicePool.from_string(pool_string).distribution
+            numpy.testing.assert_array_equal(edited.distribution.counts, expected.counts)
+
+    def test_edit_pool_float(self):
+        pool = DicePool.from_string('yggpr', exact=False)
+        pool.distribution
+        edited = pool.upgrade('p')
+        self.assertFalse(edited.distribution.exact)
+        numpy.testing.assert_allclose(
+            edited.distribution.counts,
+            DicePool.from_string('yggrr', exact=True).distribution.normalized().counts,
+            atol=1e-12)
+        added = pool.with_added('b')
+        self.assertEqual(added.probability_above(success_cutoff=1),
+                         added.distribution.probability_above((None, 1, None, None)))
+
+    def test_sensitivity(self):
+        cutoffs = [(None, 1), (1, None, 1, None), (None, None, None, 0)]
+        pool = DicePool.from_string('yygpr')
+        pool.marginal_distribution([0, 1, 2])
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True) as build:
+            changes = pool.sensitivity(cutoffs)
+            build.assert_not_called()
+        self.assertEqual([(change.action, change.color) for change in changes], [
+            ('add', 'b'), ('add', 'g'), ('remove', 'g'), ('add', 'y'), ('remove', 'y'),
+            ('add', 'k'), ('add', 'p'), ('remove', 'p'), ('add', 'r'), ('remove', 'r'),
+            ('upgrade', 'g'), ('upgrade', 'p')])
+
+        base_mean = pool.distribution.mean()
+        for change in changes:
+            changed = DicePool.from_string(change.pool)
+            for delta, mean, base in zip(change.mean, changed.distribution.mean(), base_mean):
+                self.assertAlmostEqual(delta, mean - base)
+            for delta, cutoff in zip(change.probability_above, cutoffs):
+                self.assertAlmostEqual(delta, changed.probability_above(*cutoff) -
+                                       pool.probability_above(*cutoff))
+        self.assertEqual(changes[-2].pool, 'yyyrp')
+        self.assertEqual(changes[-1].probability_above[2], 0.0)
+
+        float_changes = DicePool.from_string('yygpr', exact=False).sensitivity(cutoffs)
+        for change, float_change in zip(changes, float_changes):
+            self.assertEqual(change.pool, float_change.pool)
+            numpy.testing.assert_allclose(float_change.probability_above,
+                                          change.probability_above, atol=1e-12)
+        self.assertEqual(DicePool.from_string('b').sensitivity()[-1],
+                         ('upgrade', 'p', 'bp', (0.0, -0.5, -0.75, 0.0), ()))
+
+    def assert_sensitivity_matches_rebuilt(self, pool_string, cutoff):
+        pool = DicePool.from_string(pool_string)
+        for change in pool.sensitivity([cutoff]):
+            distribution_cache.clear()
+            self.assertAlmostEqual(change.probability_above[0],
+                                   DicePool.from_string(change.pool).probability_above(*cutoff) -
+                                   DicePool.from_string(pool_string).probability_above(*cutoff))
+
+    def test_sensitivity_one_axis(self):
+        self.assert_sensitivity_matches_rebuilt('yg', (None, 1))
+        self.assert_sensitivity_matches_rebuilt('yygpr', (None, None, 2))
+
+    def test_sensitivity_triumph_despair(self):
+        # Ability and boost dice add nothing to these axes, so they are not in the marginal.
+        self.assert_sensitivity_matches_rebuilt('yrgb', (1, None, None, 1))
+        changes = {(change.action, change.color): change.probability_above[0]
+                   for change in DicePool.from_string('yrgb').sensitivity([(1, None, None, 1)])}
+        self.assertEqual(changes['remove', 'b'], 0.0)
+        self.assertGreater(changes['upgrade', 'g'], 0.0)
+
+    def test_edit_pool_invalid(self):
+        pool = DicePool.from_string('yg')
+        with self.assertRaises(ValueError):
+            pool.with_removed('p')
+        with self.assertRaises(ValueError):
+            pool.upgrade('b')
+        with self.assertRaises(ValueError):
+            pool.with_added('x')
+
+    def test_custom_dice_pool(self):
+        success = Dice(sides=[Side(symbols=[Symbol.Success])])
+        threat = Dice(sides=[Side(symbols=[Symbol.Threat])])
+        pool = DicePool([success, threat])
+        self.assertEqual(pool.distribution.to_mapping(), {(0, 1, -1, 0): 1})
+        self.assertEqual(pool.probability_above(advantage_cutoff=0), 0.0)
+        self.assertEqual(pool.mean().success, 1.0)
+
     def test_from_string_1(self):
         pool = DicePool.from_string('ygk')
         self.assertEqual(str(pool),
@@ -111,6 +788,14 @@ class DicePoolTestCase(unittest.TestCase):
         self.assertEqual(str(pool),
                          '\x1b[1m\x1b[36mb\x1b[0m\x1b[1m\x1b[31mr\x1b[0m\x1b[1m\x1b[35mp\x1b[0m')
 
+    def test_from_string_matches_folding(self):
+        pool_string = 'yyyyyyggbrrpppppppk'
+        folded = QuadDistribution()
+        for char in pool_string:
+            folded = folded.add(dice_from_color_char(char).distribution)
+        self.assertEqual(DicePool.from_string(pool_string).distribution.to_mapping(),
+                         folded.to_mapping())
+
     def test_invalid_from_string(self):
         with self.assertRaises(ValueError):
             DicePool.from_string('yyx')
@@ -204,10 +889,569 @@ class DicePoolTestCase(unittest.TestCase):
             self.assertEqual(symbols, '\x1b[1m\x1b[35mf\x1b[0m\x1b[30m\x1b[47mr\x1b[0m')
             self.assertEqual(cancelled_symbols, '\x1b[1m\x1b[35mf\x1b[0m\x1b[30m\x1b[47mr\x1b[0m')
 
+    def test_roll_many(self):
+        pool = DicePool.from_string('yygbrpk')
+        net, raw = pool.roll_many(10000, rng=numpy.random.default_rng(1), raw=True)
+        self.assertEqual(net.shape, (10000, 4))
+        self.assertEqual(raw.shape, (10000, len(Symbol)))
+        self.assertEqual(net.tolist(),
+                         pool.roll_many(10000, rng=numpy.random.default_rng(1)).tolist())
+
+        # Every roll is a possible outcome of the pool.
+        outcomes = pool.distribution.to_mapping()
+        for row in numpy.unique(net, axis=0):
+            self.assertIn(tuple(row), outcomes)
+        self.assertTrue(numpy.all(raw[:, 0] <= 2))
+        self.assertTrue(numpy.all(net[:, 1] == raw[:, 0] + raw[:, 1] - raw[:, 3] - raw[:, 4]))
+        numpy.testing.assert_allclose(net.mean(axis=0), pool.distribution.mean(), atol=0.1)
+
+    def test_roll_many_boost(self):
+        net = DicePool([BoostDice()]).roll_many(1000)
+        self.assertTrue(numpy.all(net >= 0))
+        self.assertTrue(numpy.all(net[:, 1] <= 1))
+        self.assertTrue(numpy.all(net[:, 2] <= 2))
+
+    def test_roll_imports_lazily(self):
+        # Rolling needs neither numpy nor the distributions, and only printing needs colorama.
+        code = ('import sys, eote_dice\n'
+                'eote_dice.DicePool.from_string("yg").roll()\n'
+                'print(" ".join(m for m in ("numpy", "distribution", "colorama")\n'
+                '               if m in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         universal_newlines=True)
+        self.assertEqual(output.strip(), '')
+
+    def test_ansi_colors_import_lazily(self):
+        code = ('import sys, dice\n'
+                'before = "colorama" in sys.modules\n'
+                'from dice import dice_color_to_ansi, symbol_to_ansi\n'
+                'print(before, symbol_to_ansi[dice.Symbol.Success] == "\\x1b[32m",\n'
+                '      dice_color_to_ansi[dice.DiceColor.y] == "\\x1b[33m")')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         universal_newlines=True)
+        self.assertEqual(output.split(), ['False', 'True', 'True'])
+        with self.assertRaises(AttributeError):
+            dice.no_such_attribute
+
     def test_str(self):
         self.assertEqual(str(DicePool([ProficiencyDice(), AbilityDice(), SetbackDice()])),
                          '\x1b[1m\x1b[33my\x1b[0m\x1b[1m\x1b[32mg\x1b[0m\x1b[30m\x1b[47mk\x1b[0m')
 
 
+class CommandLineTestCase(unittest.TestCase):
+    def run_main(self, *arguments):
+        with mock.patch('sys.argv', ['eote_dice'] + list(arguments)), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            main()
+        return stdout.getvalue()
+
+    def test_sensitivity(self):
+        output = self.run_main('--pool', 'yygpr', 'analyze', '--sensitivity', '--success-cutoff=1')
+        self.assertIn('Sensitivity:', output)
+        self.assertIn('upgrade g', output)
+        self.assertIn('Success: 1', output)
+        self.assertIn('remove  b', self.run_main('--pool', 'yrgb', 'analyze', '--sensitivity',
+                                                 '-t', '1', '-d', '1'))
+
+    def test_count_requires_roll(self):
+        for arguments in (('--pool', 'yg', '--count', '3'),
+                          ('--pool', 'yg', '--roll', '--count', '3', 'analyze')):
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr, \
+                    self.assertRaises(SystemExit) as raised:
+                self.run_main(*arguments)
+            self.assertEqual(raised.exception.code, 2)
+            self.assertIn('-n/--count', stderr.getvalue())
+
+    def test_simulation(self):
+        output = self.run_main('--pool', 'yygp', 'analyze', '--simulate', '1000', '--seed', '3',
+                               '--success-cutoff=1')
+        self.assertIn('1000 rolls with --seed 3', output)
+        self.assertIn('Probability Above:', output)
+        self.assertEqual(output, self.run_main('--pool', 'yygp', 'analyze', '--simulate', '1000',
+                                               '--seed', '3', '--success-cutoff=1'))
+        self.assertIn('does not roll Force points',
+                      self.run_main('--pool', 'yw', 'analyze', '--simulate', '10',
+                                    '--light-cutoff=1'))
+
+    def test_monte_carlo(self):
+        output = self.run_main('--pool', 'yygp', 'analyze', '--monte-carlo', '--time-budget', '0',
+                               '--seed', '0', '--success-cutoff=1')
+        self.assertIn('Monte Carlo:', output)
+        self.assertIn('Probability Above:', output)
+        self.assertIn('Exact:', output)
+        self.assertIn('does not estimate Force points',
+                      self.run_main('--pool', 'yw', 'analyze', '--monte-carlo',
+                                    '--dark-cutoff=1'))
+
+
+class BatchTestCase(unittest.TestCase):
+    def test_run_batch(self):
+        lines = ['{"pool": "b", "success_cutoff": 1, "advantage_cutoff": 1}',
+                 '',
+                 '{"pool": "bx"}',
+                 '{"pool": "b", "distribution": true}']
+        output = io.StringIO()
+        run_batch(lines, output)
+        answers = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len(answers), 3)
+        self.assertEqual(answers[0]['probability_above'], 1/6)
+        self.assertEqual(answers[0]['mean']['advantage'], 2/3)
+        self.assertNotIn('distribution', answers[0])
+        self.assertIn('error', answers[1])
+        self.assertNotIn('probability_above', answers[2])
+        self.assertIn([0, 1, 1, 0, 1], answers[2]['distribution'])
+        self.assertEqual(sum(value[-1] for value in answers[2]['distribution']), 6)
+        self.assertNotIn('\x1b', output.getvalue())
+
+    def test_run_batch_bad_cutoff(self):
+        lines = ['{"pool": "yygp", "success_cutoff": 1.5}',
+                 '{"pool": "yygp", "advantage_cutoff": true}',
+                 '{"pool": "b", "success_cutoff": 1, "advantage_cutoff": 1}']
+        output = io.StringIO()
+        run_batch(lines, output)
+        answers = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len(answers), 3)
+        self.assertIn('success_cutoff', answers[0]['error'])
+        self.assertIn('advantage_cutoff', answers[1]['error'])
+        self.assertEqual(answers[2]['probability_above'], 1/6)
+
+    def test_run_batch_shares_distribution_cache(self):
+        distribution_cache.clear()
+        output = io.StringIO()
+        run_batch(['{"pool": "yygp", "success_cutoff": 1, "advantage_cutoff": 1}'], output)
+        # Later lines with the same pool reuse the distribution cache, not their own copy.
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True) as build:
+            run_batch(['{"pool": "yygp", "success_cutoff": 1, "advantage_cutoff": 1}'] * 2,
+                      output)
+            build.assert_not_called()
+        answers = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len({answer['probability_above'] for answer in answers}), 1)
+
+    def test_grid_answer(self):
+        args = argparse.Namespace(pool='yygpr', grid=[parse_grid('advantage=-1:1'),
+                                                      parse_grid('success=0:3')],
+                                  triumph_cutoff=1, success_cutoff=None, advantage_cutoff=None,
+                                  despair_cutoff=0, light_cutoff=None, dark_cutoff=None)
+        answer = json.loads(json.dumps(grid_answer(DicePool.from_string(args.pool), args)))
+        self.assertEqual(answer['axes'], ['success', 'advantage'])
+        self.assertEqual(answer['cutoffs'], {'success': [0, 1, 2, 3], 'advantage': [-1, 0, 1]})
+        self.assertEqual(answer['fixed_cutoffs'], {'triumph': 1, 'despair': 0})
+        pool = DicePool.from_string('yygpr')
+        for i, success in enumerate(range(0, 4)):
+            for j, advantage in enumerate(range(-1, 2)):
+                self.assertEqual(answer['probability_above'][i][j],
+                                 pool.probability_above(1, success, advantage, 0))
+
+        args.pool, args.grid, args.dark_cutoff = 'yyww', [parse_grid('light=0:4')], 1
+        answer = grid_answer(DicePool.from_string(args.pool), args)
+        self.assertEqual(answer['fixed_cutoffs'], {'triumph': 1, 'despair': 0, 'dark': 1})
+        pool = DicePool.from_string('yyww')
+        self.assertEqual(answer['probability_above'],
+                         [pool.probability_above(1, None, None, 0, light, 1)
+                          for light in range(0, 5)])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_grid('success=1')
+
+
+class ServerTestCase(unittest.TestCase):
+    @staticmethod
+    async def _get(port: int, target: str):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(target).encode())
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b'\r\n\r\n', 1)
+        return int(head.split()[1]), json.loads(body.decode())
+
+    def _run(self, *targets):
+        async def run():
+            http_server, analysis_server = await server.start_server('127.0.0.1', 0)
+            port = http_server.sockets[0].getsockname()[1]
+            responses = await asyncio.gather(*(self._get(port, target) for target in targets))
+            http_server.close()
+            await http_server.wait_closed()
+            return responses, analysis_server.stats
+
+        return asyncio.run(run())
+
+    def test_analyze(self):
+        responses, _ = self._run('/analyze?pool=b&success_cutoff=1&advantage_cutoff=1',
+                                 '/probability?pool=b&advantage_cutoff=1',
+                                 '/probability?pool=b',
+                                 '/analyze?pool=x',
+                                 '/nothing')
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(responses[0][1]['probability_above'], 1/6)
+        self.assertEqual(responses[0][1]['mean']['success'], 1/3)
+        self.assertEqual(responses[1], (200, {'pool': 'b', 'probability_above': 1/2}))
+        self.assertEqual(responses[2][0], 400)
+        self.assertEqual(responses[3][0], 400)
+        self.assertEqual(responses[4][0], 404)
+
+    def test_roll(self):
+        responses, _ = self._run('/roll?pool=yb&count=5&seed=3',
+                                 '/roll?pool=yb&count=5&seed=3',
+                                 '/roll?pool=yb&count=0')
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(len(responses[0][1]['rolls']), 5)
+        self.assertEqual(responses[0], responses[1])
+        self.assertEqual(responses[2][0], 400)
+
+    def test_internal_error(self):
+        with mock.patch('server.answer_query', side_effect=IndexError), \
+                mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            responses, stats = self._run('/analyze?pool=b', '/roll?pool=b')
+        self.assertEqual(responses[0], (500, {'error': 'Internal server error.'}))
+        self.assertEqual(responses[1][0], 200)
+        self.assertIn('IndexError', stderr.getvalue())
+        self.assertEqual(stats.errors, 1)
+        self.assertEqual(stats.to_dict()['endpoints']['/analyze']['requests'], 1)
+
+    def test_coalesce(self):
+        build_pool = server._build_pool
+
+        def slow_build_pool(pool_string):
+            time.sleep(0.2)
+            return build_pool(pool_string)
+
+        with mock.patch('server._build_pool', side_effect=slow_build_pool) as build:
+            responses, stats = self._run('/analyze?pool=ygp', '/analyze?pool=pgy')
+            build.assert_called_once_with('ygp')
+        self.assertEqual(responses[0][1]['mean'], responses[1][1]['mean'])
+        self.assertEqual(stats.computations, 1)
+        self.assertEqual(stats.coalesced, 1)
+        self.assertEqual(stats.to_dict()['endpoints']['/analyze']['requests'], 2)
+
+
+class PoolTableTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'pools.tbl')
+        cls.layout = table.TableLayout(max_per_color=1, triumph_max=1, success_range=(-1, 2),
+                                       advantage_range=(0, 1), despair_max=1)
+        table.generate(cls.path, cls.layout, workers=1)
+        cls.table = table.PoolTable(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.table
+        cls.directory.cleanup()
+
+    def test_matches_distribution(self):
+        cutoffs = [(None, None, None, None), (1, None, None, None), (None, -1, 1, None),
+                   (0, 2, 0, 1), (None, None, None, 1)]
+        pool_strings = list(table.pools(self.layout))
+        self.assertEqual(len(pool_strings), 2 ** 6)
+        for pool_string in pool_strings:
+            self.assertIn(pool_string, self.table)
+            distribution = DicePool.from_string(pool_string).distribution
+            for mean, expected in zip(self.table.mean(pool_string), distribution.mean()):
+                self.assertAlmostEqual(mean, expected)
+            for cutoff in cutoffs:
+                self.assertAlmostEqual(self.table.probability_above(pool_string, cutoff),
+                                       distribution.probability_above(cutoff))
+
+    def test_not_covered(self):
+        self.assertNotIn('yy', self.table)
+        self.assertIsNone(self.table.mean('yy'))
+        self.assertIsNone(self.table.probability_above('yy', (None, 1, None, None)))
+        self.assertIsNone(self.table.probability_above('y', (None, 3, None, None)))
+        self.assertIsNone(self.table.probability_above('y', (2, None, None, None)))
+
+    def test_dice_pool(self):
+        with mock.patch('dice.pool_table', self.table), \
+                mock.patch.object(DicePool, '_cached_distribution', autospec=True,
+                                  wraps=DicePool._cached_distribution) as build:
+            pool = DicePool.from_string('ygpr')
+            self.assertAlmostEqual(pool.probability_above(success_cutoff=1), 0.4240451389)
+            self.assertAlmostEqual(pool.mean().triumph, 1/12)
+            build.assert_not_called()
+            pool.probability_above(success_cutoff=3)
+            build.assert_called_once()
+
+    def test_wrong_file(self):
+        path = os.path.join(self.directory.name, 'wrong.tbl')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            table.PoolTable(path)
+
+
+class MonteCarloTestCase(unittest.TestCase):
+    def test_z_score(self):
+        self.assertAlmostEqual(simulation.z_score(0.95), 1.959964, places=5)
+        with self.assertRaises(ValueError):
+            simulation.z_score(1.0)
+
+    def test_converges(self):
+        pool = DicePool.from_string('yygp')
+        result = simulation.monte_carlo(pool, (None, 1, 1, None), precision=0.02,
+                                        rng=numpy.random.default_rng(3))
+        self.assertTrue(result.converged)
+        for estimate in result.mean + (result.probability_above,):
+            self.assertLessEqual(estimate.half_width, 0.02)
+
+        distribution = pool.distribution
+        for exact, fast_exact, estimate in zip(distribution.mean(), result.exact_mean,
+                                               result.mean):
+            self.assertAlmostEqual(fast_exact, exact)
+            self.assertLess(abs(exact - estimate.value), 0.05)
+        self.assertAlmostEqual(result.exact_probability_above,
+                               distribution.probability_above((None, 1, 1, None)))
+        self.assertLess(abs(result.probability_above.value - result.exact_probability_above),
+                        0.05)
+
+    def test_time_budget(self):
+        result = simulation.monte_carlo(DicePool.from_string('yyggpprr'), precision=1e-9,
+                                        time_budget=0.0, batch_size=1000, cross_check=False)
+        self.assertFalse(result.converged)
+        self.assertEqual(result.samples, 1000)
+        self.assertIsNone(result.probability_above)
+        self.assertIsNone(result.exact_mean)
+
+    def test_no_hits(self):
+        # Boost dice never roll a triumph, the interval still has a width.
+        result = simulation.monte_carlo(DicePool.from_string('bb'), (1, None, None, None),
+                                        batch_size=1000, time_budget=0.0,
+                                        rng=numpy.random.default_rng(0))
+        self.assertEqual(result.probability_above.value, 0.0)
+        self.assertGreater(result.probability_above.half_width, 0.0)
+        self.assertEqual(result.exact_probability_above, 0.0)
+        self.assertEqual(simulation.exact_mismatches(result), ())
+
+    def test_exact_cells(self):
+        self.assertEqual(simulation.exact_cells(DicePool.from_string('yygp')),
+                         DicePool.from_string('yygp').distribution.counts.size)
+
+
+class SimulateTestCase(unittest.TestCase):
+    pool = DicePool.from_string('yygbrpk')
+
+    def test_reproducible_across_workers(self):
+        result = simulation.simulate(self.pool, 50000, seed=7, chunk_size=12000)
+        self.assertEqual(result.samples, 50000)
+        self.assertEqual(result.seed, 7)
+        histogram = result.histogram
+        self.assertEqual(sum(histogram.to_mapping().values()), 50000)
+        outcomes = self.pool.distribution.to_mapping()
+        for outcome in histogram.to_mapping():
+            self.assertIn(outcome, outcomes)
+        numpy.testing.assert_allclose(histogram.mean(), self.pool.distribution.mean(),
+                                      atol=0.05)
+
+        # The number of workers does not change any count.
+        parallel = simulation.simulate(self.pool, 50000, seed=7, workers=2, chunk_size=12000)
+        self.assertEqual(parallel.histogram.to_mapping(), histogram.to_mapping())
+        self.assertNotEqual(simulation.simulate(self.pool, 50000, seed=8,
+                                                chunk_size=12000).histogram.to_mapping(),
+                            histogram.to_mapping())
+
+    def test_fresh_seed(self):
+        result = simulation.simulate(self.pool, 1000)
+        self.assertEqual(simulation.simulate(self.pool, 1000, result.seed).histogram.to_mapping(),
+                         result.histogram.to_mapping())
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            simulation.simulate(self.pool, 0)
+        with self.assertRaises(ValueError):
+            simulation.simulate(self.pool, 10, chunk_size=0)
+
+
+class SweepTestCase(unittest.TestCase):
+    cutoffs = [(None, 1, None, None), (None, 1, 2, None), (1, None, None, None)]
+
+    def test_matches_dice_pool(self):
+        ranges = {'g': (0, 2), 'y': (1, 2), 'p': (0, 1)}
+        results = list(sweep.sweep(ranges, self.cutoffs, workers=2))
+        self.assertEqual([result.pool for result in results], sweep.sweep_pools(ranges))
+        self.assertEqual(len(results), 3 * 2 * 2)
+        self.assertEqual(results[0].pool, 'y')
+        for result in results:
+            distribution = DicePool.from_string(result.pool).distribution
+            self.assertEqual(result.mean, distribution.mean())
+            self.assertEqual(result.probabilities,
+                             tuple(distribution.probability_above(cutoff)
+                                   for cutoff in self.cutoffs))
+
+    def test_float(self):
+        result, = sweep.sweep({'y': (3, 3)}, self.cutoffs, exact=False, workers=1)
+        distribution = DicePool.from_string('yyy').distribution
+        for probability, cutoff in zip(result.probabilities, self.cutoffs):
+            self.assertAlmostEqual(probability, distribution.probability_above(cutoff))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            sweep.sweep({'x': (0, 1)})
+        with self.assertRaises(ValueError):
+            sweep.sweep({'g': (2, 1)})
+        with self.assertRaises(ValueError):
+            sweep.parse_cutoff('success=1,foo=2')
+
+    def test_parse_cutoff(self):
+        self.assertEqual(sweep.parse_cutoff('success=1, advantage=-2'), (None, 1, -2, None))
+        self.assertEqual(sweep.format_cutoff((None, 1, -2, None)), 'success>=1,advantage>=-2')
+
+    def test_write(self):
+        results = [sweep.SweepResult('g', (0.0, 0.625, 0.625, 0.0), (0.5,))]
+        cutoffs = [(None, 1, None, None)]
+        output = io.StringIO()
+        sweep.write_csv(results, output, cutoffs)
+        self.assertEqual(output.getvalue(),
+                         'pool,mean_triumph,mean_success,mean_advantage,mean_despair,success>=1\n'
+                         'g,0.0,0.625,0.625,0.0,0.5\n')
+        output = io.StringIO()
+        sweep.write_json(results, output, cutoffs)
+        self.assertEqual(json.loads(output.getvalue())['probability_above'], {'success>=1': 0.5})
+
+
+class RollStreamTestCase(unittest.TestCase):
+    pool = DicePool.from_string('yygbrpkw')
+
+    def test_roll_stream(self):
+        batches = list(self.pool.roll_stream(25, numpy.random.default_rng(1), batch_size=10))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+        # Each batch is one roll_many().
+        rng = numpy.random.default_rng(1)
+        self.assertEqual(numpy.vstack(batches).tolist(),
+                         numpy.vstack([self.pool.roll_many(n, rng, raw=True)[1]
+                                       for n in (10, 10, 5)]).tolist())
+        self.assertEqual(list(self.pool.roll_stream(0)), [])
+        with self.assertRaises(ValueError):
+            list(self.pool.roll_stream(-1))
+
+    def test_cancel_symbol_counts(self):
+        raw = numpy.vstack(list(self.pool.roll_stream(200, numpy.random.default_rng(2))))
+        cancelled = DicePool.cancel_symbol_counts(raw)
+        for raw_counts, cancelled_counts in zip(raw, cancelled):
+            symbols = [symbol for symbol, count in zip(Symbol, raw_counts)
+                       for _ in range(count)]
+            expected = DicePool._cancel_symbols(symbols)
+            self.assertEqual(cancelled_counts.tolist(),
+                             [expected.count(symbol) for symbol in Symbol])
+
+    def write(self, count, format):
+        output = io.BytesIO()
+        rolls.write_rolls(self.pool, count, output, format, numpy.random.default_rng(3),
+                          batch_size=7)
+        return output.getvalue()
+
+    def raw(self, count):
+        """Return the rolls written by write()."""
+        return numpy.vstack(list(self.pool.roll_stream(count, numpy.random.default_rng(3),
+                                                       batch_size=7)))
+
+    def test_text(self):
+        raw = self.raw(20)
+        for format in ('plain', 'color'):
+            lines = self.write(20, format).decode().split('\n')
+            self.assertEqual(lines[-1], '')
+            self.assertEqual(len(lines), 21)
+            for line, raw_counts in zip(lines, raw):
+                symbols = [symbol for symbol, count in zip(Symbol, raw_counts)
+                           for _ in range(count)]
+                cancelled = DicePool._cancel_symbols(symbols)
+                cancelled.sort(key=DicePool._sort_symbol_by_power)
+                if format == 'color':
+                    expected = (DicePool._symbols_to_ascii_(symbols),
+                                DicePool._symbols_to_ascii_(cancelled))
+                else:
+                    expected = (''.join(symbol.value for symbol in symbols),
+                                ''.join(symbol.value for symbol in cancelled))
+                self.assertEqual(line, '\t'.join(expected))
+
+    def test_csv_and_binary(self):
+        lines = self.write(20, 'csv').decode().splitlines()
+        self.assertEqual(lines[0], 'triumph,success,advantage,despair,light,dark')
+        csv_net = [[int(value) for value in line.split(',')] for line in lines[1:]]
+        records = numpy.frombuffer(self.write(20, 'binary'), dtype=rolls.NET_RECORD)
+        self.assertEqual(records.itemsize, 6)
+        self.assertEqual([list(record) for record in records.tolist()], csv_net)
+
+        rng = numpy.random.default_rng(3)
+        net = numpy.vstack([self.pool.roll_many(n, rng) for n in (7, 7, 6)])
+        self.assertEqual([row[:4] for row in csv_net], net.tolist())
+        self.assertEqual([row[4:] for row in csv_net], self.raw(20)[:, 6:].tolist())
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.write(1, 'xml')
+        with self.assertRaises(ValueError):
+            rolls.write_rolls(DicePool.from_string('y' * 64), 1, io.BytesIO(), 'binary')
+        self.assertEqual(self.write(0, 'plain'), b'')
+
+
+class OptimizeTestCase(unittest.TestCase):
+    @staticmethod
+    def _brute_force(fixed, ranges, cutoff, target, at_most):
+        reaching = []
+        for counts in itertools.product(*(range(low, high + 1) for low, high in ranges.values())):
+            pool = DicePool.from_string(
+                fixed + ''.join(color * count for color, count in zip(ranges, counts)))
+            probability = pool.probability_above(*cutoff)
+            if (probability <= target) if at_most else (probability >= target):
+                reaching.append(counts)
+        return sorted(counts for counts in reaching
+                      if not any(other != counts and all(o <= c for o, c in zip(other, counts))
+                                 for other in reaching))
+
+    def test_matches_brute_force(self):
+        for fixed, ranges, cutoff, target, at_most in [
+                ('yyg', {'p': (0, 4), 'r': (0, 3)}, (None, 1), 0.4, True),
+                ('', {'g': (0, 4), 'y': (0, 3)}, (None, 2), 0.5, False),
+                # Difficulty dice can raise the despair probability and lower the success one.
+                ('yg', {'r': (0, 3), 'g': (0, 2), 'k': (1, 3)}, (None, 1, None, 1), 0.05, False),
+                ('ggg', {'b': (0, 2), 'w': (0, 2)}, (None, None, 1, None, 2), 0.3, False),
+                ('y', {'g': (0, 3)}, (None, 1), 0.99, False),
+        ]:
+            results = optimize.optimize(fixed, ranges, cutoff, target, at_most)
+            self.assertEqual(sorted(result.counts for result in results),
+                             self._brute_force(fixed, ranges, cutoff, target, at_most))
+            for result in results:
+                probability = DicePool.from_string(result.pool).probability_above(*cutoff)
+                self.assertEqual(result.probability, probability)
+            self.assertEqual([sum(result.counts) for result in results],
+                             sorted(sum(result.counts) for result in results))
+
+    def test_incremental(self):
+        with mock.patch.object(DicePool, '_build_distribution', autospec=True,
+                               wraps=DicePool._build_distribution) as build:
+            results = optimize.optimize('yyg', {'p': (0, 4), 'r': (0, 3)}, (None, 1), 0.4,
+                                        at_most=True)
+        # Only the fixed dice are built as a pool.
+        self.assertLessEqual(build.call_count, 1)
+        self.assertEqual(results[0].pool, 'yygrrr')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            optimize.optimize('', {'x': (0, 1)}, (None, 1), 0.5)
+        with self.assertRaises(ValueError):
+            optimize.optimize('', {'g': (2, 1)}, (None, 1), 0.5)
+        with self.assertRaises(ValueError):
+            optimize.optimize('', {'g': (0, 1)}, (None, 1), 1.5)
+        with self.assertRaises(ValueError):
+            optimize.optimize('', {'g': (0, 1)}, (0, None, None, 0), 0.5)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_time_per_call(self):
+        calls = []
+        seconds = benchmark.time_per_call(lambda: calls.append(1), min_time=0.001, repeat=2)
+        self.assertGreater(seconds, 0.0)
+        self.assertGreaterEqual(len(calls), 2)
+
+    def test_compare(self):
+        baseline = {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0}, 'gone': {'seconds': 1.0}}
+        results = {'fast': {'seconds': 0.5}, 'slow': {'seconds': 1.5}, 'new': {'seconds': 9.0}}
+        self.assertEqual(benchmark.compare(results, baseline), [('slow', 1.5)])
+        self.assertEqual(benchmark.compare(results, baseline, threshold=2.0), [])
+
+    def test_import_time(self):
+        self.assertGreater(benchmark.import_time('dice'), 0.0)
+
+
 if __name__ == '__main__':
     unittest.main()